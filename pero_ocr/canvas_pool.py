@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def fill_canvas(canvas, img, offset=(0, 0), scale=1.0):
+    """Copy scaled image into a canvas and zero the rest of the canvas.
+    Scaling is done during the copy, so the image is read only once and no temporary arrays are created.
+    :param canvas: target array (H x W x C)
+    :param img: image array (h x w x C), has to fit into the canvas at the offset
+    :param offset: (y, x) position of the image in the canvas
+    :param scale: multiplier of image values, e.g. 1/256 for network input normalization
+    """
+    y, x = offset
+    height, width = img.shape[:2]
+    canvas[:y] = 0
+    canvas[y + height:] = 0
+    canvas[y:y + height, :x] = 0
+    canvas[y:y + height, x + width:] = 0
+    np.multiply(img, scale, out=canvas[y:y + height, x:x + width], casting='unsafe')
+    return canvas
+
+
+class CanvasPool(object):
+    """Preallocated network input canvases reused across calls. Pages of a document mostly lead to the same
+    canvas shapes, so large input buffers are allocated once instead of for every page.
+    Canvases are not cleared, use fill_canvas to initialize them.
+    """
+    def __init__(self, dtype=np.float32, max_canvases=4):
+        """
+        :param dtype: type of the canvases
+        :param max_canvases: number of free canvases kept for reuse, the least recently released are dropped
+        """
+        self.dtype = dtype
+        self.max_canvases = max_canvases
+        self.free_canvases = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, shape):
+        shape = tuple(shape)
+        with self.lock:
+            for i, canvas in enumerate(self.free_canvases):
+                if canvas.shape == shape:
+                    del self.free_canvases[i]
+                    return canvas
+        return np.empty(shape, dtype=self.dtype)
+
+    def release(self, canvas):
+        with self.lock:
+            self.free_canvases.append(canvas)
+            while len(self.free_canvases) > self.max_canvases:
+                self.free_canvases.popleft()
+
+    @contextmanager
+    def canvas(self, shape):
+        """Canvas of given shape returned to the pool at the end of the with block.
+        """
+        canvas = self.acquire(shape)
+        try:
+            yield canvas
+        finally:
+            self.release(canvas)
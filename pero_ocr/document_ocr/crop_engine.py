@@ -1,7 +1,29 @@
 import numpy as np
 import cv2
 from scipy import interpolate, ndimage
-from numba import jit
+
+from pero_ocr import parallel
+
+
+def remap_roi(img, coords):
+    """cv2.remap of an image reading only its region covered by the sampling coordinates.
+    Pixels sampled outside of the image are zero, as with BORDER_CONSTANT on the whole image.
+    :param img: source image
+    :param coords: float32 sampling coordinates (H x W x 2), x and y in source image pixels
+    """
+    x_coords = coords[:, :, 0]
+    y_coords = coords[:, :, 1]
+    # one more pixel on each side for bilinear interpolation
+    x_start = max(0, int(np.floor(x_coords.min())) - 1)
+    x_stop = min(img.shape[1], int(np.floor(x_coords.max())) + 2)
+    y_start = max(0, int(np.floor(y_coords.min())) - 1)
+    y_stop = min(img.shape[0], int(np.floor(y_coords.max())) + 2)
+    if x_start >= x_stop or y_start >= y_stop:
+        return np.zeros(coords.shape[:2] + img.shape[2:], dtype=img.dtype)
+
+    roi = img[y_start:y_stop, x_start:x_stop]
+    return cv2.remap(roi, x_coords - np.float32(x_start), y_coords - np.float32(y_start),
+                     interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
 
 
 class EngineLineCropper(object):
@@ -15,9 +37,7 @@ class EngineLineCropper(object):
     def crop(self, img, baseline, heights, return_mapping=False):
         try:
             line_coords = self.get_crop_inputs(baseline, heights, self.line_height)
-
-            line_crop = cv2.remap(img, line_coords[:, :, 0], line_coords[:, :, 1],
-                                      interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+            line_crop = remap_roi(img, line_coords)
         except:
             print("ERROR: line crop failed.", heights, baseline)
             line_crop = np.zeros([self.line_height, 32, 3], dtype=np.uint8)
@@ -28,6 +48,22 @@ class EngineLineCropper(object):
         else:
             return line_crop
 
+    def crop_lines(self, img, baselines, heights):
+        """Crop all lines of a page. Lines are cropped in threads of the shared executor, as most of the work
+        is in cv2.remap and numpy which release the GIL.
+        :param baselines: list of line baselines
+        :param heights: list of line heights
+        :return: list of line crops, None for lines which failed to crop
+        """
+        def crop_line(line):
+            baseline, line_heights = line
+            try:
+                return remap_roi(img, self.get_crop_inputs(baseline, line_heights, self.line_height))
+            except Exception:
+                return None
+
+        return parallel.get_executor().map(crop_line, list(zip(baselines, heights)), cost=0.001, releases_gil=True)
+
     def blend_in(self, img, line_crop, mapping, offset):
         ystart = offset[0]
         ystop = ystart + mapping.shape[0]
@@ -96,51 +132,55 @@ class EngineLineCropper(object):
 
         return coords
 
-    @jit
     def reverse_line_mapping(self, forward_mapping, sample_positions, sampled_values):
-        backward_mapping = np.zeros_like(sample_positions)
-        forward_position = 0
-        for i in range(sample_positions.shape[0]):
-            while forward_mapping[forward_position] > sample_positions[i]:
-                forward_position += 1
-            d = forward_mapping[forward_position] - forward_mapping[forward_position-1]
-            da = (sample_positions[i] - forward_mapping[forward_position-1]) / d
-            backward_mapping[i] = (1 - da) * sampled_values[forward_position - 1] + da * sampled_values[forward_position]
-        return backward_mapping
-
-    @jit
-    def reverse_xy_mapping(self, forward_mapping, shape):
-
-        y_mapping = forward_mapping[:,:,1]
-        y_mapping = np.clip(cv2.resize(y_mapping, (0,0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR), 0, shape[0]-1)
-        y_mapping = np.round(y_mapping).astype(np.int)
-        ystart = np.round(np.amin(y_mapping)).astype(np.int)
-        ystop = np.round(np.amax(y_mapping)).astype(np.int) + 1
-
-        x_mapping = forward_mapping[:,:,0]
-        x_mapping = np.clip(cv2.resize(x_mapping, (0,0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR), 0, shape[1]-1)
-        x_mapping = np.round(x_mapping).astype(np.int)
-        xstart = np.round(np.amin(x_mapping)).astype(np.int)
-        xstop = np.round(np.amax(x_mapping)).astype(np.int) + 1
-
-        y_map = np.tile(np.arange(0, forward_mapping.shape[0]), (forward_mapping.shape[1], 1)).T.astype(np.float32)
-        y_map = cv2.resize(y_map, (0,0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR)
-        x_map = np.tile(np.arange(0, forward_mapping.shape[1]), (forward_mapping.shape[0], 1)).astype(np.float32)
-        x_map = cv2.resize(x_map, (0,0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR)
-
-        reverse_mapping = np.ones((ystop-ystart, xstop-xstart, 2), dtype=np.float32) * -1
-
-        for sx, sy, dx, dy in zip(x_map.flatten(), y_map.flatten(), x_mapping.flatten(), y_mapping.flatten()):
-            # print(dy, ystart, dx, xstart)
-            reverse_mapping[dy-ystart, dx-xstart, 0] = sx
-            reverse_mapping[dy-ystart, dx-xstart, 1] = sy
-
-        return reverse_mapping, (ystart, xstart)
+        # The original loop interpolated between forward_mapping[forward_position - 1] and
+        # forward_mapping[forward_position], but never advanced from position 0 as forward_mapping starts at 0.
+        # It thus interpolated linearly between the first and the last sampled value, which is kept here,
+        # so that crops stay the same as those the OCR models were trained on.
+        return np.interp(sample_positions, forward_mapping[[0, -1]], sampled_values[[0, -1]])
+
+    def reverse_xy_mapping(self, forward_mapping, shape, upsample=4):
+        """Inverse of a line crop mapping, for every image pixel covered by the line its position in the line crop.
+        The forward mapping is upsampled, so that every covered image pixel is hit by some crop position.
+        :param forward_mapping: crop sampling coordinates (H x W x 2) returned by get_crop_inputs
+        :param shape: shape of the cropped image
+        :param upsample: upsampling factor of the forward mapping
+        :return: reverse mapping of the region of interest covered by the line (-1 where not covered)
+            and (y, x) offset of the region in the image
+        """
+        def upsampled(values):
+            return cv2.resize(values, (0, 0), fx=upsample, fy=upsample, interpolation=cv2.INTER_LINEAR)
+
+        y_mapping = np.round(np.clip(upsampled(forward_mapping[:, :, 1]), 0, shape[0] - 1)).astype(np.int64).ravel()
+        x_mapping = np.round(np.clip(upsampled(forward_mapping[:, :, 0]), 0, shape[1] - 1)).astype(np.int64).ravel()
+        ystart, ystop = y_mapping.min(), y_mapping.max() + 1
+        xstart, xstop = x_mapping.min(), x_mapping.max() + 1
+
+        # crop positions of the upsampled mapping, the maps are separable so only a row and a column are resized
+        height, width = forward_mapping.shape[:2]
+        y_map = cv2.resize(np.arange(height, dtype=np.float32)[:, np.newaxis], (1, height * upsample),
+                           interpolation=cv2.INTER_LINEAR)
+        x_map = cv2.resize(np.arange(width, dtype=np.float32)[np.newaxis, :], (width * upsample, 1),
+                           interpolation=cv2.INTER_LINEAR)
+        y_map = np.broadcast_to(y_map, (height * upsample, width * upsample)).ravel()
+        x_map = np.broadcast_to(x_map, (height * upsample, width * upsample)).ravel()
+
+        # several crop positions may hit the same image pixel, the last one in row-major order is kept
+        roi_width = xstop - xstart
+        flat_positions = (y_mapping - ystart) * roi_width + (x_mapping - xstart)
+        _, last = np.unique(flat_positions[::-1], return_index=True)
+        last = flat_positions.shape[0] - 1 - last
+
+        reverse_mapping = np.full(((ystop - ystart) * roi_width, 2), -1, dtype=np.float32)
+        reverse_mapping[flat_positions[last], 0] = x_map[last]
+        reverse_mapping[flat_positions[last], 1] = y_map[last]
+
+        return reverse_mapping.reshape(ystop - ystart, roi_width, 2), (ystart, xstart)
 
     def get_blend_mask(self, mapping):
         mask = mapping[:,:,0] > -1
         mask = np.pad(mask, ((self.blend_border,self.blend_border), (self.blend_border,self.blend_border)))
-        mask = ndimage.uniform_filter(mask.astype(np.float), size=2*self.blend_border+1)
+        mask = ndimage.uniform_filter(mask.astype(np.float64), size=2*self.blend_border+1)
         mask = mask[self.blend_border:-self.blend_border, self.blend_border:-self.blend_border]
         mask = 2 * np.clip(mask-0.5, 0, 1)
         return mask[:, :, np.newaxis]
@@ -162,7 +202,7 @@ def main():
     plt.subplot(132)
     plt.imshow(back_mapped[410:420, 1200:1240])
     plt.subplot(133)
-    plt.imshow(np.concatenate((mapping, mapping[:,:,:1]), axis=2).astype(np.int)[410:420, 1200:1240])
+    plt.imshow(np.concatenate((mapping, mapping[:,:,:1]), axis=2).astype(int)[410:420, 1200:1240])
     plt.show()
 
 
@@ -0,0 +1,97 @@
+import itertools
+
+import numpy as np
+
+
+# ids of documents seen by all contexts of the process
+_document_ids = itertools.count()
+
+
+class DocumentContext(object):
+    """Priors shared by consecutive pages of a single document (book, newspaper issue). Page parser components
+    read them to skip estimation passes and update them with values observed on each page.
+
+    Invalidation rule: all priors are dropped when a page size differs from the previous page by more than
+    tolerance (relative) in any dimension, as the page probably comes from a different document or scan setup.
+    A page whose text height deviates from the prior by more than tolerance replaces the scale priors
+    (text height, downsample) and drops region templates, which are no longer expected to fit. Region templates
+    are also dropped when more than tolerance of the detected baselines lies outside of them. A page whose
+    rotation differs from the prior by more than rotation_tolerance replaces the rotation prior.
+    """
+    def __init__(self, tolerance=0.2, rotation_tolerance=1.0):
+        """
+        :param tolerance: relative difference of page size and text height still considered the same document
+        :param rotation_tolerance: difference of page rotation in degrees still considered the same document
+        """
+        self.tolerance = tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.page_size = None
+        self.page_count = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self.document_id = next(_document_ids)  # changes whenever the priors are dropped
+        self.text_height = None  # median text height in input image pixels
+        self.downsample = None  # downsample chosen by the line detector
+        self.rotation = None  # dominant baseline rotation in degrees
+        self.region_templates = None  # region polygons of a previous page relative to page size
+
+    def deviates(self, value, prior):
+        return prior is None or abs(value - prior) > self.tolerance * abs(prior)
+
+    def begin_page(self, page_size):
+        """Start a new page, drops all priors when the page does not seem to belong to the document.
+        :param page_size: (height, width) of the page
+        """
+        if self.page_size is not None and any(self.deviates(v, p) for v, p in zip(page_size, self.page_size)):
+            self.invalidate()
+            self.page_count = 0
+        self.page_size = tuple(page_size)
+        self.page_count += 1
+
+    def update_scale(self, text_height, downsample=None):
+        """Record text height and downsample observed on the current page.
+        :param text_height: median text height in input image pixels
+        :param downsample: downsample factor chosen for the page by the line detector
+        """
+        if text_height is None or not np.isfinite(text_height):
+            return
+        if self.text_height is not None and self.deviates(text_height, self.text_height):
+            self.region_templates = None
+        self.text_height = float(text_height)
+        if downsample is not None:
+            self.downsample = downsample
+
+    def rotation_deviates(self, rotation):
+        return self.rotation is None or abs(rotation - self.rotation) > self.rotation_tolerance
+
+    def update_rotation(self, rotation):
+        """Record dominant rotation of the current page, the prior is kept while pages stay within rotation_tolerance.
+        :param rotation: dominant baseline rotation of the page in degrees
+        """
+        if self.rotation_deviates(rotation):
+            self.rotation = rotation
+
+    def update_regions(self, polygons):
+        """Record region polygons of the current page as templates for following pages.
+        :param polygons: list of region polygons in page coordinates
+        """
+        page_scale = np.asarray(self.page_size[::-1], dtype=np.float64)
+        self.region_templates = [np.asarray(polygon, dtype=np.float64) / page_scale for polygon in polygons]
+
+    def get_region_templates(self, page_size=None):
+        """Region templates scaled to page coordinates.
+        :param page_size: (height, width) of the target page, current page size by default
+        """
+        if self.region_templates is None:
+            return None
+        page_size = self.page_size if page_size is None else page_size
+        page_scale = np.asarray(page_size[::-1], dtype=np.float64)
+        return [template * page_scale for template in self.region_templates]
+
+    def check_region_coverage(self, coverage):
+        """Drop region templates when the detected lines do not fit them.
+        :param coverage: fraction of detected baseline points inside of the regions of the current page
+        """
+        if coverage < 1 - self.tolerance:
+            self.region_templates = None
@@ -1,6 +1,7 @@
 import re
 import pickle
 import json
+import struct
 from io import BytesIO
 from datetime import datetime
 
@@ -9,8 +10,6 @@ import lxml.etree as ET
 import cv2
 
 from pero_ocr.ocr_engine.softmax import softmax
-from pero_ocr.document_ocr.crop_engine import EngineLineCropper
-from pero_ocr.force_alignment import force_align
 
 
 def log_softmax(x):
@@ -19,6 +18,8 @@ def log_softmax(x):
 
 
 class TextLine(object):
+    __slots__ = ('id', 'baseline', 'polygon', 'heights', 'transcription', 'logits', 'crop', 'characters')
+
     def __init__(self, id=None, baseline=None, polygon=None, heights=None, transcription=None, logits=None, crop=None, characters=None):
         self.id = id
         self.baseline = baseline
@@ -40,6 +41,8 @@ class TextLine(object):
 
 
 class RegionLayout(object):
+    __slots__ = ('id', 'polygon', 'lines', 'transcription')
+
     def __init__(self, id, polygon):
         self.id = id  # ID string
         self.polygon = polygon  # bounding polygon
@@ -60,6 +63,90 @@ class RegionLayout(object):
         return region_element
 
 
+class PageGeometry(object):
+    """Geometry of all lines of a page stored in contiguous arrays.
+    Line i owns rows baseline_offsets[i]:baseline_offsets[i+1] of baselines (and similarly for polygons)
+    and row i of heights. Bound lines hold views into these arrays, so in-place changes are shared both ways.
+    Lines whose coordinates are reassigned after binding are not tracked; pack the geometry again in that case.
+    """
+    __slots__ = ('lines', 'baselines', 'baseline_offsets', 'polygons', 'polygon_offsets', 'heights')
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.baselines, self.baseline_offsets = pack_coords([line.baseline for line in self.lines], dtype=np.float64)
+        self.polygons, self.polygon_offsets = pack_coords([line.polygon for line in self.lines], dtype=np.float64)
+        self.heights = np.full((len(self.lines), 2), np.nan)
+        for i, line in enumerate(self.lines):
+            if line.heights is not None and len(line.heights) == 2:
+                self.heights[i] = line.heights
+
+    def bind(self):
+        """Replace coordinates of all lines by views into the contiguous arrays.
+        """
+        baselines = unpack_ragged(self.baselines, self.baseline_offsets)
+        polygons = unpack_ragged(self.polygons, self.polygon_offsets)
+        for line, baseline, polygon, heights in zip(self.lines, baselines, polygons, self.heights):
+            if line.baseline is not None:
+                line.baseline = baseline
+            if line.polygon is not None:
+                line.polygon = polygon
+            if line.heights is not None and not np.isnan(heights[0]):
+                line.heights = heights
+        return self
+
+    @property
+    def baseline_lines(self):
+        """Line index of each baseline point."""
+        return np.repeat(np.arange(len(self.lines)), np.diff(self.baseline_offsets))
+
+    @property
+    def polygon_lines(self):
+        """Line index of each polygon point."""
+        return np.repeat(np.arange(len(self.lines)), np.diff(self.polygon_offsets))
+
+    def bounding_boxes(self, use_polygons=True):
+        """Axis aligned bounding boxes of all lines.
+        :param use_polygons: compute boxes of line polygons, baselines otherwise
+        :return: array (lines x 4) of [x_min, y_min, x_max, y_max], NaN for lines without coordinates
+        """
+        if use_polygons:
+            coords, offsets = self.polygons, self.polygon_offsets
+        else:
+            coords, offsets = self.baselines, self.baseline_offsets
+        boxes = np.full((len(self.lines), 4), np.nan)
+        non_empty = offsets[1:] > offsets[:-1]
+        if np.any(non_empty):
+            starts = offsets[:-1][non_empty]
+            boxes[non_empty, :2] = np.minimum.reduceat(coords, starts, axis=0)
+            boxes[non_empty, 2:] = np.maximum.reduceat(coords, starts, axis=0)
+        return boxes
+
+    def rotate(self, rotation, center=(0, 0)):
+        """Rotate baselines and polygons of all lines in place.
+        :param rotation: rotation angle in degrees (same convention as cv2.getRotationMatrix2D)
+        :param center: center of rotation
+        """
+        M = cv2.getRotationMatrix2D(tuple(center), rotation, 1)
+        for coords in [self.baselines, self.polygons]:
+            coords[...] = coords @ M[:, :2].T + M[:, 2]
+        return self
+
+    def draw_baselines(self, img, color=(0, 0, 255), thickness=2):
+        return self._draw(img, self.baselines, self.baseline_offsets, color, False, thickness)
+
+    def draw_polygons(self, img, color=(0, 255, 0), thickness=2):
+        return self._draw(img, self.polygons, self.polygon_offsets, color, True, thickness)
+
+    @staticmethod
+    def _draw(img, coords, offsets, color, close, thickness):
+        non_empty = offsets[1:] > offsets[:-1]
+        if np.any(non_empty):
+            points = np.split(coords.astype(np.int32), offsets[1:-1])
+            points = [p for p, valid in zip(points, non_empty) if valid]
+            cv2.polylines(img, points, close, color, thickness)
+        return img
+
+
 def get_coords_form_page_xml(coords_element, schema):
     if 'points' in coords_element.attrib:
         coords = points_string_to_array(coords_element.attrib['points'])
@@ -191,6 +278,10 @@ class PageLayout(object):
             out_f.write(xml_string)
 
     def to_altoxml_string(self):
+        # numba compiled modules, imported only when needed to keep layout import fast
+        from pero_ocr.document_ocr.crop_engine import EngineLineCropper
+        from pero_ocr.force_alignment import force_align
+
         NSMAP = {"xlink": 'http://www.w3.org/1999/xlink',
                  "xsi": 'http://www.w3.org/2001/XMLSchema-instance'}
         root = ET.Element("alto", nsmap=NSMAP)
@@ -447,6 +538,123 @@ class PageLayout(object):
                 line.logits = logits_dict[line.id]
                 line.characters = characters[line.id]
 
+    def to_binary(self, file_name):
+        """Save page layout in the compact binary format.
+        Regions, lines, baselines, polygons, heights and transcriptions are stored as concatenated arrays
+        with offsets. Logits, crops and characters are not stored (see save_logits).
+        :param file_name: to save into.
+        """
+        regions = self.regions
+        lines = [line for region in regions for line in region.lines]
+
+        line_flags = np.zeros(len(lines), dtype=np.uint8)
+        for i, line in enumerate(lines):
+            line_flags[i] = (LINE_HAS_ID * (line.id is not None)
+                             | LINE_HAS_BASELINE * (line.baseline is not None)
+                             | LINE_HAS_POLYGON * (line.polygon is not None)
+                             | LINE_HAS_HEIGHTS * (line.heights is not None)
+                             | LINE_HAS_TRANSCRIPTION * (line.transcription is not None))
+        region_flags = np.asarray(
+            [REGION_HAS_TRANSCRIPTION * (region.transcription is not None) for region in regions], dtype=np.uint8)
+
+        arrays = dict()
+        arrays['region_flags'] = region_flags
+        arrays['region_polygons'], arrays['region_polygon_offsets'] = pack_coords(
+            [region.polygon for region in regions])
+        arrays['region_line_offsets'] = np.cumsum([0] + [len(region.lines) for region in regions], dtype=np.int64)
+        arrays['region_ids'], arrays['region_id_offsets'] = pack_strings([region.id for region in regions])
+        arrays['region_transcriptions'], arrays['region_transcription_offsets'] = pack_strings(
+            [region.transcription for region in regions])
+
+        arrays['line_flags'] = line_flags
+        arrays['baselines'], arrays['baseline_offsets'] = pack_coords([line.baseline for line in lines])
+        arrays['polygons'], arrays['polygon_offsets'] = pack_coords([line.polygon for line in lines])
+        arrays['heights'], arrays['height_offsets'] = pack_ragged(
+            [np.asarray(line.heights).reshape(-1) if line.heights is not None else None for line in lines])
+        arrays['line_ids'], arrays['line_id_offsets'] = pack_strings([line.id for line in lines])
+        arrays['line_transcriptions'], arrays['line_transcription_offsets'] = pack_strings(
+            [line.transcription for line in lines])
+
+        header = {
+            'version': LAYOUT_BINARY_VERSION,
+            'id': self.id,
+            'page_size': [int(x) for x in self.page_size],
+            'arrays': dict(),
+        }
+        # array offsets are relative to the (aligned) end of the header
+        offset = 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            arrays[name] = array
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset = align_offset(offset + array.nbytes)
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = align_offset(len(LAYOUT_BINARY_MAGIC) + 8 + len(header_bytes))
+        with open(file_name, 'wb') as f:
+            f.write(LAYOUT_BINARY_MAGIC)
+            f.write(struct.pack('<Q', data_start))
+            f.write(header_bytes)
+            for name, array in arrays.items():
+                f.write(b'\0' * (data_start + header['arrays'][name]['offset'] - f.tell()))
+                f.write(array.tobytes())
+
+    def from_binary(self, file_name, mmap=True):
+        """Load page layout saved by to_binary.
+        :param file_name: to load from.
+        :param mmap: memory map the file; line and region coordinates are then copy-on-write views into it.
+        """
+        if mmap:
+            buffer = np.memmap(file_name, dtype=np.uint8, mode='c').view(np.ndarray)
+        else:
+            with open(file_name, 'rb') as f:
+                buffer = np.frombuffer(bytearray(f.read()), dtype=np.uint8)
+
+        magic_end = len(LAYOUT_BINARY_MAGIC)
+        if buffer[:magic_end].tobytes() != LAYOUT_BINARY_MAGIC:
+            raise ValueError(f'File {file_name} is not a binary page layout.')
+        data_start, = struct.unpack('<Q', buffer[magic_end:magic_end + 8].tobytes())
+        header = json.loads(buffer[magic_end + 8:data_start].tobytes().rstrip(b'\0').decode('utf-8'))
+        if header['version'] != LAYOUT_BINARY_VERSION:
+            raise ValueError(f'Unsupported binary page layout version {header["version"]} in {file_name}.')
+
+        arrays = dict()
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            start = data_start + spec['offset']
+            count = int(np.prod(spec['shape']))
+            arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+
+        self.id = header['id']
+        self.page_size = tuple(header['page_size'])
+
+        region_polygons = unpack_ragged(arrays['region_polygons'], arrays['region_polygon_offsets'])
+        region_ids = unpack_strings(arrays['region_ids'], arrays['region_id_offsets'])
+        region_transcriptions = unpack_strings(
+            arrays['region_transcriptions'], arrays['region_transcription_offsets'])
+
+        line_flags = arrays['line_flags']
+        baselines = unpack_ragged(arrays['baselines'], arrays['baseline_offsets'])
+        polygons = unpack_ragged(arrays['polygons'], arrays['polygon_offsets'])
+        heights = unpack_ragged(arrays['heights'], arrays['height_offsets'])
+        line_ids = unpack_strings(arrays['line_ids'], arrays['line_id_offsets'])
+        line_transcriptions = unpack_strings(arrays['line_transcriptions'], arrays['line_transcription_offsets'])
+
+        region_line_offsets = arrays['region_line_offsets']
+        for r, region_flags in enumerate(arrays['region_flags']):
+            region = RegionLayout(region_ids[r], region_polygons[r])
+            if region_flags & REGION_HAS_TRANSCRIPTION:
+                region.transcription = region_transcriptions[r]
+            for l in range(region_line_offsets[r], region_line_offsets[r + 1]):
+                flags = line_flags[l]
+                region.lines.append(TextLine(
+                    id=line_ids[l] if flags & LINE_HAS_ID else None,
+                    baseline=baselines[l] if flags & LINE_HAS_BASELINE else None,
+                    polygon=polygons[l] if flags & LINE_HAS_POLYGON else None,
+                    heights=heights[l].tolist() if flags & LINE_HAS_HEIGHTS else None,
+                    transcription=line_transcriptions[l] if flags & LINE_HAS_TRANSCRIPTION else None))
+            self.regions.append(region)
+
     def render_to_image(self, image, thickness=2, circles=True):
         """Render layout into image.
         :param image: image to render layout into
@@ -468,6 +676,12 @@ class PageLayout(object):
             for l in r.lines:
                 yield l
 
+    def pack_geometry(self):
+        """Store geometry of all lines in contiguous arrays and bind the lines to them.
+        :return: PageGeometry with lines in lines_iterator order
+        """
+        return PageGeometry(self.lines_iterator()).bind()
+
 
 def draw_lines(img, lines, color=(255,0,0), circles=(False, False, False), close=False, thickness=2):
     """Draw a line into image.
@@ -509,6 +723,67 @@ def points_string_to_array(coords):
     return np.asarray(coords)
 
 
+LAYOUT_BINARY_MAGIC = b'PERO-PLB'
+LAYOUT_BINARY_VERSION = 1
+LAYOUT_BINARY_ALIGNMENT = 64
+
+REGION_HAS_TRANSCRIPTION = 1
+
+LINE_HAS_ID = 1
+LINE_HAS_BASELINE = 2
+LINE_HAS_POLYGON = 4
+LINE_HAS_HEIGHTS = 8
+LINE_HAS_TRANSCRIPTION = 16
+
+
+def align_offset(offset, alignment=LAYOUT_BINARY_ALIGNMENT):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def pack_ragged(arrays, dtype=None):
+    """Concatenate arrays along the first axis.
+    :param arrays: list of arrays, None items are stored as empty
+    :param dtype: output dtype, common dtype of all arrays by default
+    :return: concatenated values and offsets of individual arrays (len(arrays) + 1)
+    """
+    present = [array for array in arrays if array is not None]
+    if dtype is None:
+        dtype = np.result_type(*present) if present else np.float64
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(array) if array is not None else 0 for array in arrays])
+    if present:
+        values = np.concatenate(present).astype(dtype, copy=False)
+    else:
+        values = np.zeros(0, dtype=dtype)
+    return values, offsets
+
+
+def unpack_ragged(values, offsets):
+    """Split values concatenated by pack_ragged into a list of views.
+    """
+    return [values[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def pack_coords(coords_list, dtype=None):
+    """Concatenate coordinate arrays (baselines, polygons) into a single (N, 2) array and offsets.
+    """
+    coords_list = [np.asarray(coords).reshape(-1, 2) if coords is not None else None for coords in coords_list]
+    values, offsets = pack_ragged(coords_list, dtype=dtype)
+    return values.reshape(-1, 2), offsets
+
+
+def pack_strings(strings):
+    """Concatenate utf-8 encoded strings into a byte array and offsets. None is stored as empty string.
+    """
+    encoded = [np.frombuffer(s.encode('utf-8'), dtype=np.uint8) if s is not None else None for s in strings]
+    return pack_ragged(encoded, dtype=np.uint8)
+
+
+def unpack_strings(values, offsets):
+    data = values.tobytes()
+    return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
 def find_optimal(logit, positions, idx):
     maximum = -100
     highest = -1
@@ -1,19 +1,16 @@
 import numpy as np
 from os.path import isabs, join, realpath
 
-from multiprocessing import Pool
-from functools import partial
+import shapely
 from scipy import ndimage
 
 from .layout import PageLayout, RegionLayout, TextLine
-from pero_ocr.document_ocr import crop_engine as cropper
-from pero_ocr.ocr_engine import line_ocr_engine
-from pero_ocr.line_engine import baseline_engine
-from pero_ocr.region_engine import region_engine
-from pero_ocr.region_engine import region_engine_splic
-from pero_ocr.region_engine import SimpleThresholdRegion
+from pero_ocr import parallel
 import pero_ocr.line_engine.line_postprocessing as linepp
 
+# engine modules import heavy frameworks (TensorFlow, PyTorch, numba, sklearn),
+# they are imported only by the components which use them
+
 
 def layout_parser_factory(config, config_path=''):
     config = config['LAYOUT_PARSER']
@@ -22,11 +19,16 @@ def layout_parser_factory(config, config_path=''):
     elif config['METHOD'] == 'cnn':
         region_parser = RegionExtractorCNN(config, config_path=config_path)
     elif config['METHOD'] == 'SIMPLE_THRESHOLD_REGION':
+        from pero_ocr.region_engine.simple_threshold_region_engine import SimpleThresholdRegion
         region_parser = SimpleThresholdRegion(config, config_path=config_path)
     elif config['METHOD'] == 'SPLIC':
         region_parser = RegionExtractorSPLIC(config, config_path=config_path)
     else:
         raise ValueError('Unknown layout parser method: {}'.format(config['METHOD']))
+    if config.getboolean('USE_REGION_TEMPLATES', fallback=False):
+        if config.getboolean('KEEP_LINES', fallback=False):
+            raise ValueError('Region templates can not be used with KEEP_LINES, template regions have no lines.')
+        region_parser = RegionTemplateParser(region_parser)
     return region_parser
 
 
@@ -66,6 +68,33 @@ def compose_path(file_path, reference_path):
     return file_path
 
 
+def engine_threads(config):
+    """Per engine thread limits from a component config section, the PAGE_PARSER NUM_THREADS budget
+    is used for engines without them.
+    """
+    return {
+        'intra_op_threads': config.getint('INTRA_OP_THREADS', fallback=None),
+        'inter_op_threads': config.getint('INTER_OP_THREADS', fallback=None)
+    }
+
+
+def document_id(document_context):
+    """Id of the document a page belongs to, None for independent pages.
+    """
+    return document_context.document_id if document_context is not None else None
+
+
+def region_coverage(baseline_list, regions):
+    """Fraction of baseline points inside of the regions.
+    """
+    polygons = [region.polygon for region in regions if len(region.polygon) >= 3]
+    if not baseline_list or not polygons:
+        return 0.0
+    area = shapely.union_all(shapely.make_valid(shapely.polygons(polygons)))
+    points = np.concatenate(baseline_list).astype(np.float64)
+    return float(np.mean(shapely.contains_xy(area, points[:, 0], points[:, 1])))
+
+
 class MissingLogits(Exception):
     pass
 
@@ -74,7 +103,7 @@ class PageDecoder:
     def __init__(self, decoder):
         self.decoder = decoder
 
-    def process_page(self, page_layout: PageLayout):
+    def process_page(self, page_layout: PageLayout, document_context=None):
         for line in page_layout.lines_iterator():
             logits = self.prepare_dense_logits(line)
             line.transcription = self.decoder(logits).best_hyp()
@@ -92,7 +121,7 @@ class WholePageRegion(object):
     def __init__(self, config, config_path=''):
         pass
 
-    def process_page(self, img, page_layout: PageLayout):
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
         corners = np.asarray([
             [0, 0],
             [page_layout.page_size[1], 0],
@@ -103,18 +132,40 @@ class WholePageRegion(object):
         return page_layout
 
 
+class RegionTemplateParser(object):
+    """Layout parser which reuses regions of a previous page of the document and runs the wrapped parser
+    only on the first page and when DocumentContext drops the templates.
+    """
+    def __init__(self, region_parser):
+        self.region_parser = region_parser
+
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
+        templates = document_context.get_region_templates() if document_context is not None else None
+        if templates is None:
+            page_layout = self.region_parser.process_page(img, page_layout, document_context=document_context)
+            if document_context is not None:
+                document_context.update_regions([region.polygon for region in page_layout.regions])
+        else:
+            page_layout.regions = [RegionLayout('r{:03d}'.format(r_num), polygon)
+                                   for r_num, polygon in enumerate(templates)]
+        return page_layout
+
+
 class RegionExtractorCNN(object):
     def __init__(self, config, config_path=''):
         model_path = compose_path(config['MODEL_PATH'], config_path)
         downsample = config.getint('DOWNSAMPLE')
         use_cpu = config.getboolean('USE_CPU')
-        self.region_engine = region_engine.EngineRegionDetector(
+        from pero_ocr.region_engine.region_engine import EngineRegionDetector
+        self.region_engine = EngineRegionDetector(
             model_path=model_path,
             downsample=downsample,
-            use_cpu=use_cpu
+            use_cpu=use_cpu,
+            **engine_threads(config)
         )
 
-    def process_page(self, img, page_layout: PageLayout):
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
+        self.region_engine.embedding_cache.begin_page(document_id(document_context))
         region_list = self.region_engine.detect(img)
         for r_num, region in enumerate(region_list):
             new_region = RegionLayout('r{:03d}'.format(r_num), np.asarray(region))
@@ -129,27 +180,28 @@ class RegionExtractorSPLIC(object):
         use_cpu = config.getboolean('USE_CPU')
         min_size = config.getint('MIN_SIZE')
         self.keep_lines = config.getboolean('KEEP_LINES')
-        self.region_engine = region_engine_splic.EngineRegionSPLIC(
+        from pero_ocr.region_engine.region_engine_splic import EngineRegionSPLIC
+        self.region_engine = EngineRegionSPLIC(
             model_path=model_path,
             downsample=downsample,
             use_cpu=use_cpu,
-            min_size=min_size
+            min_size=min_size,
+            **engine_threads(config)
         )
-        self.pool = Pool()
 
-    def process_page(self, img, page_layout: PageLayout):
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
+        self.region_engine.embedding_cache.begin_page(document_id(document_context))
+        if document_context is not None and document_context.text_height is not None:
+            self.region_engine.adapt_downsample(document_context.text_height)
         polygons_list, baselines_list, heights_list, textlines_list = self.region_engine.detect(img)
+        if document_context is not None:
+            document_context.update_scale(self.region_engine.text_height)
         for id, polygon in enumerate(polygons_list):
             region = RegionLayout('r{:03d}'.format(id), polygon)
             page_layout.regions.append(region)
 
         if self.keep_lines:
-            if len(page_layout.regions) > 4:
-                page_layout.regions = list(self.pool.map(partial(assign_lines_to_region, baselines_list, heights_list, textlines_list),
-                                 page_layout.regions))
-            else:
-                for region in page_layout.regions:
-                    region = assign_lines_to_region(baselines_list, heights_list, textlines_list, region)
+            page_layout.regions = assign_lines_to_regions(baselines_list, heights_list, textlines_list, page_layout.regions)
 
         return page_layout
 
@@ -160,22 +212,33 @@ class LineRefiner(object):
         self.downsample = config.getint('DOWNSAMPLE')
         self.pad = config.getint('PAD')
         self.use_cpu = config.getboolean('USE_CPU')
-        self.line_engine = baseline_engine.EngineLineDetectorCNN(
+        from pero_ocr.line_engine.baseline_engine import EngineLineDetectorCNN
+        self.line_engine = EngineLineDetectorCNN(
             model_path=self.model_path,
             downsample=self.downsample,
             pad=self.pad,
             use_cpu=self.use_cpu,
-            detection_threshold=1
+            detection_threshold=1,
+            tile_size=config.getint('TILE_SIZE', fallback=None),
+            tile_overlap=config.getint('TILE_OVERLAP', fallback=64),
+            **engine_threads(config)
         )
         self.adjust_baselines = config.getboolean('ADJUST_BASELINES')
         self.adjust_heights = config.getboolean('ADJUST_HEIGHTS')
 
-    def process_page(self, img, page_layout: PageLayout):
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
         if not list(page_layout.lines_iterator()):
             print(f"Warning: Skipping line reninement for page {page_layout.id}. No text lines present.")
             return page_layout
 
-        baselines_map, heights_map = self.line_engine.infer_maps(img)
+        # text height of the input layout determines the downsample, so that the CNN usually runs only once,
+        # pages of a document with similar text height start with the refined downsample of previous pages
+        height = np.median([l.heights[0] + l.heights[1] for l in page_layout.lines_iterator()])
+        downsample = linepp.optimal_downsample(height, self.downsample)
+        if document_context is not None and document_context.downsample is not None \
+                and not document_context.deviates(height, document_context.text_height):
+            downsample = document_context.downsample
+        baselines_map, heights_map = self.line_engine.infer_maps(img, downsample)
 
         if self.adjust_baselines:
             baselines = [line.baseline for line in page_layout.lines_iterator()]
@@ -184,45 +247,41 @@ class LineRefiner(object):
                 line.baseline = baseline
 
         if self.adjust_heights:
-            #heights_map = ndimage.morphology.grey_dilation(heights_map, size=(5, 1, 1))
-            for line in page_layout.lines_iterator():
-                baseline = line.baseline / self.downsample
-                sample_points = linepp.resample_baselines([baseline], num_points=40)[0]
-                heights_pred = self.line_engine.get_heights(
-                    heights_map,
-                    (np.round(sample_points[:,1]).astype(np.int), np.round(sample_points[:,0]).astype(np.int)))
-                line.heights = heights_pred * self.downsample
+            self.adjust_line_heights(page_layout, heights_map, downsample)
 
         height = np.median([l.heights[0] + l.heights[1] for l in page_layout.lines_iterator()])
-        if height / self.downsample <= 6 or height / self.downsample > 18:
-            temp_downsample = self.downsample
-            print("ADAPT DOWNAMPLING", img.shape[0:2], self.downsample, height, height / self.downsample)
-            self.downsample = max(1, int(height / 12 + 0.5))
-
-            self.line_engine.downsample = self.downsample
-            baselines_map, heights_map = self.line_engine.infer_maps(img)
-            self.line_engine.downsample = temp_downsample
+        new_downsample = linepp.optimal_downsample(height, downsample)
+        if new_downsample != downsample:
+            print("ADAPT DOWNAMPLING", img.shape[0:2], downsample, height, height / downsample)
+            downsample = new_downsample
+            baselines_map, heights_map = self.line_engine.infer_maps(img, downsample)
             if self.adjust_heights:
-                heights_map = ndimage.morphology.grey_dilation(heights_map, size=(11, 1, 1))
-                for line in page_layout.lines_iterator():
-                    baseline = line.baseline / self.downsample
-                    sample_points = linepp.resample_baselines([baseline], num_points=40)[0]
-                    heights_pred = self.line_engine.get_heights(
-                        heights_map,
-                        (np.round(sample_points[:, 1]).astype(np.int), np.round(sample_points[:, 0]).astype(np.int)))
-                    line.heights = heights_pred * self.downsample
+                self.adjust_line_heights(page_layout, heights_map, downsample)
 
             height = np.median([l.heights[0] + l.heights[1] for l in page_layout.lines_iterator()])
-            print(f"OPTIMAL DOWNAMPLING {img.shape[0] // self.downsample}:{img.shape[1] // self.downsample}",
-                  self.downsample, height, height / self.downsample)
-            self.downsample = temp_downsample
+            print(f"OPTIMAL DOWNAMPLING {img.shape[0] // downsample}:{img.shape[1] // downsample}",
+                  downsample, height, height / downsample)
 
+        if document_context is not None:
+            document_context.update_scale(height, downsample)
 
         for line in page_layout.lines_iterator():
             line.polygon = linepp.baseline_to_textline(line.baseline, line.heights)
 
         return page_layout
 
+    def adjust_line_heights(self, page_layout, heights_map, downsample):
+        if downsample != self.downsample:
+            heights_map = ndimage.morphology.grey_dilation(heights_map, size=(11, 1, 1))
+        for line in page_layout.lines_iterator():
+            baseline = line.baseline / downsample
+            sample_points = linepp.resample_baselines([baseline], num_points=40)[0]
+            heights_pred = self.line_engine.get_heights(
+                heights_map,
+                (np.round(sample_points[:, 1]).astype(int), np.round(sample_points[:, 0]).astype(int)))
+            line.heights = heights_pred * downsample
+
+
 def assign_lines_to_region(baseline_list, heights_list, textline_list, region):
     for line_num, (baseline, heights, textline) in enumerate(zip(baseline_list, heights_list, textline_list)):
         baseline_intersection, textline_intersection = linepp.mask_textline_by_region(baseline, textline, region.polygon)
@@ -231,6 +290,18 @@ def assign_lines_to_region(baseline_list, heights_list, textline_list, region):
             region.lines.append(new_textline)
     return region
 
+
+def assign_lines_to_regions(baseline_list, heights_list, textline_list, regions):
+    """Assign lines to all regions they intersect, lines are masked by the regions.
+    """
+    masked_lines = linepp.mask_textlines_by_regions(baseline_list, textline_list, [region.polygon for region in regions])
+    for region, region_lines in zip(regions, masked_lines):
+        for line_num, baseline, textline in region_lines:
+            new_textline = TextLine(id='{}-l{:03d}'.format(region.id, line_num+1), baseline=baseline, polygon=textline, heights=heights_list[line_num])
+            region.lines.append(new_textline)
+    return regions
+
+
 class BaseTextlineExtractor(object):
     def __init__(self, config):
         self.merge_lines = config.getboolean('MERGE_LINES')
@@ -240,17 +311,20 @@ class BaseTextlineExtractor(object):
         self.resample_lines = config.getboolean('RESAMPLE_LINES')
         self.order_lines = config['ORDER_LINES']
         self.heights_from_regions = config.getboolean('HEIGHTS_FROM_REGIONS')
-        self.pool = Pool()
 
-    def postprocess_region_lines(self, region):
+    def postprocess_region_lines(self, region, rotation_prior=None):
         if region.lines:
             region_baseline_list = [line.baseline for line in region.lines]
             region_textline_list = [line.polygon for line in region.lines]
             region_heights_list = [line.heights for line in region.lines]
             region.lines = []
 
-            rotation = linepp.get_rotation(region_baseline_list)
-            region_baseline_list = [linepp.rotate_coords(baseline, rotation, (0, 0)) for baseline in region_baseline_list]
+            # get_rotation needs at least two lines, regions with a single line take the page rotation
+            if rotation_prior is not None and len(region_baseline_list) < 2:
+                rotation = rotation_prior
+            else:
+                rotation = linepp.get_rotation(region_baseline_list)
+            region_baseline_list = linepp.rotate_lines(region_baseline_list, rotation, (0, 0))
 
             if self.merge_lines:
                 region_baseline_list, region_heights_list = linepp.merge_lines(region_baseline_list, region_heights_list)
@@ -266,8 +340,7 @@ class BaseTextlineExtractor(object):
             if self.heights_from_regions:
                 scores = []
                 region_heights_list = []
-                for baseline in region_baseline_list:
-                    baseline = linepp.rotate_coords(baseline, -rotation, (0, 0))
+                for baseline in linepp.rotate_lines(region_baseline_list, -rotation, (0, 0)):
                     height_asc = int(round(np.amin(baseline[:,1]) - np.amin(region.polygon[:,1])))
                     height_des = int(round(np.amax(region.polygon[:,1]) - np.amax(baseline[:,1])))
                     region_heights_list.append((height_asc, height_des))
@@ -277,9 +350,7 @@ class BaseTextlineExtractor(object):
                 region_baseline_list = [region_baseline_list[best_ind]]
                 region_heights_list = [region_heights_list[best_ind]]
 
-            region_textline_list = []
-            for baseline, height in zip(region_baseline_list, region_heights_list):
-                region_textline_list.append(linepp.baseline_to_textline(baseline, height))
+            region_textline_list = linepp.baselines_to_textlines(region_baseline_list, region_heights_list)
 
             if self.order_lines == 'vertical':
                 region_baseline_list, region_heights_list, region_textline_list = linepp.order_lines_vertical(region_baseline_list, region_heights_list, region_textline_list)
@@ -288,8 +359,8 @@ class BaseTextlineExtractor(object):
             else:
                 raise ValueError("Argument order_lines must be either 'vertical' or 'reading_order'.")
 
-            region_textline_list = [linepp.rotate_coords(textline, -rotation, (0, 0)) for textline in region_textline_list]
-            region_baseline_list = [linepp.rotate_coords(baseline, -rotation, (0, 0)) for baseline in region_baseline_list]
+            region_textline_list = linepp.rotate_lines(region_textline_list, -rotation, (0, 0))
+            region_baseline_list = linepp.rotate_lines(region_baseline_list, -rotation, (0, 0))
 
             scores = []
             for line in region.lines:
@@ -301,22 +372,36 @@ class BaseTextlineExtractor(object):
 
         return region
 
-    def process_page(self, img, page_layout: PageLayout):
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
         if not page_layout.regions:
             print(f"Warning: Skipping line detection for page {page_layout.id}. No text region present.")
             return page_layout
 
-        baseline_list, heights_list, textline_list = self.line_engine.detect_lines(img)
-
-        if len(page_layout.regions) > 4:
-            page_layout.regions = list(self.pool.map(partial(assign_lines_to_region, baseline_list, heights_list, textline_list),
-                             page_layout.regions))
-        else:
-            for region in page_layout.regions:
-                region = assign_lines_to_region(baseline_list, heights_list, textline_list, region)
+        rotation_prior = None
+        downsample = None
+        if document_context is not None:
+            rotation_prior = document_context.rotation
+            downsample = document_context.downsample
+            if downsample is None and document_context.text_height is not None:
+                downsample = linepp.optimal_downsample(document_context.text_height, self.line_engine.downsample)
+
+        baseline_list, heights_list, textline_list, downsample = self.line_engine.detect_lines(
+            img, downsample, return_downsample=True)
+
+        if document_context is not None and baseline_list:
+            document_context.update_scale(np.median([h[0] + h[1] for h in heights_list]), downsample)
+            # single line regions take the rotation of previous pages while the page stays within tolerance
+            page_rotation = linepp.get_rotation(baseline_list)
+            if document_context.rotation_deviates(page_rotation):
+                rotation_prior = page_rotation
+            document_context.update_rotation(page_rotation)
+            if document_context.region_templates is not None:
+                document_context.check_region_coverage(region_coverage(baseline_list, page_layout.regions))
+
+        page_layout.regions = assign_lines_to_regions(baseline_list, heights_list, textline_list, page_layout.regions)
 
         for region in page_layout.regions:
-            region = self.postprocess_region_lines(region)
+            region = self.postprocess_region_lines(region, rotation_prior)
 
         return page_layout
 
@@ -329,12 +414,18 @@ class TextlineExtractorCNN(BaseTextlineExtractor):
         pad = config.getint('PAD')
         use_cpu = config.getboolean('USE_CPU')
         detection_threshold = config.getfloat('DETECTION_THRESHOLD')
-        self.line_engine = baseline_engine.EngineLineDetectorCNN(
+        tile_size = config.getint('TILE_SIZE', fallback=None)
+        tile_overlap = config.getint('TILE_OVERLAP', fallback=64)
+        from pero_ocr.line_engine.baseline_engine import EngineLineDetectorCNN
+        self.line_engine = EngineLineDetectorCNN(
             model_path=model_path,
             downsample=downsample,
             pad=pad,
             use_cpu=use_cpu,
             detection_threshold=detection_threshold,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            **engine_threads(config)
         )
 
 
@@ -344,16 +435,17 @@ class TextlineExtractorSimple(object):
         block_size = config.getint('BLOCK_SIZE')
         minimum_length = config.getint('MINIMUM_LENGTH')
         ignored_border_pixels = config.getint('IGNORED_BORDER_PIXELS')
-        self.line_engine = baseline_engine.EngineLineDetectorSimple(
+        from pero_ocr.line_engine.baseline_engine import EngineLineDetectorSimple
+        self.line_engine = EngineLineDetectorSimple(
             adaptive_threshold=adaptive_threshold,
             block_size=block_size,
             minimum_length=minimum_length,
             ignored_border_pixels=ignored_border_pixels
         )
 
-    def process_page(self, img, page_layout: PageLayout):
-        for region in page_layout.regions:
-            baselines_list, heights_list, textlines_list = self.line_engine.detect_lines(img, region.polygon)
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
+        region_lines = self.line_engine.detect_lines_in_regions(img, [region.polygon for region in page_layout.regions])
+        for region, (baselines_list, heights_list, textlines_list) in zip(page_layout.regions, region_lines):
             for line_num, (baseline, heights, textline) in enumerate(zip(baselines_list, heights_list, textlines_list)):
                 new_textline = TextLine(id='{}-l{:03d}'.format(region.id, line_num+1), baseline=baseline, polygon=textline, heights=heights)
                 region.lines.append(new_textline)
@@ -365,15 +457,17 @@ class LineCropper(object):
         poly = config.getint('INTERP')
         line_scale = config.getfloat('LINE_SCALE')
         line_height = config.getint('LINE_HEIGHT')
-        self.crop_engine = cropper.EngineLineCropper(line_height=line_height, poly=poly, scale=line_scale)
-
-    def process_page(self, img, page_layout: PageLayout):
-        for line in page_layout.lines_iterator():
-            try:
-                line.crop = self.crop_engine.crop(img, line.baseline, line.heights)
-            except ValueError:
-                line.crop = np.zeros((self.crop_engine.line_height, self.crop_engine.line_height, 3))
+        from pero_ocr.document_ocr.crop_engine import EngineLineCropper
+        self.crop_engine = EngineLineCropper(line_height=line_height, poly=poly, scale=line_scale)
+
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
+        lines = list(page_layout.lines_iterator())
+        crops = self.crop_engine.crop_lines(img, [line.baseline for line in lines], [line.heights for line in lines])
+        for line, crop in zip(lines, crops):
+            if crop is None:
+                crop = np.zeros((self.crop_engine.line_height, self.crop_engine.line_height, 3))
                 print(f"WARNING: Failed to crop line {line.id} in page {page_layout.id}. Probably contain vertical line. Contanct Olda Kodym to fix this bug!")
+            line.crop = crop
         return page_layout
 
 
@@ -382,11 +476,13 @@ class PageOCR(object):
         json_file = compose_path(config['OCR_JSON'], config_path)
         if 'METHOD' in config and config['METHOD'] == 'pytorch_ocr':
             from pero_ocr.ocr_engine.pytorch_ocr_engine import PytorchEngineLineOCR
-            self.ocr_engine = PytorchEngineLineOCR(json_file, gpu_id=0)
+            self.ocr_engine = PytorchEngineLineOCR(
+                json_file, gpu_id=0, intra_op_threads=config.getint('INTRA_OP_THREADS', fallback=None))
         else:
-            self.ocr_engine = line_ocr_engine.EngineLineOCR(json_file, gpu_id=0)
+            from pero_ocr.ocr_engine.line_ocr_engine import EngineLineOCR
+            self.ocr_engine = EngineLineOCR(json_file, gpu_id=0, **engine_threads(config))
 
-    def process_page(self, img, page_layout: PageLayout):
+    def process_page(self, img, page_layout: PageLayout, document_context=None):
         for line in page_layout.lines_iterator():
             if line.crop is None:
                 raise Exception(f'Missing crop in line {line.id}.')
@@ -408,6 +504,15 @@ class PageParser (object):
         self.run_ocr = config['PAGE_PARSER'].getboolean('RUN_OCR')
         self.run_decoder = config['PAGE_PARSER'].getboolean('RUN_DECODER')
 
+        # thread budget of the process, applied to TensorFlow sessions, PyTorch, OpenCV and numba
+        num_threads = config['PAGE_PARSER'].getint('NUM_THREADS', fallback=parallel.get_thread_budget())
+        parallel.set_thread_budget(num_threads)
+        # replacing the shared executor shuts down pools used by other parsers of the process, so it is
+        # replaced only for an explicit size differing from the current one
+        max_workers = config['PAGE_PARSER'].getint('MAX_WORKERS', fallback=None)
+        if max_workers and parallel.get_executor().max_workers != max_workers:
+            parallel.configure_executor(max_workers=max_workers)
+
         self.layout_parser = None
         self.line_parser = None
         self.line_cropper = None
@@ -424,16 +529,28 @@ class PageParser (object):
         if self.run_decoder:
             self.decoder = page_decoder_factory(config, config_path=config_path)
 
-    def process_page(self, image, page_layout):
+        # libraries imported by the components
+        parallel.apply_thread_budget()
+
+    def process_page(self, image, page_layout, document_context=None):
+        """Run all configured components on a page.
+        :param document_context: DocumentContext shared by consecutive pages of a document, pages are independent if None
+        """
+        if document_context is not None:
+            # inputs without images (e.g. decoding of stored logits) take the page size from the layout
+            page_size = image.shape[:2] if image is not None else page_layout.page_size
+            if page_size is not None and min(page_size) > 0:
+                document_context.begin_page(page_size)
+
         if self.run_layout_parser:
-            page_layout = self.layout_parser.process_page(image, page_layout)
+            page_layout = self.layout_parser.process_page(image, page_layout, document_context=document_context)
         if self.run_line_parser:
-            page_layout = self.line_parser.process_page(image, page_layout)
+            page_layout = self.line_parser.process_page(image, page_layout, document_context=document_context)
         if self.run_line_cropper:
-            page_layout = self.line_cropper.process_page(image, page_layout)
+            page_layout = self.line_cropper.process_page(image, page_layout, document_context=document_context)
         if self.run_ocr:
-            page_layout = self.ocr.process_page(image, page_layout)
+            page_layout = self.ocr.process_page(image, page_layout, document_context=document_context)
         if self.run_decoder:
-            page_layout = self.decoder.process_page(page_layout)
+            page_layout = self.decoder.process_page(page_layout, document_context=document_context)
 
         return page_layout
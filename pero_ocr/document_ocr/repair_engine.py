@@ -9,10 +9,10 @@ import json
 
 import numpy as np
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-import tensorflow as tf
+
 
 class EngineRepairCNN(object):
-    def __init__(self, json_path, use_cpu=False):
+    def __init__(self, json_path, use_cpu=False, intra_op_threads=None, inter_op_threads=None):
         with open(json_path, 'r', encoding='utf8') as f:
             config = json.load(f)
         with open(config['chars_path'], 'rb') as handle:
@@ -24,56 +24,89 @@ class EngineRepairCNN(object):
         self.height = config['height']
         self.max_width = config['max_width']
 
-        repair_model = config['repair_model']
-        inpainting_model = config['inpainting_model']
-
-        if repair_model:
-            tf.reset_default_graph()
-            saver = tf.train.import_meta_graph(repair_model + '.meta')
-            if use_cpu:
-                tf_config = tf.ConfigProto(device_count={'GPU': 0})
-            else:
-                tf_config = tf.ConfigProto(device_count={'GPU': 1})
-                tf_config.gpu_options.allow_growth = True
-            self.repair_session = tf.Session(config=tf_config)
-            saver.restore(self.repair_session, repair_model)
-
-        if inpainting_model:
-            tf.reset_default_graph()
-            saver = tf.train.import_meta_graph(inpainting_model + '.meta')
-            if use_cpu:
-                tf_config = tf.ConfigProto(device_count={'GPU': 0})
-            else:
-                tf_config = tf.ConfigProto(device_count={'GPU': 1})
-                tf_config.gpu_options.allow_growth = True
-            self.inpainting_session = tf.Session(config=tf_config)
-            saver.restore(self.inpainting_session, inpainting_model)
+        self.repair_model = config['repair_model']
+        self.inpainting_model = config['inpainting_model']
+
+        # sessions are created on first use, tools often use only one of the models
+        self.use_cpu = use_cpu
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.sessions = {}
+
+    def get_session(self, model_path):
+        if model_path not in self.sessions:
+            from pero_ocr import tf_utils
+            self.sessions[model_path], _ = tf_utils.load_model(
+                model_path, use_cpu=self.use_cpu,
+                intra_op_threads=self.intra_op_threads, inter_op_threads=self.inter_op_threads)
+        return self.sessions[model_path]
+
+    @property
+    def repair_session(self):
+        return self.get_session(self.repair_model)
+
+    @property
+    def inpainting_session(self):
+        return self.get_session(self.inpainting_model)
+
+    def export_frozen_graph(self):
+        from pero_ocr import tf_utils
+        inputs = ['inference_content:0', 'inference_style:0', 'inference_transcriptions:0']
+        paths = []
+        if self.repair_model:
+            paths.append(tf_utils.export_frozen_graph(self.repair_session, self.repair_model, inputs, ['inference_op:0']))
+        if self.inpainting_model:
+            paths.append(tf_utils.export_frozen_graph(self.inpainting_session, self.inpainting_model, inputs, ['inference_op:0']))
+        return paths
 
     def repair_line(self, line, transcription):
-        labels = self.transcriptions_to_labels([transcription])[0]
-        labels = self.clip_or_pad_labels(labels).astype(np.int32)
-
-        line = self.clip_or_pad_image(line)
-        line = line[np.newaxis, :, :, :] / 255.
-
-        feed_dict = {'inference_content:0': line,
-                     'inference_style:0': line,
-                     'inference_transcriptions:0': labels}
-        output = self.repair_session.run('inference_op:0', feed_dict=feed_dict)
-        return (255*np.clip(output[0, :, :, :], 0, 1)).astype(np.uint8)
+        return self.repair_lines([line], [transcription])[0]
 
     def inpaint_line(self, line, transcription):
-        labels = self.transcriptions_to_labels([transcription])[0]
-        labels = self.clip_or_pad_labels(labels).astype(np.int32)
-
-        line = self.clip_or_pad_image(line)
-        line = line[np.newaxis, :, :, :] / 255.
-
-        feed_dict = {'inference_content:0': line,
-                     'inference_style:0': line,
-                     'inference_transcriptions:0': labels}
-        output = self.inpainting_session.run('inference_op:0', feed_dict=feed_dict)
-        return (255*np.clip(output[0, :, :, :], 0, 1)).astype(np.uint8)
+        return self.inpaint_lines([line], [transcription])[0]
+
+    def repair_lines(self, lines, transcriptions, batch_size=16):
+        """Repair line crops to match their transcriptions.
+        :param lines: line crops (height x width x 3), padded or clipped to max_width
+        :param transcriptions: transcription of each line
+        :param batch_size: lines processed by a single session run, if the network accepts variable batch size
+        :return: list of repaired lines (height x max_width x 3) as uint8
+        """
+        return self.run_batched(self.repair_session, lines, transcriptions, batch_size)
+
+    def inpaint_lines(self, lines, transcriptions, batch_size=16):
+        """Inpaint missing (zero) parts of line crops, see repair_lines.
+        """
+        return self.run_batched(self.inpainting_session, lines, transcriptions, batch_size)
+
+    def run_batched(self, session, lines, transcriptions, batch_size=16):
+        # networks exported with a fixed batch size get batches padded to it
+        input_shape = session.graph.get_tensor_by_name('inference_content:0').shape
+        fixed_batch_size = input_shape.as_list()[0] if input_shape.ndims is not None else None
+        if fixed_batch_size is not None:
+            batch_size = fixed_batch_size
+
+        labels = [self.clip_or_pad_labels(l)[0] for l in self.transcriptions_to_labels(transcriptions)]
+        outputs = []
+        for batch_start in range(0, len(lines), batch_size):
+            batch_lines = lines[batch_start:batch_start + batch_size]
+            batch_labels = labels[batch_start:batch_start + batch_size]
+            line_count = len(batch_lines)
+            padded_size = fixed_batch_size if fixed_batch_size is not None else line_count
+
+            images = np.zeros((padded_size, self.height, self.max_width, 3))
+            for i, line in enumerate(batch_lines):
+                images[i] = self.clip_or_pad_image(line)
+            images /= 255.
+            batch_transcriptions = np.zeros((padded_size, self.max_labels), dtype=np.int32)
+            batch_transcriptions[:line_count] = batch_labels
+
+            feed_dict = {'inference_content:0': images,
+                         'inference_style:0': images,
+                         'inference_transcriptions:0': batch_transcriptions}
+            output = session.run('inference_op:0', feed_dict=feed_dict)
+            outputs += list((255 * np.clip(output[:line_count], 0, 1)).astype(np.uint8))
+        return outputs
 
     def transcriptions_to_labels(self, transcriptions):
         trans = str.maketrans(''.join(self.from_char), ''.join(self.to_char))
@@ -1 +1,12 @@
-from .baseline_engine import EngineLineDetectorSimple, EngineLineDetectorCNN
\ No newline at end of file
+# engines are imported on first access, so that importing line_postprocessing does not import TensorFlow
+_lazy_attributes = {
+    'EngineLineDetectorSimple': '.baseline_engine',
+    'EngineLineDetectorCNN': '.baseline_engine',
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        import importlib
+        return getattr(importlib.import_module(_lazy_attributes[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,14 +1,15 @@
-import tensorflow as tf
 import numpy as np
 import cv2
 import shapely
 import sys
 from scipy import ndimage
 from scipy import signal
-from scipy.ndimage.morphology import binary_erosion
-from skimage.draw import polygon2mask
 
 from . import line_postprocessing as pp
+from pero_ocr import parallel
+from pero_ocr import tiling
+from pero_ocr.canvas_pool import CanvasPool, fill_canvas
+
 
 class EngineLineDetectorSimple(object):
     def __init__(self, adaptive_threshold=91, block_size=20,
@@ -39,11 +40,15 @@ class EngineLineDetectorSimple(object):
         column_width = x2 - x1
         column_height = y2 - y1
 
-        img_mask = polygon2mask(img.shape[0:2], region)
-        img_mask = img_mask[y1:y2, x1:x2]
-        img_mask = binary_erosion(img_mask, structure=np.ones((1, 2 * self.ignored_border_pixels + 1)))
-
         img_crop = img[y1:y2, x1:x2, :]
+
+        # mask rasterized only in the bounding box, clipped by the image as the crop is, the last row and
+        # column are included as cv2 rasterizes edges clipped by the mask differently
+        img_mask = region_mask(region, (y1, x1), (column_height + 1, column_width + 1))
+        img_mask = img_mask[:img_crop.shape[0], :img_crop.shape[1]]
+        img_mask = cv2.erode(img_mask, np.ones((1, 2 * self.ignored_border_pixels + 1), dtype=np.uint8),
+                             borderType=cv2.BORDER_CONSTANT, borderValue=0).astype(bool)
+
         img_crop = img_crop.mean(axis=2).astype(np.uint8)
         img_crop = cv2.adaptiveThreshold(img_crop, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, self.block_size, self.adaptive_threshold) == 0
 
@@ -62,7 +67,11 @@ class EngineLineDetectorSimple(object):
 
         baseline_coords = signal.find_peaks(target_signal, distance=int(round(0.85*line_period)))[0]
         region = shapely.geometry.polygon.Polygon(region)
-        used_inds = []
+        used_inds = set()
+
+        # rows of connected components are contiguous, so a row contains a component iff it is in its row extent
+        object_rows = np.array([[s[0].start, s[0].stop] for s in ndimage.find_objects(img_crop_labeled)],
+                               dtype=np.int64).reshape(-1, 2)
 
         for baseline_coord in baseline_coords[::-1]:
             valid_baseline = True
@@ -71,17 +80,17 @@ class EngineLineDetectorSimple(object):
                 for ind in matching_objects:
                     if ind in used_inds:
                         valid_baseline = False
-                    used_inds.append(ind)
+                    used_inds.add(ind)
 
-                for yb1 in range(baseline_coord, 0, -3):
-                    line_inds_to_check = img_crop_labeled[yb1, :]
-                    if not np.any(np.intersect1d(matching_objects, line_inds_to_check)):
-                        break
+                # rows containing any of the matching objects, rows of the region outside of the image contain none
+                row_changes = np.zeros(max(img_crop_labeled.shape[0], column_height) + 1, dtype=np.int64)
+                np.add.at(row_changes, object_rows[matching_objects - 1, 0], 1)
+                np.add.at(row_changes, object_rows[matching_objects - 1, 1], -1)
+                covered_rows = np.cumsum(row_changes[:-1]) > 0
 
-                for yb2 in range(baseline_coord, column_height, 3):
-                    line_inds_to_check = img_crop_labeled[yb2, :]
-                    if not np.any(np.intersect1d(matching_objects, line_inds_to_check)):
-                        break
+                # first row without the objects, going by 3 rows up and down from the baseline
+                yb1 = first_uncovered_row(covered_rows, np.arange(baseline_coord, 0, -3))
+                yb2 = first_uncovered_row(covered_rows, np.arange(baseline_coord, column_height, 3))
 
                 xb1, xb2 = 0, column_width
 
@@ -99,45 +108,87 @@ class EngineLineDetectorSimple(object):
 
         return baselines_list, heights_list, textlines_list
 
+    def detect_lines_in_regions(self, img, regions):
+        """Detect lines in multiple text regions, see detect_lines. Regions are processed in threads
+        of the shared executor.
+        :param regions: list of region polygons
+        :return: list of (baselines, heights, textlines) for each region
+        """
+        return parallel.get_executor().map(lambda region: self.detect_lines(img, region), regions,
+                                           cost=0.01, releases_gil=True)
+
+
+def region_mask(region, origin, shape):
+    """Rasterize region polygon with cv2, which releases the GIL. Unlike skimage polygon2mask, which tests
+    pixel centers, pixels touched by the outline are included.
+    :param region: region polygon, (y, x) points
+    :param origin: (y, x) position of the mask in the image
+    :param shape: shape of the mask
+    :return: uint8 mask, 1 inside of the region
+    """
+    mask = np.zeros(shape, dtype=np.uint8)
+    cv2.fillPoly(mask, [np.round(region[:, ::-1] - np.asarray(origin)[::-1]).astype(np.int32)], 1)
+    return mask
+
+
+def first_uncovered_row(covered_rows, rows):
+    """First of rows which is not covered, the last of rows if all are covered.
+    """
+    uncovered = np.flatnonzero(~covered_rows[rows])
+    return rows[uncovered[0]] if len(uncovered) > 0 else rows[-1]
+
 
 class EngineLineDetectorCNN(object):
-    def __init__(self, model_path, downsample=4, pad=50, use_cpu=False, detection_threshold=0.5):
+    def __init__(self, model_path, downsample=4, pad=50, use_cpu=False, detection_threshold=0.5,
+                 tile_size=None, tile_overlap=64, intra_op_threads=None, inter_op_threads=None):
 
         self.downsample = downsample
         self.pad = pad
         self.detection_threshold = detection_threshold
+        self.tile_size = tile_size # downsampled images larger than this are processed in overlapping tiles
+        self.tile_overlap = tile_overlap
+        self.estimation_size = 512 # size of the central crop (in downsampled pixels) used for scale estimation
+        self.canvas_pool = CanvasPool()
 
-        tf.reset_default_graph()
-        saver = tf.train.import_meta_graph(model_path + '.meta')
-        if use_cpu:
-            tf_config = tf.ConfigProto(device_count={'GPU': 0})
-        else:
-            tf_config = tf.ConfigProto(device_count={'GPU': 1})
-            tf_config.gpu_options.allow_growth = True
-        self.session = tf.Session(config=tf_config)
-        saver.restore(self.session, model_path)
+        from pero_ocr import tf_utils
+        self.model_path = model_path
+        self.session, _ = tf_utils.load_model(model_path, use_cpu=use_cpu,
+                                              intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
 
-    def infer_maps(self, img):
+    def infer_maps(self, img, downsample=None):
         """CNN Model inference for baseline pixelwise probabilities and heights.
         :param img: input image array
+        :param downsample: downsample factor, self.downsample by default
         """
+        if downsample is None:
+            downsample = self.downsample
 
-        img = cv2.resize(img, (0,0), fx=1/self.downsample, fy=1/self.downsample, interpolation=cv2.INTER_AREA)
-        img = np.pad(img, [(self.pad, self.pad), (self.pad, self.pad), (0,0)], 'constant')
-
-        new_shape_x = int(np.ceil(img.shape[0] / 64) * 64)
-        new_shape_y = int(np.ceil(img.shape[1] / 64) * 64)
-        test_img_canvas = np.zeros((1, new_shape_x, new_shape_y, 3))
-        test_img_canvas[0, :img.shape[0], :img.shape[1], :] = img
+        img = cv2.resize(img, (0,0), fx=1/downsample, fy=1/downsample, interpolation=cv2.INTER_AREA)
 
-        out_map = self.session.run('test_probs:0', feed_dict={'test_dataset:0' : test_img_canvas/256.})
-        out_map = out_map[0, :img.shape[0], :img.shape[1], :]
-        out_map = out_map[self.pad:-self.pad,self.pad:-self.pad,:]
+        if self.tile_size and max(img.shape[:2]) > self.tile_size:
+            out_map = tiling.infer_tiled(img, self.run_network, self.tile_size, overlap=self.tile_overlap, pad=self.pad,
+                                         scale=1/256., canvas_pool=self.canvas_pool)
+        else:
+            new_shape_x = int(np.ceil((img.shape[0] + 2 * self.pad) / 64) * 64)
+            new_shape_y = int(np.ceil((img.shape[1] + 2 * self.pad) / 64) * 64)
+            with self.canvas_pool.canvas((1, new_shape_x, new_shape_y, 3)) as test_img_canvas:
+                fill_canvas(test_img_canvas[0], img, offset=(self.pad, self.pad), scale=1/256.)
+                out_map = self.run_network(test_img_canvas)
+            out_map = out_map[0, self.pad:self.pad + img.shape[0], self.pad:self.pad + img.shape[1], :]
         heights_map = out_map[:,:,:2].astype(np.float32)
         baselines_map = pp.nonmaxima_suppression(out_map[:,:,2]-out_map[:,:,3]) > self.detection_threshold
 
         return baselines_map, heights_map
 
+    def export_frozen_graph(self):
+        from pero_ocr import tf_utils
+        return tf_utils.export_frozen_graph(self.session, self.model_path, ['test_dataset:0'], ['test_probs:0'])
+
+    def run_network(self, batch):
+        """Run the CNN on a normalized batch (values divided by 256).
+        """
+        return self.session.run('test_probs:0', feed_dict={'test_dataset:0' : batch})
+
     def get_heights(self, heights_map, inds):
         heights_pred = heights_map[inds]  #* (baselines_img == i)[:, :, np.newaxis]
 
@@ -148,83 +199,98 @@ class EngineLineDetectorCNN(object):
         ])
         return heights_pred
 
-    def parse_maps(self, baselines_map, heights_map):
+    def estimate_downsample(self, img):
+        """Estimate optimal downsample factor from CNN inference on a central crop of the page.
+        :param img: input image array
+        """
+        crop_size = self.estimation_size * self.downsample
+        y1 = max(0, (img.shape[0] - crop_size) // 2)
+        x1 = max(0, (img.shape[1] - crop_size) // 2)
+        baselines_map, heights_map = self.infer_maps(img[y1:y1 + crop_size, x1:x1 + crop_size])
+
+        heights = heights_map[baselines_map].sum(axis=1)
+        heights = heights[heights > 0]
+        if heights.size == 0:
+            return self.downsample
+        return pp.optimal_downsample(np.median(heights) * self.downsample, self.downsample)
+
+    def parse_maps(self, baselines_map, heights_map, downsample=None):
         """Parse input baseline and height map into list of baselines coords and heights
         :param baseline_map: array of baseline and endpoint probabilities
         :param heights_map: array of estimated heights
+        :param downsample: downsample factor the maps were inferred with, self.downsample by default
         """
+        if downsample is None:
+            downsample = self.downsample
         baselines_list = []
         heights_list = []
 
         baselines_img, num_detections = ndimage.measurements.label(baselines_map, structure=np.ones((3, 3)))
-        inds = np.where(baselines_img > 0)
-        labels = baselines_img[inds[0], inds[1]]
-
-        for i in range(1, num_detections+1):
-            baseline_inds, = np.where(labels == i)
-            if (np.amax(inds[1][baseline_inds]) - np.amin(inds[1][baseline_inds])) > 5:
-                pos_all = np.stack([inds[1][baseline_inds], inds[0][baseline_inds]], axis=1)  # go from matrix indexing to image indexing
-
-                _, indices = np.unique(pos_all[:, 0], return_index=True)
-                pos = pos_all[indices]
-                x_index = np.argsort(pos[:, 0])
-                pos = pos[x_index]
-
-                target_point_count = min(10, pos.shape[0] // 10)
-                target_point_count = max(target_point_count, 2)
-                selected_pos = np.linspace(0, (pos.shape[0]) - 1, target_point_count).astype(np.int32)
-                pos = pos[selected_pos, :]
-
-                heights_pred = heights_map[inds[0][baseline_inds], inds[1][baseline_inds], :]  #* (baselines_img == i)[:, :, np.newaxis]
-
-                heights_pred = self.get_heights(heights_map, (inds[0][baseline_inds], inds[1][baseline_inds]))
-                if np.all(heights_pred > 0):
-                    baselines_list.append(self.downsample * pos.astype(np.float32))
-                    heights_list.append([self.downsample * heights_pred[0],
-                                         self.downsample * heights_pred[1]])
+        if num_detections == 0:
+            return baselines_list, heights_list
+        rows, cols, offsets = pp.label_pixel_groups(baselines_img)
+
+        heights_pred = np.maximum(heights_map[rows, cols], 0)
+        heights_pred = np.stack([
+            pp.group_percentile(heights_pred[:, 0], offsets, 70),
+            pp.group_percentile(heights_pred[:, 1], offsets, 70)
+        ], axis=1)
+        widths = np.maximum.reduceat(cols, offsets[:-1]) - np.minimum.reduceat(cols, offsets[:-1])
+        points = pp.group_baseline_points(rows, cols, offsets)
+
+        for pos, width, heights in zip(points, widths, heights_pred):
+            if width > 5 and np.all(heights > 0):
+                baselines_list.append(downsample * pos.astype(np.float32))
+                heights_list.append([downsample * heights[0],
+                                     downsample * heights[1]])
 
         return baselines_list, heights_list
 
-    def detect_lines_single_scale(self, img):
+    def detect_lines_single_scale(self, img, downsample=None):
         """Detect lines in document image.
         :param img: input image array
+        :param downsample: downsample factor, self.downsample by default
         """
-        baselines_map, heights_map = self.infer_maps(img)
-        baselines_list, heights_list = self.parse_maps(baselines_map, heights_map)
+        baselines_map, heights_map = self.infer_maps(img, downsample)
+        baselines_list, heights_list = self.parse_maps(baselines_map, heights_map, downsample)
 
         rotation = pp.get_rotation(baselines_list)
-        baselines_list = [pp.rotate_coords(baseline, rotation, (0, 0)) for baseline in baselines_list]
-
-        textlines_list = []
-        for baseline, height in zip(baselines_list, heights_list):
-            textlines_list.append(pp.baseline_to_textline(baseline, height))
+        baselines_list = pp.rotate_lines(baselines_list, rotation, (0, 0))
+        textlines_list = pp.baselines_to_textlines(baselines_list, heights_list)
 
-        textlines_list = [pp.rotate_coords(textline, -rotation, (0, 0)) for textline in textlines_list]
-        baselines_list = [pp.rotate_coords(baseline, -rotation, (0, 0)) for baseline in baselines_list]
+        textlines_list = pp.rotate_lines(textlines_list, -rotation, (0, 0))
+        baselines_list = pp.rotate_lines(baselines_list, -rotation, (0, 0))
 
         return baselines_list, heights_list, textlines_list
 
-    def detect_lines(self, img):
-        """Detect lines in document image.
+    def detect_lines(self, img, downsample=None, return_downsample=False):
+        """Detect lines in document image. The detailed inference runs at given downsample (e.g. the one
+        of the previous page of a document) or at downsample estimated by a cheap pre-pass.
+        Only when the detected text height is still out of range, detection is repeated at the corrected downsample.
         :param img: input image array
+        :param downsample: known downsample factor, skips the estimation
+        :param return_downsample: return also the downsample factor the lines were detected at
         """
-        baselines_list, heights_list, textlines_list = self.detect_lines_single_scale(img)
-        temp_downsample = self.downsample
+        if downsample is None:
+            downsample = self.estimate_downsample(img)
+
+        baselines_list, heights_list, textlines_list = self.detect_lines_single_scale(img, downsample)
 
-        height = np.median([h[0] + h[1] for h in heights_list])
-        if height / self.downsample <= 6 or height / self.downsample > 18:
-            print("ADAPT DOWNAMPLING", img.shape[0:2], self.downsample, height, height / self.downsample)
-            self.downsample = max(1, int(height / 12 + 0.5))
+        height = np.median([h[0] + h[1] for h in heights_list]) if heights_list else np.nan
+        new_downsample = pp.optimal_downsample(height, downsample)
+        if new_downsample != downsample:
+            print("ADAPT DOWNAMPLING", img.shape[0:2], downsample, height, height / downsample)
             try:
-                baselines_list, heights_list, textlines_list = self.detect_lines_single_scale(img)
+                baselines_list, heights_list, textlines_list = self.detect_lines_single_scale(img, new_downsample)
+                downsample = new_downsample
             except:
-                print(f'Error: Failed to detect lines in adapted resolution. Downsample was {self.downsample}',
+                print(f'Error: Failed to detect lines in adapted resolution. Downsample was {new_downsample}',
                       file=sys.stderr)
             height = np.median([h[0] + h[1] for h in heights_list])
-            print(f"OPTIMAL DOWNAMPLING {img.shape[0]//self.downsample}:{img.shape[1]//self.downsample}", self.downsample, height, height / self.downsample)
-
-        self.downsample = temp_downsample
+            print(f"OPTIMAL DOWNAMPLING {img.shape[0]//downsample}:{img.shape[1]//downsample}", downsample, height, height / downsample)
 
+        if return_downsample:
+            return baselines_list, heights_list, textlines_list, downsample
         return baselines_list, heights_list, textlines_list
 
 
@@ -2,68 +2,94 @@ import math
 import random
 import warnings
 
-import tensorflow as tf
 import numpy as np
 import cv2
+import shapely
 import shapely.geometry
 from scipy import ndimage, interpolate
-from sklearn import cluster
 
-import matplotlib.pyplot as plt
+
+def optimal_downsample(height, downsample, min_height=6, max_height=18, target_height=12):
+    """Get downsample factor for CNN inference which brings median text height to the range the models were trained for.
+    :param height: median text height in input image pixels
+    :param downsample: current downsample factor, kept if text height is already in range
+    """
+    if not np.isfinite(height) or min_height < height / downsample <= max_height:
+        return downsample
+    return max(1, int(height / target_height + 0.5))
+
 
 def merge_lines(baselines, heights):
     """Merge lines on similar vertical offsets. Useful as postprocessing with known regions.
     :param baselines: list of baselines to merge
     :param heights: list of respective textline heights
     """
+    if len(baselines) == 0:
+        return [], []
 
     rotation = get_rotation(baselines)
-    baselines = [rotate_coords(baseline, rotation, (0, 0)) for baseline in baselines]
-    baselines = [baseline.tolist() for baseline in baselines]
-
-    merged_lines = list()
-    lines_to_merge = list()
-    for i in range(len(baselines)):
-        lines_to_merge_i = list()
-        for j in range(len(baselines)):
-            if i != j:
-                avg_hpos_1 = np.average(np.asarray(baselines[i])[:, 1]).astype(np.int32)
-                avg_hpos_2 = np.average(np.asarray(baselines[j])[:, 1]).astype(np.int32)
-                min_i = np.amin(np.asarray(baselines[i])[:, 0]).astype(np.int32)
-                max_i = np.amax(np.asarray(baselines[i])[:, 0]).astype(np.int32)
-                min_j = np.amin(np.asarray(baselines[j])[:, 0]).astype(np.int32)
-                max_j = np.amax(np.asarray(baselines[j])[:, 0]).astype(np.int32)
-                v_overlay = (min_i > min_j and max_i < max_j) or (min_j > min_i and max_j < max_i)
-                h_overlay = np.minimum(avg_hpos_1 + heights[i][1], avg_hpos_2 + heights[j][1]) - np.maximum(avg_hpos_1 - heights[i][0], avg_hpos_2 - heights[j][0])
-                if h_overlay > (0.7 * np.minimum(heights[i][0] + heights[i][1], heights[j][0] + heights[j][1])) and not v_overlay:
-                    if i not in merged_lines:
-                        lines_to_merge_i.append(i)
-                        merged_lines.append(i)
-                    if j not in merged_lines:
-                        lines_to_merge_i.append(j)
-                        merged_lines.append(j)
-        lines_to_merge.append(lines_to_merge_i)
-
-    for line_group in lines_to_merge:
-        if len(line_group) > 0:
-            new_line = list()
-            new_height = np.zeros(2)
-            for l_num in line_group:
-                new_line += baselines[l_num]
-                if heights[l_num][0] > new_height[0]:
-                    new_height[0] = heights[l_num][0]
-                if heights[l_num][1] > new_height[1]:
-                    new_height[1] = heights[l_num][1]
-            new_line_inds = np.argsort(np.asarray(new_line)[:, 0])
-            baselines.append([new_line[x] for x in new_line_inds.tolist()])
-            heights.append(new_height.tolist())
-
-    baselines = filter_list(baselines, merged_lines)
-    heights = filter_list(heights, merged_lines)
-
-    baselines = [np.asarray(baseline) for baseline in baselines]
-    baselines = [rotate_coords(baseline, -rotation, (0, 0)) for baseline in baselines]
-    return baselines, heights
+    baselines = rotate_lines(baselines, rotation, (0, 0))
+
+    avg_hpos = np.asarray([np.average(baseline[:, 1]) for baseline in baselines]).astype(np.int32)
+    min_pos = np.asarray([np.amin(baseline[:, 0]) for baseline in baselines]).astype(np.int32)
+    max_pos = np.asarray([np.amax(baseline[:, 0]) for baseline in baselines]).astype(np.int32)
+    heights_array = np.asarray(heights, dtype=np.float64).reshape(-1, 2)
+    lower = avg_hpos - heights_array[:, 0]
+    upper = avg_hpos + heights_array[:, 1]
+
+    # lines can only be merged when their vertical extents overlap
+    i, j = overlapping_intervals(lower, upper)
+    h_overlay = np.minimum(upper[i], upper[j]) - np.maximum(lower[i], lower[j])
+    line_heights = heights_array.sum(axis=1)
+    v_overlay = ((min_pos[i] > min_pos[j]) & (max_pos[i] < max_pos[j])) | ((min_pos[j] > min_pos[i]) & (max_pos[j] < max_pos[i]))
+    matching = (h_overlay > 0.7 * np.minimum(line_heights[i], line_heights[j])) & ~v_overlay
+    i, j = i[matching], j[matching]
+    i, j = np.concatenate([i, j]), np.concatenate([j, i])
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    neighbour_starts = np.searchsorted(i, np.arange(len(baselines) + 1))
+
+    # each line takes all its not yet merged neighbours, lines are visited in their order
+    merged = np.zeros(len(baselines), dtype=bool)
+    line_groups = []
+    for line_num in range(len(baselines)):
+        neighbours = j[neighbour_starts[line_num]:neighbour_starts[line_num + 1]]
+        if len(neighbours) == 0:
+            continue
+        line_group = [line_num] if not merged[line_num] else []
+        line_group += neighbours[~merged[neighbours]].tolist()
+        if line_group:
+            merged[line_group] = True
+            line_groups.append(line_group)
+
+    new_baselines = [baseline for baseline, line_merged in zip(baselines, merged) if not line_merged]
+    new_heights = [height for height, line_merged in zip(heights, merged) if not line_merged]
+    for line_group in line_groups:
+        new_line = np.concatenate([baselines[l_num] for l_num in line_group])
+        new_baselines.append(new_line[np.argsort(new_line[:, 0])])
+        new_heights.append(np.maximum(heights_array[line_group].max(axis=0), 0).tolist())
+
+    new_baselines = rotate_lines(new_baselines, -rotation, (0, 0))
+    return new_baselines, new_heights
+
+
+def overlapping_intervals(lower, upper):
+    """All pairs of intervals with positive overlap, found by a sweep over intervals sorted by their start.
+    Takes O(n log n + k) time for k returned pairs.
+    :param lower: interval starts
+    :param upper: interval ends
+    :return: indices of the first and the second interval of each pair
+    """
+    order = np.argsort(lower, kind='stable')
+    lower, upper = lower[order], upper[order]
+    # intervals starting after the start of an interval and before its end
+    ends = np.searchsorted(lower, upper, side='left')
+    counts = np.maximum(ends - np.arange(1, len(lower) + 1), 0)
+    first = np.repeat(np.arange(len(lower)), counts)
+    second = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + first + 1
+    # empty intervals with the same start
+    overlapping = np.minimum(upper[first], upper[second]) > lower[second]
+    return order[first[overlapping]], order[second[overlapping]]
 
 
 def cluster_baselines(baselines, heights):
@@ -76,6 +102,7 @@ def cluster_baselines(baselines, heights):
     alpha = 4  # how much to reduce vertical difference penalty
     feature_normalizers = np.asarray([[baseline[-1][0] - baseline[0][0], alpha*height[0]] for baseline, height in zip(baselines, heights)])
     feature_normalizers = np.median(feature_normalizers, axis=0)
+    from sklearn import cluster
     baseline_labels = cluster.DBSCAN(eps=0.5, min_samples=1).fit(baseline_features/feature_normalizers).labels_
 
     return baseline_labels
@@ -168,13 +195,50 @@ def stretch_baselines_to_region(baselines, region):
 
 
 def resample_baselines(baselines, num_points=10):
-    baselines_resampled = []
-    for baseline in baselines:
-        line_interpf = np.poly1d(np.polyfit(baseline[:,0], baseline[:,1], 2))
-        new_xs = np.linspace(np.amin(baseline[:,0]), np.amax(baseline[:,0]), num_points)
-        new_ys = line_interpf(new_xs)
-        baselines_resampled.append(np.stack((new_xs, new_ys), axis=-1))
-    return baselines_resampled
+    """Resample baselines to evenly spaced points of a quadratic fit. All baselines are fitted at once,
+    baselines with less than 3 distinct x coordinates are fitted by np.polyfit.
+    :param baselines: list of baselines
+    :param num_points: number of points of each resampled baseline
+    """
+    if len(baselines) == 0:
+        return []
+    points, offsets = concatenate_lines(baselines)
+    points = points.astype(np.float64)
+    counts = np.diff(offsets)
+    line_ids = np.repeat(np.arange(len(baselines)), counts)
+    xs, ys = points[:, 0], points[:, 1]
+
+    x_min = np.minimum.reduceat(xs, offsets[:-1])
+    x_max = np.maximum.reduceat(xs, offsets[:-1])
+
+    # least squares of x normalized to [-1, 1] in each line, the normal equations are well conditioned then
+    center = (x_min + x_max) / 2
+    scale = np.maximum((x_max - x_min) / 2, np.finfo(np.float64).tiny)
+    t = (xs - center[line_ids]) / scale[line_ids]
+    powers = t[:, np.newaxis] ** np.arange(5)
+    moments = np.stack([np.bincount(line_ids, powers[:, k], minlength=len(baselines)) for k in range(5)], axis=1)
+    rhs = np.stack([np.bincount(line_ids, ys * powers[:, k], minlength=len(baselines)) for k in range(3)], axis=1)
+    normal_matrices = moments[:, np.arange(3)[:, np.newaxis] + np.arange(3)]
+
+    sorted_xs = xs[np.lexsort((xs, line_ids))]
+    x_changes = np.ones(len(xs), dtype=bool)
+    x_changes[1:] = sorted_xs[1:] != sorted_xs[:-1]
+    x_changes[offsets[:-1]] = True
+    distinct_counts = np.add.reduceat(x_changes, offsets[:-1])
+    fitted = distinct_counts >= 3
+
+    coefficients = np.zeros((len(baselines), 3))
+    if np.any(fitted):
+        coefficients[fitted] = np.linalg.solve(normal_matrices[fitted], rhs[fitted][:, :, np.newaxis])[:, :, 0]
+
+    new_xs = np.linspace(x_min, x_max, num_points, axis=1)
+    new_t = (new_xs - center[:, np.newaxis]) / scale[:, np.newaxis]
+    new_ys = coefficients[:, :1] + coefficients[:, 1:2] * new_t + coefficients[:, 2:] * new_t ** 2
+    for line_num in np.flatnonzero(~fitted):
+        baseline = baselines[line_num]
+        new_ys[line_num] = np.poly1d(np.polyfit(baseline[:, 0], baseline[:, 1], 2))(new_xs[line_num])
+
+    return list(np.stack((new_xs, new_ys), axis=-1))
 
 
 def nonmaxima_suppression(input, element_size=(7,1)):
@@ -192,16 +256,81 @@ def nonmaxima_suppression(input, element_size=(7,1)):
     return input * (input == dilated)
 
 
+def label_pixel_groups(labels_img):
+    """Group pixels of a labeled image by label with a single sort.
+    :param labels_img: labeled image, 0 is background, labels are consecutive from 1
+    :return: rows and columns of labeled pixels ordered by label (row-major inside each label)
+        and boundaries of the label groups (number of labels + 1)
+    """
+    rows, cols = np.nonzero(labels_img)
+    labels = labels_img[rows, cols]
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=np.amax(labels_img, initial=0) + 1)[1:]
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return rows[order], cols[order], offsets
+
+
+def group_percentile(values, offsets, q):
+    """Percentile of each group of values, same as np.percentile with linear interpolation.
+    :param values: values ordered by group
+    :param offsets: boundaries of the groups, all groups have to be non-empty
+    :param q: percentile
+    """
+    counts = np.diff(offsets)
+    group_ids = np.repeat(np.arange(counts.shape[0]), counts)
+    sorted_values = values[np.lexsort((values, group_ids))]
+    positions = (counts - 1) * (q / 100)
+    lower = np.floor(positions).astype(np.int64)
+    fraction = positions - lower
+    a = sorted_values[offsets[:-1] + lower]
+    b = sorted_values[offsets[:-1] + np.ceil(positions).astype(np.int64)]
+    return np.where(fraction >= 0.5, b - (b - a) * (1 - fraction), a + (b - a) * fraction)
+
+
+def group_baseline_points(rows, cols, offsets, max_points=10):
+    """Baseline points of pixel groups. For each column of a group, its top pixel is taken, at most max_points
+    (at least 2) of these are selected evenly along the group.
+    :param rows: rows of pixels ordered by group
+    :param cols: columns of pixels ordered by group
+    :param offsets: boundaries of the groups
+    :return: list of point arrays (x, y) of each group
+    """
+    group_count = offsets.shape[0] - 1
+    if group_count == 0:
+        return []
+    group_ids = np.repeat(np.arange(group_count), np.diff(offsets))
+    order = np.lexsort((rows, cols, group_ids))
+    group_ids, rows, cols = group_ids[order], rows[order], cols[order]
+
+    column_start = np.ones(group_ids.shape[0], dtype=bool)
+    column_start[1:] = (group_ids[1:] != group_ids[:-1]) | (cols[1:] != cols[:-1])
+    group_ids, rows, cols = group_ids[column_start], rows[column_start], cols[column_start]
+
+    column_counts = np.bincount(group_ids, minlength=group_count)
+    column_offsets = np.concatenate([[0], np.cumsum(column_counts)])
+    point_counts = np.maximum(np.minimum(max_points, column_counts // 10), 2)
+
+    # same as np.linspace(0, column_count - 1, point_count).astype(np.int32) for each group
+    point_groups = np.repeat(np.arange(group_count), point_counts)
+    point_ends = np.cumsum(point_counts)
+    k = np.arange(point_groups.shape[0]) - np.repeat(point_ends - point_counts, point_counts)
+    step = (column_counts - 1) / (point_counts - 1)
+    selected = k * step[point_groups]
+    last = k == point_counts[point_groups] - 1
+    selected[last] = (column_counts - 1)[point_groups[last]]
+    selected = selected.astype(np.int32) + column_offsets[:-1][point_groups]
+
+    points = np.stack([cols[selected], rows[selected]], axis=1)
+    return np.split(points, point_ends[:-1])
+
+
 def filter_list(items_list, indices_to_remove):
     """Remove list items by their indices.
     :param items_list: target list
     :param indices_to_remove: indices of items to be removed from target list
     """
-    items_to_remove = list()
-    [items_to_remove.append(items_list[index_to_remove]) for index_to_remove in indices_to_remove]
-    [items_list.remove(item_to_remove) for item_to_remove in items_to_remove]
-
-    return items_list
+    indices_to_remove = set(indices_to_remove)
+    return [item for index, item in enumerate(items_list) if index not in indices_to_remove]
 
 
 def mask_textline_by_region(baseline, textline, region):
@@ -217,6 +346,10 @@ def mask_textline_by_region(baseline, textline, region):
     if not region_shpl.is_valid:
         warnings.warn("Input region contains self-intersections, replacing it with convex hull...")
         region_shpl = region_shpl.convex_hull
+    return clip_textline_by_region(baseline_shpl, textline_shpl, region_shpl)
+
+
+def clip_textline_by_region(baseline_shpl, textline_shpl, region_shpl):
     baseline_is = region_shpl.intersection(baseline_shpl)
     textline_is = region_shpl.intersection(textline_shpl)
     if isinstance(baseline_is, shapely.geometry.LineString) and isinstance(textline_is, shapely.geometry.Polygon) and baseline_is.length>2:
@@ -225,6 +358,55 @@ def mask_textline_by_region(baseline, textline, region):
         return None, None
 
 
+def mask_textlines_by_regions(baselines, textlines, regions):
+    """Mask all textlines by all regions. Same as mask_textline_by_region for each line and region pair,
+    but candidate lines of a region are found by a spatial index and lines covered by the region are kept
+    without computing intersections.
+    :param baselines: list of baselines
+    :param textlines: list of respective textline polygons
+    :param regions: list of region polygons
+    :return: list of (line index, masked baseline, masked textline) tuples of each region
+    """
+    assigned = [[] for _ in regions]
+    if not len(baselines) or not len(regions):
+        return assigned
+
+    baselines_shpl = shapely.linestrings(
+        np.concatenate(baselines), indices=np.repeat(np.arange(len(baselines)), [len(b) for b in baselines]))
+    textlines_shpl = shapely.polygons(shapely.linearrings(
+        np.concatenate(textlines), indices=np.repeat(np.arange(len(textlines)), [len(t) for t in textlines])))
+    invalid = ~shapely.is_valid(textlines_shpl)
+    textlines_shpl[invalid] = shapely.convex_hull(textlines_shpl[invalid])  # this can happen after merging two lines
+    long_enough = shapely.length(baselines_shpl) > 2
+    tree = shapely.STRtree(baselines_shpl)
+
+    for region_assigned, region in zip(assigned, regions):
+        region_shpl = shapely.geometry.Polygon(region)
+        candidates = np.sort(tree.query(region_shpl, predicate='intersects'))
+        if not candidates.size:
+            continue
+        if not region_shpl.is_valid:
+            warnings.warn("Input region contains self-intersections, replacing it with convex hull...")
+            region_shpl = region_shpl.convex_hull
+        shapely.prepare(region_shpl)
+
+        covered = shapely.covers(region_shpl, baselines_shpl[candidates]) & \
+            shapely.covers(region_shpl, textlines_shpl[candidates])
+        for line_num, is_covered in zip(candidates, covered):
+            if is_covered:
+                if long_enough[line_num]:
+                    region_assigned.append((
+                        line_num, shapely.get_coordinates(baselines_shpl[line_num]),
+                        shapely.get_coordinates(textlines_shpl[line_num].exterior)))
+            else:
+                baseline_is, textline_is = clip_textline_by_region(
+                    baselines_shpl[line_num], textlines_shpl[line_num], region_shpl)
+                if baseline_is is not None:
+                    region_assigned.append((line_num, baseline_is, textline_is))
+
+    return assigned
+
+
 def baseline_to_textline(baseline, heights):
     """Convert baseline coords and its respective heights to a textline polygon.
     :param baseline: baseline coords
@@ -242,6 +424,33 @@ def baseline_to_textline(baseline, heights):
     return pos_t
 
 
+def baselines_to_textlines(baselines, heights):
+    """Convert baselines and their respective heights to textline polygons, same as baseline_to_textline
+    for each baseline.
+    :param baselines: list of baselines
+    :param heights: list of textline heights
+    """
+    if len(baselines) == 0:
+        return []
+    points, offsets = concatenate_lines(baselines)
+    points = points.astype(np.float32)
+    counts = np.diff(offsets)
+    heights = np.asarray(heights).astype(np.float32).reshape(-1, 2)
+    heights = np.repeat(heights, counts, axis=0)
+    pos_up = points.copy()
+    pos_up[:, 1] -= heights[:, 0]
+    pos_down = points
+    pos_down[:, 1] += heights[:, 1]
+
+    # each textline goes along its baseline above it and back along it below it
+    line_starts = np.repeat(offsets[:-1], counts)
+    position = np.arange(points.shape[0]) - line_starts
+    textlines = np.empty((2 * points.shape[0], 2), dtype=np.float32)
+    textlines[2 * line_starts + position] = pos_up
+    textlines[2 * line_starts + 2 * np.repeat(counts, counts) - 1 - position] = pos_down
+    return np.split(textlines, 2 * offsets[1:-1])
+
+
 def get_rotation(lines):
     """Get mean baseline tilt as angle.
     :param baselines: list of baselines
@@ -280,12 +489,34 @@ def rotate_coords(coords, rotation, center):
     :param center: center of rotation
     """
     M = cv2.getRotationMatrix2D((center), rotation, 1)
-    change_coords = [[item[0], item[1]] for item in coords]
-    coords = np.array([change_coords])
-    rotated_coords = cv2.transform(coords, M)[0]
-    out_coords = [[item[0], item[1]] for item in rotated_coords]
+    coords = np.ascontiguousarray(coords)
+    return cv2.transform(coords[np.newaxis], M)[0]
+
+
+def rotate_lines(lines, rotation, center):
+    """Rotate all lines around given center point with a single transform, same as rotate_coords of each line.
+    :param lines: list of point arrays
+    :param rotation: rotation angle
+    :param center: center of rotation
+    """
+    if len(lines) == 0:
+        return []
+    lines = [np.asarray(line) for line in lines]
+    if len({line.dtype for line in lines}) > 1:
+        # integer coordinates are rounded by the transform, they can not be mixed with others
+        return [rotate_coords(line, rotation, center) for line in lines]
+    points, offsets = concatenate_lines(lines)
+    return np.split(rotate_coords(points, rotation, center), offsets[1:-1])
+
+
+def concatenate_lines(lines):
+    """Concatenate points of lines into a single array.
+    :param lines: list of point arrays
+    :return: concatenated points and boundaries of the lines
+    """
+    offsets = np.concatenate([[0], np.cumsum([len(line) for line in lines])]).astype(np.int64)
+    return np.concatenate(lines, axis=0), offsets
 
-    return np.asarray(out_coords)
 
 def adjust_baselines_to_intensity(baselines, img, tolerance=5):
     grad_img = np.gradient(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float))[0]
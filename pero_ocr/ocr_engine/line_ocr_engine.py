@@ -10,6 +10,7 @@ from scipy import sparse
 import tensorflow as tf
 
 from .CTC_nets import build_eval_net, line_nets
+from pero_ocr import tf_utils
 from .softmax import softmax
 
 
@@ -87,11 +88,19 @@ class BaseEngineLineOCR(object):
 
 
 class EngineLineOCR(BaseEngineLineOCR):
-    def __init__(self, json_def, gpu_id=0, batch_size=8):
+    def __init__(self, json_def, gpu_id=0, batch_size=8, intra_op_threads=None, inter_op_threads=None):
         super(EngineLineOCR, self).__init__(json_def, gpu_id=0, batch_size=8)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
 
+        self.data_shape = [self.batch_size, self.line_px_height, None, 3]
+        if tf_utils.has_frozen_graph(self.checkpoint):
+            self.load_frozen_graph(use_cpu=gpu_id is None)
+        else:
+            self.build_graph(use_cpu=gpu_id is None)
+
+    def build_graph(self, use_cpu=False):
         self.net_graph = tf.Graph()
-        tf.reset_default_graph()
         with self.net_graph.as_default():
             net = line_nets[self.net_name]
             (saver, input_data, _, seq_len, logits, logits_t, decoded, _) = build_eval_net(
@@ -104,22 +113,48 @@ class EngineLineOCR(BaseEngineLineOCR):
         self.saver = saver
         self.input_data = input_data
 
-        if gpu_id is None:
-            config = tf.ConfigProto(device_count={'GPU': 0})
-        else:
-            config = tf.ConfigProto(device_count={'GPU': 1})
-            config.gpu_options.allow_growth = True
-        self.session = tf.Session(graph=self.net_graph, config=config)
+        self.session = tf.Session(graph=self.net_graph, config=tf_utils.session_config(
+            use_cpu, self.intra_op_threads, self.inter_op_threads))
         self.saver.restore(self.session, self.checkpoint)
 
-        self.data_shape = [self.batch_size, self.line_px_height, None, 3]
-        self.data_shape[2] = 128
+        data_shape = list(self.data_shape)
+        data_shape[2] = 128
         out_logits, = self.session.run(
             [self.out_logits],
-            feed_dict={self.input_data: np.zeros(self.data_shape, dtype=np.uint8)}
+            feed_dict={self.input_data: np.zeros(data_shape, dtype=np.uint8)}
         )
-        self.net_subsampling = self.data_shape[2] / out_logits.shape[1]
-        self.data_shape[2] = None
+        self.net_subsampling = data_shape[2] / out_logits.shape[1]
+
+    def load_frozen_graph(self, use_cpu=False):
+        """Load graph exported by export_frozen_graph, net subsampling is taken from its metadata.
+        """
+        self.session, metadata = tf_utils.load_frozen_graph(
+            self.checkpoint, use_cpu=use_cpu,
+            intra_op_threads=self.intra_op_threads, inter_op_threads=self.inter_op_threads)
+        self.net_graph = self.session.graph
+        tensors = {key: self.net_graph.get_tensor_by_name(name) for key, name in metadata['tensors'].items()}
+
+        self.net_subsampling = metadata['net_subsampling']
+        self.input_data = tensors['input_data']
+        self.in_seq_len = tensors['seq_len']
+        self.out_logits = tensors['logits']
+        with self.net_graph.as_default():
+            self.out_decoded = [tf.SparseTensor(tensors['decoded_indices'], tensors['decoded_values'], tensors['decoded_shape'])]
+        self.saver = None
+
+    def export_frozen_graph(self):
+        tensors = {
+            'input_data': self.input_data.name,
+            'seq_len': self.in_seq_len.name,
+            'logits': self.out_logits.name,
+            'decoded_indices': self.out_decoded[0].indices.name,
+            'decoded_values': self.out_decoded[0].values.name,
+            'decoded_shape': self.out_decoded[0].dense_shape.name,
+        }
+        outputs = [tensors['logits'], tensors['decoded_indices'], tensors['decoded_values'], tensors['decoded_shape']]
+        metadata = {'tensors': tensors, 'net_subsampling': self.net_subsampling, 'net_name': self.net_name}
+        return tf_utils.export_frozen_graph(
+            self.session, self.checkpoint, [tensors['input_data'], tensors['seq_len']], outputs, metadata=metadata)
 
     def run_ocr(self, batch_data):
         seq_lengths = np.ones([self.batch_size], dtype=np.int32) * batch_data.shape[2] / self.net_subsampling
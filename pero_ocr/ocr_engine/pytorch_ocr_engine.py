@@ -24,9 +24,13 @@ def greedy_decode_ctc(scores_probs, chars):
 
 
 class PytorchEngineLineOCR(BaseEngineLineOCR):
-    def __init__(self, json_def, gpu_id=0, batch_size=8):
+    def __init__(self, json_def, gpu_id=0, batch_size=8, intra_op_threads=None):
         super(PytorchEngineLineOCR, self).__init__(json_def, gpu_id=0, batch_size=8)
 
+        if intra_op_threads is not None:
+            # PyTorch has a single thread pool per process, the last engine setting it wins
+            torch.set_num_threads(intra_op_threads)
+
         self.net_subsampling = 4
         self.characters = list(self.characters) + ['|']
         self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
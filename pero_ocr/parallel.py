@@ -0,0 +1,178 @@
+import os
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+# set in threads and processes of the shared pools to run nested maps serially instead of deadlocking the pool
+_worker_flag = threading.local()
+
+
+def _init_process_worker():
+    _worker_flag.active = True
+
+
+def _run_in_thread_worker(func, item):
+    _worker_flag.active = True
+    try:
+        return func(item)
+    finally:
+        _worker_flag.active = False
+
+
+class SharedExecutor(object):
+    """Lazily created thread and process pools shared by all page parser components.
+    For each map, execution mode (serial, threads, processes) is chosen by estimated cost of the work.
+    """
+    def __init__(self, max_workers=None, serial_threshold=0.005, process_overhead=0.002):
+        """
+        :param max_workers: size of the pools, number of CPUs by default
+        :param serial_threshold: total estimated work (seconds) below which maps run serially
+        :param process_overhead: estimated per item overhead (seconds) of dispatching work to a process
+        """
+        self.max_workers = max_workers if max_workers else os.cpu_count()
+        self.serial_threshold = serial_threshold
+        self.process_overhead = process_overhead
+        self._thread_pool = None
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def thread_pool(self):
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(self.max_workers)
+            return self._thread_pool
+
+    @property
+    def process_pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                # spawn, as forking a process with initialized TensorFlow/CUDA is not safe
+                self._process_pool = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_process_worker)
+            return self._process_pool
+
+    def choose_mode(self, item_count, cost=0.0, releases_gil=False, transfer_cost=0.0):
+        """Choose how to execute a map.
+        :param item_count: number of work items
+        :param cost: estimated compute time of a single item (seconds)
+        :param releases_gil: the work runs mostly in code releasing the GIL (numpy, OpenCV, TensorFlow)
+        :param transfer_cost: estimated time to pickle a single item and its result (seconds)
+        :return: 'serial', 'thread' or 'process'
+        """
+        if getattr(_worker_flag, 'active', False):
+            return 'serial'
+        if self.max_workers <= 1 or item_count <= 1 or cost * item_count < self.serial_threshold:
+            return 'serial'
+        if releases_gil:
+            return 'thread'
+        if cost > transfer_cost + self.process_overhead:
+            return 'process'
+        return 'serial'
+
+    def map(self, func, items, cost=0.0, releases_gil=False, transfer_cost=0.0):
+        """Apply func to all items, see choose_mode for the parameters.
+        Func and items have to be picklable when processes can be chosen.
+        :return: list of results in order of items
+        """
+        items = list(items)
+        mode = self.choose_mode(len(items), cost=cost, releases_gil=releases_gil, transfer_cost=transfer_cost)
+        if mode == 'thread':
+            return list(self.thread_pool.map(_run_in_thread_worker, [func] * len(items), items))
+        elif mode == 'process':
+            chunksize = max(1, len(items) // (4 * self.max_workers))
+            return list(self.process_pool.map(func, items, chunksize=chunksize))
+        else:
+            return [func(item) for item in items]
+
+    def shutdown(self):
+        with self._lock:
+            if self._thread_pool is not None:
+                self._thread_pool.shutdown()
+                self._thread_pool = None
+            if self._process_pool is not None:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+
+_executor = None
+
+
+def get_executor():
+    """Shared executor of the current process, created on first use.
+    """
+    global _executor
+    if _executor is None:
+        _executor = SharedExecutor()
+    return _executor
+
+
+def configure_executor(max_workers=None, **kwargs):
+    """Replace the shared executor by one with given parameters (see SharedExecutor).
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+    _executor = SharedExecutor(max_workers=max_workers, **kwargs)
+    return _executor
+
+
+# number of compute threads of the current process, None means library defaults
+_thread_budget = None
+
+THREAD_ENVIRONMENT_VARIABLES = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMBA_NUM_THREADS']
+
+
+def split_cores(workers, cores=None):
+    """Split cores of a node among worker processes, each worker gets at least one thread.
+    :param workers: number of worker processes
+    :param cores: number of cores to split, all CPUs of the node by default
+    :return: list of thread counts, one per worker
+    """
+    cores = cores if cores else os.cpu_count()
+    base, remainder = divmod(cores, workers)
+    return [max(1, base + (1 if i < remainder else 0)) for i in range(workers)]
+
+
+def set_thread_environment(threads):
+    """Thread limits of numerical libraries read at their import, in this process and in spawned processes.
+    """
+    for variable in THREAD_ENVIRONMENT_VARIABLES:
+        os.environ[variable] = str(threads)
+
+
+def get_thread_budget():
+    return _thread_budget
+
+
+def set_thread_budget(threads):
+    """Limit compute threads of the current process. The limit is applied to already imported libraries
+    and, through environment variables, to libraries imported later. TensorFlow sessions created afterwards
+    use it as their default number of intra-op threads (see tf_utils.session_config).
+    :param threads: number of threads, None keeps library defaults
+    """
+    global _thread_budget
+    _thread_budget = threads
+    if threads is not None:
+        set_thread_environment(threads)
+    apply_thread_budget()
+
+
+def apply_thread_budget():
+    """Apply the thread budget to OpenCV, PyTorch and numba, if they are imported.
+    Call again after importing them, as they are not imported here not to load them needlessly.
+    """
+    threads = _thread_budget
+    if threads is None:
+        return
+    if 'cv2' in sys.modules:
+        sys.modules['cv2'].setNumThreads(threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    if 'numba' in sys.modules:
+        numba = sys.modules['numba']
+        # numba can not use more threads than it was started with
+        numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
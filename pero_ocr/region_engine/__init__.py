@@ -1,2 +1,12 @@
-from .region_engine import EngineRegionDetector
-from .simple_threshold_region_engine import SimpleThresholdRegion
+# engines are imported on first access, so that importing a single engine does not import all of their dependencies
+_lazy_attributes = {
+    'EngineRegionDetector': '.region_engine',
+    'SimpleThresholdRegion': '.simple_threshold_region_engine',
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        import importlib
+        return getattr(importlib.import_module(_lazy_attributes[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
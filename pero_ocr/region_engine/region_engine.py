@@ -1,4 +1,3 @@
-import tensorflow as tf
 import numpy as np
 import cv2
 
@@ -16,13 +15,39 @@ import shapely.geometry
 from pyamg import smoothed_aggregation_solver
 
 from pero_ocr.region_engine import spectral_clustering as sc
+from pero_ocr.canvas_pool import CanvasPool, fill_canvas
+
+
+def open_labels(labels, size):
+    """Morphological opening of each label of a label image by a square structure element.
+    Each label is processed only in its bounding box (with a margin of the structure size), so memory and time
+    do not grow with the number of labels times the image size. Labels are disjoint and opening only shrinks
+    them, so the opened labels are disjoint as well.
+    :param labels: label image, 0 is background
+    :param size: size of the square structure element
+    :return: label image with opened labels, pixels removed by the opening are 0
+    """
+    structure = np.ones((size, size), dtype=bool)
+    opened = np.zeros(labels.shape, dtype=np.int64)
+    for index, bbox in enumerate(ndimage.find_objects(labels)):
+        if bbox is None:
+            continue
+        value = index + 1
+        roi = tuple(slice(max(0, s.start - size), min(dim, s.stop + size)) for s, dim in zip(bbox, labels.shape))
+        mask = labels[roi] == value
+        # border of the image is background, as in erosion of the whole image
+        mask = ndimage.binary_erosion(mask, structure=structure)
+        mask = ndimage.binary_dilation(mask, structure=structure)
+        opened[roi][mask] = value
+    return opened
+
 
 class EngineRegionDetector(object):
 
     def __init__(self, model_path, downsample=4, use_cpu=False,
                  reduce_factor=4, n_components=16,
                  scale=400, sigma=0.02, min_size=400,
-                 median_smooth=(5,5,1), smooth=5):
+                 median_smooth=(5,5,1), smooth=5, intra_op_threads=None, inter_op_threads=None):
 
         self.downsample = downsample # downsample factor before CNN inference
         self.reduce_factor = reduce_factor # another downsample factor before spectral clustering (target shouldn't be much bigger than 256 x 256)
@@ -33,15 +58,17 @@ class EngineRegionDetector(object):
         self.min_size = min_size # felzenszwalb parameter: minimum cluster size, works strangely, see skimage docs
         self.smooth = smooth # structure element of morphological posprocessing (bigger means more compact cluster shapes)
         self.simplification = 3 # error threshold for bounding polygon point removal for easier editing
+        self.canvas_pool = CanvasPool()
+        self.embedding_cache = sc.SpectralEmbeddingCache() # eigenvectors of the previous page warm-start the next one
+
+        from pero_ocr import tf_utils
+        self.model_path = model_path
+        self.session, _ = tf_utils.load_model(model_path, use_cpu=use_cpu,
+                                              intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
 
-        saver = tf.train.import_meta_graph(model_path + '.meta')
-        if use_cpu:
-            tf_config = tf.ConfigProto(device_count={'GPU': 0})
-        else:
-            tf_config = tf.ConfigProto(device_count={'GPU': 1})
-            tf_config.gpu_options.allow_growth = True
-        self.session = tf.Session(config=tf_config)
-        saver.restore(self.session, model_path)
+    def export_frozen_graph(self):
+        from pero_ocr import tf_utils
+        return tf_utils.export_frozen_graph(self.session, self.model_path, ['inference_input:0'], ['inderence:0'])
 
     def detect(self, image):
         out_map = self.get_maps(image)
@@ -70,18 +97,17 @@ class EngineRegionDetector(object):
             new_shape_x += 1
         while not new_shape_y % 64 == 0:
             new_shape_y += 1
-        test_img_canvas = np.zeros((1, new_shape_x, new_shape_y, 3))
-        test_img_canvas[0, :img.shape[0], :img.shape[1], :] = img
-
-        out_map = self.session.run('inderence:0', feed_dict={'inference_input:0': test_img_canvas[:,:,:]/256.})
+        with self.canvas_pool.canvas((1, new_shape_x, new_shape_y, 3)) as test_img_canvas:
+            fill_canvas(test_img_canvas[0], img, scale=1/256.)
+            out_map = self.session.run('inderence:0', feed_dict={'inference_input:0': test_img_canvas})
         out_map = out_map[0, :img.shape[0], :img.shape[1], :]
 
         return out_map
 
     def cluster_image(self, img):
         edge_img = skeletonize(block_reduce(img[:,:,2], (self.reduce_factor, self.reduce_factor), func=np.amax)>0.1).astype(np.float64)
-        adjacency = sc.img_to_graph(edge_img)
-        eigenvectors = sc.spectral_embedding(adjacency, n_components=self.n_components)
+        adjacency = sc.img_to_graph_2d(edge_img)
+        eigenvectors = self.embedding_cache.embed(adjacency, edge_img.shape, n_components=self.n_components)
 
         eigenvectors = eigenvectors/np.amax(eigenvectors)
         eigenvectors = np.reshape(eigenvectors, (edge_img.shape[0],edge_img.shape[1], self.n_components))
@@ -93,10 +119,4 @@ class EngineRegionDetector(object):
         labels[np.argmax(img, axis=2)==0] = 0
         labels[np.argmax(img, axis=2)==1] += 1
 
-        labels_post = np.zeros((labels.shape[0], labels.shape[1], np.amax(labels)+1))
-        for i in range(1, np.amax(labels)+1):
-            labels_post[:,:,i] = labels == i
-        labels_post = ndimage.morphology.binary_erosion(labels_post, structure=np.ones((self.smooth, self.smooth, 1)))
-        labels_post = ndimage.morphology.binary_dilation(labels_post, structure=np.ones((self.smooth, self.smooth, 1)))
-
-        return np.argmax(labels_post, axis=2)
+        return open_labels(labels, self.smooth)
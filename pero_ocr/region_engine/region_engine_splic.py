@@ -1,4 +1,3 @@
-import tensorflow as tf
 import numpy as np
 import cv2
 import hdbscan
@@ -8,32 +7,38 @@ from scipy.spatial import Delaunay
 
 from skimage.measure import block_reduce
 from sklearn.metrics import pairwise_distances
+import shapely
 import shapely.geometry
-from shapely.ops import cascaded_union, polygonize
+from shapely.ops import unary_union, polygonize
 
 from pero_ocr.line_engine import line_postprocessing as pp
+from pero_ocr.canvas_pool import CanvasPool, fill_canvas
 from pero_ocr.region_engine import spectral_clustering as sc
 
 
 class EngineRegionSPLIC(object):
 
     def __init__(self, model_path, downsample=4, use_cpu=False,
-                 reduce_factor=8, n_components=24, min_size=2, pad=52):
+                 reduce_factor=8, n_components=24, min_size=2, pad=52,
+                 intra_op_threads=None, inter_op_threads=None):
 
         self.downsample = downsample # downsample factor before CNN inference
         self.reduce_factor = reduce_factor # another downsample factor before spectral clustering (target shouldn't be much bigger than 256 x 256)
         self.n_components = n_components # neumber of eigenvectors for clustering
         self.pad = pad # CNN training pad
         self.min_size = min_size # minimum cluster size
+        self.text_height = None # median text height of the last page in input image pixels
+        self.canvas_pool = CanvasPool()
+        self.embedding_cache = sc.SpectralEmbeddingCache() # eigenvectors of the previous page warm-start the next one
 
-        saver = tf.train.import_meta_graph(model_path + '.meta')
-        if use_cpu:
-            tf_config = tf.ConfigProto(device_count={'GPU': 0})
-        else:
-            tf_config = tf.ConfigProto(device_count={'GPU': 1})
-            tf_config.gpu_options.allow_growth = True
-        self.session = tf.Session(config=tf_config)
-        saver.restore(self.session, model_path)
+        from pero_ocr import tf_utils
+        self.model_path = model_path
+        self.session, _ = tf_utils.load_model(model_path, use_cpu=use_cpu,
+                                              intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+
+    def export_frozen_graph(self):
+        from pero_ocr import tf_utils
+        return tf_utils.export_frozen_graph(self.session, self.model_path, ['test_dataset:0'], ['test_probs:0'])
 
     def detect(self, image):
 
@@ -70,7 +75,7 @@ class EngineRegionSPLIC(object):
             region_poly = alpha_shape(region_poly_points, max_alpha)
 
             if region_poly.geom_type == 'MultiPolygon':
-                for poly in region_poly:
+                for poly in region_poly.geoms:
                     polygons_list.append(poly.simplify(5).exterior.coords)
             elif region_poly.geom_type == 'Polygon':
                 polygons_list.append(region_poly.simplify(5).exterior.coords)
@@ -84,15 +89,13 @@ class EngineRegionSPLIC(object):
     def get_maps(self, img):
 
         img = cv2.resize(img, (0,0), fx=1/self.downsample, fy=1/self.downsample, interpolation=cv2.INTER_AREA)
-        img = np.pad(img, [(self.pad, self.pad), (self.pad, self.pad), (0,0)], 'constant')
 
-        new_shape_x = int(np.ceil(img.shape[0] / 64) * 64)
-        new_shape_y = int(np.ceil(img.shape[1] / 64) * 64)
-        test_img_canvas = np.zeros((1, new_shape_x, new_shape_y, 3))
-        test_img_canvas[0, :img.shape[0], :img.shape[1], :] = img
-
-        out_map = self.session.run('test_probs:0', feed_dict={'test_dataset:0': test_img_canvas[:,:,:]/256.})
-        out_map = out_map[0, self.pad:img.shape[0]-self.pad, self.pad:img.shape[1]-self.pad, :]
+        new_shape_x = int(np.ceil((img.shape[0] + 2 * self.pad) / 64) * 64)
+        new_shape_y = int(np.ceil((img.shape[1] + 2 * self.pad) / 64) * 64)
+        with self.canvas_pool.canvas((1, new_shape_x, new_shape_y, 3)) as test_img_canvas:
+            fill_canvas(test_img_canvas[0], img, offset=(self.pad, self.pad), scale=1/256.)
+            out_map = self.session.run('test_probs:0', feed_dict={'test_dataset:0': test_img_canvas})
+        out_map = out_map[0, self.pad:self.pad + img.shape[0], self.pad:self.pad + img.shape[1], :]
 
         return out_map
 
@@ -100,6 +103,7 @@ class EngineRegionSPLIC(object):
         recompute = False
         heights = (out_map[:,:,2] > 0.2).astype(np.float) * (out_map[:,:,0] + out_map[:,:,1])
         med_height = np.median(heights[heights>0])
+        self.text_height = med_height * self.downsample
         if med_height <= 6 or med_height > 18:
             self.downsample = max(1, self.downsample * (med_height / 12))
             recompute = True
@@ -107,6 +111,14 @@ class EngineRegionSPLIC(object):
         return recompute
 
 
+    def adapt_downsample(self, text_height):
+        """Set downsample for a known text height, so that update_ds does not have to recompute the maps.
+        :param text_height: median text height in input image pixels
+        """
+        med_height = text_height / self.downsample
+        if med_height <= 6 or med_height > 18:
+            self.downsample = max(1, text_height / 12)
+
     def parse_maps(self, out_map):
         """Parse input baseline, height and region map into list of baselines coords, heights and embd
         :param baseline_map: array of baseline and endpoint probabilities
@@ -126,57 +138,49 @@ class EngineRegionSPLIC(object):
                                             reduce_factor=self.reduce_factor)
 
         baselines_img, num_detections = ndimage.measurements.label(baselines_map, structure=np.ones((3, 3)))
-        inds = np.where(baselines_img > 0)
-        labels = baselines_img[inds[0], inds[1]]
-
-        for i in range(1, num_detections+1):
-            bl_inds, = np.where(labels == i)
-            if len(bl_inds) > 5:
-                pos_all = np.stack([inds[1][bl_inds], inds[0][bl_inds]], axis=1)  # go from matrix indexing to image indexing
-
-                _, indices = np.unique(pos_all[:, 0], return_index=True)
-                pos = pos_all[indices]
-                x_index = np.argsort(pos[:, 0])
-                pos = pos[x_index]
-
-                target_point_count = min(10, pos.shape[0] // 10)
-                target_point_count = max(target_point_count, 2)
-                selected_pos = np.linspace(0, (pos.shape[0]) - 1, target_point_count).astype(np.int32)
-
-                pos = pos[selected_pos, :]
-                pos[0,0] -= 2 # region edge detection bites out of baseline pixels, stretch to compensate
-                pos[-1,0] += 2
-
-                heights_pred = heights_map[inds[0][bl_inds], inds[1][bl_inds], :]
-
-                heights_pred = np.maximum(heights_pred, 0)
-                heights_pred = np.asarray([
-                    np.percentile(heights_pred[:, 0], 70),
-                    np.percentile(heights_pred[:, 1], 70)
-                ])
-
-                embd = embd_map[inds[0][bl_inds]-int(heights_pred[0]/2), np.clip(np.amin(inds[1][bl_inds]+5), 0, embd_map.shape[1]-1), :]
-                embd = np.average(embd, axis=0)
-                l_embd_list.append(embd)
-
-                embd = embd_map[inds[0][bl_inds]-int(heights_pred[0]/2), int(np.round(np.clip(np.average(inds[1][bl_inds]), 0, embd_map.shape[1]-1))), :]
-                embd = np.average(embd, axis=0)
-                m_embd_list.append(embd)
-
-                embd = embd_map[inds[0][bl_inds]-int(heights_pred[0]/2), np.clip(np.amax(inds[1][bl_inds]-5), 0, embd_map.shape[1]-1), :]
-                embd = np.average(embd, axis=0)
-                r_embd_list.append(embd)
-
-                baselines_list.append(self.downsample * pos.astype(np.float))
-                heights_list.append([self.downsample * heights_pred[0],
-                                     self.downsample * heights_pred[1]])
+        if num_detections == 0:
+            return baselines_list, heights_list, l_embd_list, m_embd_list, r_embd_list
+        rows, cols, offsets = pp.label_pixel_groups(baselines_img)
+        counts = np.diff(offsets)
+
+        heights_pred = np.maximum(heights_map[rows, cols], 0)
+        heights_pred = np.stack([
+            pp.group_percentile(heights_pred[:, 0], offsets, 70),
+            pp.group_percentile(heights_pred[:, 1], offsets, 70)
+        ], axis=1)
+        points = pp.group_baseline_points(rows, cols, offsets)
+
+        # embeddings are averaged over pixels half the text height above the baseline, in left, middle and right column
+        embd_rows = rows - np.repeat((heights_pred[:, 0] / 2).astype(np.int64), counts)
+        max_col = embd_map.shape[1] - 1
+        embd_cols = [
+            np.clip(np.minimum.reduceat(cols, offsets[:-1]) + 5, 0, max_col),
+            np.round(np.clip(np.add.reduceat(cols, offsets[:-1]) / counts, 0, max_col)).astype(np.int64),
+            np.clip(np.maximum.reduceat(cols, offsets[:-1]) - 5, 0, max_col)
+        ]
+        l_embd, m_embd, r_embd = [
+            np.add.reduceat(embd_map[embd_rows, np.repeat(embd_col, counts)], offsets[:-1], axis=0) / counts[:, np.newaxis]
+            for embd_col in embd_cols]
+
+        for i in np.nonzero(counts > 5)[0]:
+            pos = points[i]
+            pos[0,0] -= 2 # region edge detection bites out of baseline pixels, stretch to compensate
+            pos[-1,0] += 2
+
+            l_embd_list.append(l_embd[i])
+            m_embd_list.append(m_embd[i])
+            r_embd_list.append(r_embd[i])
+
+            baselines_list.append(self.downsample * pos.astype(np.float64))
+            heights_list.append([self.downsample * heights_pred[i, 0],
+                                 self.downsample * heights_pred[i, 1]])
 
         return baselines_list, heights_list, l_embd_list, m_embd_list, r_embd_list
 
     def edges_to_embd(self, edge_map, n_components=16, reduce_factor=4):
         edge_map_reduced  = block_reduce(edge_map, (reduce_factor,reduce_factor), func=np.amax).astype(np.float32)
-        adjacency = sc.img_to_graph(edge_map_reduced)
-        eigenvectors = sc.spectral_embedding(adjacency, n_components=n_components)
+        adjacency = sc.img_to_graph_2d(edge_map_reduced)
+        eigenvectors = self.embedding_cache.embed(adjacency, edge_map_reduced.shape, n_components=n_components)
 
         eigenvectors = np.reshape(eigenvectors, (edge_map_reduced.shape[0],edge_map_reduced.shape[1], n_components))
 
@@ -207,16 +211,22 @@ class EngineRegionSPLIC(object):
 
     def filter_polygons(self, polygon_coords_list, threshold=0.9):
         # this may potentially remove two very similar regions but those shouldnt happen in SPLIC method
-        polygons_list = [shapely.geometry.Polygon(coords) for coords in polygon_coords_list]
-        num_polys = len(polygons_list)
-        intersections = np.zeros((num_polys, num_polys))
-        for i in range(num_polys):
-            for j in range(num_polys):
-                if i != j:
-                    if polygons_list[i].intersects(polygons_list[j]):
-                        intersections[i, j] = polygons_list[i].intersection(polygons_list[j]).area / polygons_list[i].area
-        scores = np.amax(intersections, axis=1)
-        return [polygon_coords_list[i] for i in np.where(scores < threshold)[0]]
+        polygons = np.array([shapely.geometry.Polygon(coords) for coords in polygon_coords_list], dtype=object)
+        # only pairs of intersecting polygons found by the spatial index are intersected,
+        # the query prepares the polygons for the predicate
+        first, second = shapely.STRtree(polygons).query(polygons, predicate='intersects')
+        different = first != second
+        first, second = first[different], second[different]
+
+        # degenerate (zero-area) polygons are dropped
+        areas = shapely.area(polygons)
+        keep = areas > 0
+        first, second = first[keep[first] & keep[second]], second[keep[first] & keep[second]]
+
+        overlaps = shapely.area(shapely.intersection(polygons[first], polygons[second])) / areas[first]
+        scores = np.zeros(len(polygons))
+        np.maximum.at(scores, first, overlaps)
+        return [polygon_coords_list[i] for i in np.where(keep & (scores < threshold))[0]]
 
 def alpha_shape(points, alpha):
     if len(points) < 4:
@@ -240,4 +250,4 @@ def alpha_shape(points, alpha):
     edge_points = np.unique(np.concatenate((edge1,edge2,edge3)), axis = 0).tolist()
     m = shapely.geometry.MultiLineString(edge_points)
     triangles = list(polygonize(m))
-    return cascaded_union(triangles)
+    return unary_union(triangles)
@@ -11,39 +11,36 @@ class SimpleThresholdRegion:
     def __init__(self, config, config_path=''):
         pass
 
-    def process_page(self, img: np.ndarray, page_layout: PageLayout):
+    def process_page(self, img: np.ndarray, page_layout: PageLayout, document_context=None):
         polygons = SimpleThresholdRegion._compute_layout(img)
         page_layout.regions = [RegionLayout(f'r-{idx}', polygon[:, ::-1]) for idx, polygon in enumerate(polygons)]
         return page_layout
 
     @staticmethod
-    def _split_components(img_segment: np.ndarray, min_point_per_component=0):
+    def _split_components(labels: np.ndarray, stats: np.ndarray, min_point_per_component=0):
         """
-        Split all components so that each one is in separate array.
+        Split all components so that each one is in separate array cropped to its bounding box.
 
-        :param img_segment: array with connected components having positive values and background as -1
-                       (output of connectedComponents)
+        :param labels: label image with components having positive values and background 0
+                       (output of connectedComponentsWithStats)
+        :param stats: component statistics (output of connectedComponentsWithStats)
         :param min_point_per_component: if component is composed number of points smaller than given amount
                                         it is not returned
-        :return: array of components (numpy array where nonzero pixel is part of component)
+        :return: list of (component, (x, y)) pairs, component is uint8 crop of the label image where nonzero
+                 pixels are part of the component and (x, y) is position of the crop in the label image
         """
-
-        # get most common nonzero value
-        vals, counts = np.unique(img_segment, return_counts=True)
-        max_idxs = filter(lambda x: counts[x] if vals[x] != 0 and counts[x] >= min_point_per_component else 0,
-                          range(len(vals)))
-
-        # translate indices to values
-        max_ocurr_vals = [vals[max_idx] for max_idx in max_idxs]
-
+        height, width = labels.shape
         components = []
+        for value in range(1, stats.shape[0]):
+            x, y, w, h, area = stats[value]
+            if area < min_point_per_component:
+                continue
+            # one pixel around the component, so that its contour is the same as in the whole image
+            x1, y1 = max(0, x - 1), max(0, y - 1)
+            x2, y2 = min(width, x + w + 1), min(height, y + h + 1)
+            component = (labels[y1:y2, x1:x2] == value).astype(np.uint8)
+            components.append((component, (x1, y1)))
 
-        for max_val in max_ocurr_vals:
-            component = img_segment.copy()
-            component[component != max_val] = 0
-            components.append(component)
-
-        # return points
         return components
 
     @staticmethod
@@ -103,14 +100,14 @@ class SimpleThresholdRegion:
         mask = (dist < border_dist // downscale).astype(np.uint8)
 
         # segmentation
-        _, labels = cv2.connectedComponents(mask, connectivity=8)
-        components = SimpleThresholdRegion._split_components(labels, min_point_per_component // downscale)
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        components = SimpleThresholdRegion._split_components(labels, stats, min_point_per_component // downscale)
 
         regions = []
 
-        for component in components:
+        for component, offset in components:
             # sort polygon points
-            contours, _ = cv2.findContours(component.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
 
             if len(contours) == 0:
                 continue
@@ -1,4 +1,7 @@
+import functools
+
 import numpy as np
+import cv2
 import matplotlib.pyplot as plt
 from scipy.ndimage.morphology import distance_transform_edt
 from itertools import product
@@ -35,7 +38,20 @@ def set_diag(laplacian, value, norm_laplacian):
 def spectral_embedding(adjacency, n_components=8,
                        random_state=np.random.RandomState(), eigen_tol=0.0,
                        norm_laplacian=True, drop_first=True):
-
+    embedding, _, _ = solve_spectral_embedding(
+        adjacency, n_components=n_components, random_state=random_state,
+        norm_laplacian=norm_laplacian, drop_first=drop_first)
+    return embedding
+
+
+def solve_spectral_embedding(adjacency, n_components=8, random_state=np.random.RandomState(),
+                             norm_laplacian=True, drop_first=True, initial_vectors=None):
+    """Spectral embedding computed by LOBPCG preconditioned by an AMG hierarchy of the graph laplacian.
+    :param initial_vectors: approximation of the eigenvectors used as the LOBPCG start, e.g. eigenvectors returned
+        for a similar graph; n_nodes x (n_components + 2) if drop_first else n_nodes x (n_components + 1),
+        random start if None, of other shape or if LOBPCG fails from it
+    :return: embedding, eigenvectors of the laplacian (usable as initial_vectors), convergence stats
+    """
     n_nodes = adjacency.shape[0]
 
     # Whether to drop the first eigenvector
@@ -49,22 +65,28 @@ def spectral_embedding(adjacency, n_components=8,
                                 accept_sparse=True)
     laplacian = set_diag(laplacian, 1, norm_laplacian)
 
-    # AMG preconditioner
+    # AMG preconditioner, it depends on the exact laplacian, so it is built for every graph
     diag_shift = 1e-5 * sparse.eye(laplacian.shape[0])
     laplacian += diag_shift
     ml = smoothed_aggregation_solver(check_array(laplacian, 'csr'))
     M = ml.aspreconditioner()
     laplacian -= diag_shift
 
-
-    X = random_state.rand(laplacian.shape[0], n_components + 1)
+    warm_start = initial_vectors is not None and initial_vectors.shape == (n_nodes, n_components + 1)
+    if warm_start:
+        X = np.array(initial_vectors, dtype=np.float64)
+    else:
+        X = random_state.rand(laplacian.shape[0], n_components + 1)
     X[:, 0] = dd.ravel()
 
-    solved = False
+    stats = {'warm_start': warm_start, 'attempts': 0, 'iterations': 0, 'residual': None}
     for attempt_num in range(1, 4):
+        stats['attempts'] = attempt_num
         try:
-            _, diffusion_map = lobpcg(laplacian, X, tol=1.e-5,
-                                largest=False)
+            _, diffusion_map, residual_history = lobpcg(laplacian, X, M=M, tol=1.e-5,
+                                largest=False, retResidualNormsHistory=True)
+            stats['iterations'] = len(residual_history)
+            stats['residual'] = float(np.max(residual_history[-1]))
             break
         except:
             print('LOBPCG eigensolver failed, attempting to recondition on different eigenvector approximation (attempt {}/3)'.format(attempt_num))
@@ -79,9 +101,54 @@ def spectral_embedding(adjacency, n_components=8,
 
     embedding = deterministic_vector_sign_flip(embedding)
     if drop_first:
-        return embedding[1:n_components].T
+        return embedding[1:n_components].T, diffusion_map, stats
     else:
-        return embedding[:n_components].T
+        return embedding[:n_components].T, diffusion_map, stats
+
+
+class SpectralEmbeddingCache(object):
+    """Spectral embeddings of consecutive images warm-started from the eigenvectors of the previous image.
+    Pages of a document lead to similar graphs, LOBPCG then needs fewer iterations than from a random start.
+    """
+    def __init__(self):
+        self.shape = None # grid shape of the cached eigenvectors
+        self.diffusion_map = None
+        self.document_id = None # document of the cached eigenvectors
+        self.stats = None # convergence stats of the last embedding
+
+    def clear(self):
+        self.shape = None
+        self.diffusion_map = None
+
+    def begin_page(self, document_id=None):
+        """Keep the cached eigenvectors only for a page of the same document as the previous page.
+        :param document_id: id of the document of the page (see DocumentContext), None for an independent page
+        """
+        if document_id is None or document_id != self.document_id:
+            self.clear()
+        self.document_id = document_id
+
+    def initial_vectors(self, shape):
+        """Cached eigenvectors resized to a grid of given shape.
+        """
+        if self.diffusion_map is None:
+            return None
+        vectors = self.diffusion_map.reshape(self.shape[0], self.shape[1], -1)
+        if tuple(shape) != self.shape:
+            vectors = cv2.resize(vectors, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+        return vectors.reshape(shape[0] * shape[1], -1)
+
+    def embed(self, adjacency, shape, n_components=8):
+        """Spectral embedding of the graph of an image grid, see spectral_embedding.
+        :param adjacency: graph of the image grid (e.g. from img_to_graph)
+        :param shape: shape of the image grid
+        """
+        shape = tuple(shape[:2])
+        embedding, diffusion_map, self.stats = solve_spectral_embedding(
+            adjacency, n_components=n_components, initial_vectors=self.initial_vectors(shape))
+        self.shape = shape
+        self.diffusion_map = diffusion_map
+        return embedding
 
 
 def make_edges_3d(n_x, n_y, n_z=1):
@@ -145,7 +212,7 @@ def to_graph(n_x, n_y, n_z, mask=None, img=None,
 
     if dtype is None:
         if img is None:
-            dtype = np.int
+            dtype = int
         else:
             dtype = img.dtype
 
@@ -160,8 +227,8 @@ def to_graph(n_x, n_y, n_z, mask=None, img=None,
         n_voxels = diag.size
     else:
         if mask is not None:
-            mask = mask.astype(dtype=np.bool, copy=False)
-            mask = np.asarray(mask, dtype=np.bool)
+            mask = mask.astype(dtype=bool, copy=False)
+            mask = np.asarray(mask, dtype=bool)
             edges = mask_edges_weights(mask, edges)
             n_voxels = np.sum(mask)
         else:
@@ -182,7 +249,56 @@ def to_graph(n_x, n_y, n_z, mask=None, img=None,
     return return_as(graph)
 
 
+@functools.lru_cache(maxsize=8)
+def grid_graph_template(n_x, n_y):
+    """CSR structure of a 4-connected grid graph with self loops, shared by all images of the same shape.
+    Neighbours of each node are in column order: up, left, self, right, down.
+    :return: indptr, indices, row of each entry, mask of diagonal entries (all read-only)
+    """
+    nodes = np.arange(n_x * n_y).reshape(n_x, n_y)
+    offsets = [-n_y, -1, 0, 1, n_y]
+    valid = np.zeros((5, n_x, n_y), dtype=bool)
+    valid[0, 1:, :] = True
+    valid[1, :, 1:] = True
+    valid[2] = True
+    valid[3, :, :-1] = True
+    valid[4, :-1, :] = True
+
+    # entries ordered by row and then by column, as neighbour offsets are increasing
+    valid = valid.reshape(5, -1).T
+    rows = np.broadcast_to(nodes.reshape(-1, 1), valid.shape)[valid]
+    indices = (nodes.reshape(-1, 1) + np.asarray(offsets))[valid]
+    indptr = np.concatenate([[0], np.cumsum(valid.sum(axis=1))])
+    diagonal = rows == indices
+
+    for array in (indptr, indices, rows, diagonal):
+        array.setflags(write=False)
+    return indptr, indices, rows, diagonal
+
+
+def img_to_graph_2d(img, dtype=None):
+    """Graph of a 2-D image built directly in CSR format, same as img_to_graph without mask.
+    Edges between 4-neighbours are weighted exp(-max(a, b)) of the pixel values, diagonal are the pixel values.
+    :param img: 2-D image
+    :param dtype: type of the graph weights, type of the image by default (float32 images give float32 graphs)
+    """
+    n_x, n_y = img.shape
+    dtype = img.dtype if dtype is None else dtype
+    indptr, indices, rows, diagonal = grid_graph_template(n_x, n_y)
+
+    values = np.asarray(img, dtype=dtype).ravel()
+    data = np.exp(-np.maximum(values[rows], values[indices]))
+    data[diagonal] = values
+    # copies of the structure, so that in-place scipy operations can not modify the shared template
+    return sparse.csr_matrix((data, indices.copy(), indptr.copy()), shape=(n_x * n_y, n_x * n_y))
+
+
 def img_to_graph(img, mask=None, return_as=sparse.coo_matrix, dtype=None):
+    if mask is None and np.ndim(img) == 2:
+        graph = img_to_graph_2d(img, dtype=dtype)
+        if return_as is np.ndarray:
+            return graph.toarray()
+        return return_as(graph)
     img = np.atleast_3d(img)
     n_x, n_y, n_z = img.shape
     return to_graph(n_x, n_y, n_z, mask, img, return_as, dtype)
@@ -0,0 +1,125 @@
+import json
+import os
+
+import tensorflow as tf
+
+from pero_ocr import parallel
+
+
+FROZEN_GRAPH_SUFFIX = '.frozen.pb'
+FROZEN_METADATA_SUFFIX = '.frozen.json'
+
+
+def session_config(use_cpu=False, intra_op_threads=None, inter_op_threads=None):
+    """Session configuration with explicit thread pools, so that several sessions in a process
+    and several processes on a node do not each use all cores.
+    :param intra_op_threads: threads used inside a single op, the process thread budget by default
+    :param inter_op_threads: ops run in parallel, 1 by default when the number of threads is limited
+    (networks are mostly sequential chains of ops)
+    """
+    if use_cpu:
+        tf_config = tf.ConfigProto(device_count={'GPU': 0})
+    else:
+        tf_config = tf.ConfigProto(device_count={'GPU': 1})
+        tf_config.gpu_options.allow_growth = True
+
+    if intra_op_threads is None:
+        intra_op_threads = parallel.get_thread_budget()
+    if inter_op_threads is None and intra_op_threads is not None:
+        inter_op_threads = 1
+    # 0 lets TensorFlow choose
+    tf_config.intra_op_parallelism_threads = intra_op_threads or 0
+    tf_config.inter_op_parallelism_threads = inter_op_threads or 0
+    return tf_config
+
+
+def frozen_graph_paths(model_path):
+    return model_path + FROZEN_GRAPH_SUFFIX, model_path + FROZEN_METADATA_SUFFIX
+
+
+def has_frozen_graph(model_path):
+    """Frozen graph of a checkpoint exists and is not older than the checkpoint.
+    :param model_path: checkpoint path (without .meta/.index extensions)
+    """
+    graph_path, metadata_path = frozen_graph_paths(model_path)
+    if not os.path.isfile(graph_path) or not os.path.isfile(metadata_path):
+        return False
+    checkpoint_files = [model_path + '.index', model_path + '.meta']
+    checkpoint_time = max([os.path.getmtime(f) for f in checkpoint_files if os.path.isfile(f)], default=0)
+    return os.path.getmtime(graph_path) >= checkpoint_time
+
+
+def load_checkpoint(model_path, use_cpu=False, intra_op_threads=None, inter_op_threads=None):
+    """Restore checkpoint with its meta graph into a new graph.
+    :param intra_op_threads, inter_op_threads: see session_config
+    :return: session of the restored graph
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        saver = tf.train.import_meta_graph(model_path + '.meta')
+    session = tf.Session(graph=graph, config=session_config(use_cpu, intra_op_threads, inter_op_threads))
+    saver.restore(session, model_path)
+    return session
+
+
+def load_frozen_graph(model_path, use_cpu=False, intra_op_threads=None, inter_op_threads=None):
+    """Load frozen graph exported by export_frozen_graph, tensor names are the same as in the original graph.
+    :return: session of the frozen graph and its metadata
+    """
+    graph_path, metadata_path = frozen_graph_paths(model_path)
+    with open(metadata_path, 'r', encoding='utf8') as f:
+        metadata = json.load(f)
+    graph_def = tf.GraphDef()
+    with open(graph_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    session = tf.Session(graph=graph, config=session_config(use_cpu, intra_op_threads, inter_op_threads))
+    return session, metadata
+
+
+def load_model(model_path, use_cpu=False, intra_op_threads=None, inter_op_threads=None):
+    """Load frozen graph of a checkpoint when exported, otherwise restore the checkpoint.
+    :param intra_op_threads, inter_op_threads: see session_config
+    :return: session and metadata of the frozen graph (None when loaded from checkpoint)
+    """
+    if has_frozen_graph(model_path):
+        return load_frozen_graph(model_path, use_cpu=use_cpu,
+                                 intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    return load_checkpoint(model_path, use_cpu=use_cpu,
+                           intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads), None
+
+
+def export_frozen_graph(session, model_path, inputs, outputs, metadata=None):
+    """Freeze variables of a session into constants, strip training nodes and store the graph
+    with its metadata alongside the checkpoint.
+    :param session: session with restored model
+    :param model_path: checkpoint path the frozen graph belongs to
+    :param inputs: names of input tensors
+    :param outputs: names of output tensors
+    :param metadata: additional model information stored in the metadata file
+    """
+    graph = session.graph
+    output_nodes = [name.split(':')[0] for name in outputs]
+    input_nodes = [name.split(':')[0] for name in inputs]
+
+    graph_def = tf.graph_util.convert_variables_to_constants(session, graph.as_graph_def(), output_nodes)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=input_nodes + output_nodes)
+
+    metadata = dict(metadata) if metadata else {}
+    metadata['inputs'] = {
+        name: {'dtype': graph.get_tensor_by_name(name).dtype.name,
+               'shape': graph.get_tensor_by_name(name).shape.as_list()
+               if graph.get_tensor_by_name(name).shape.ndims is not None else None}
+        for name in inputs}
+    metadata['outputs'] = list(outputs)
+    metadata['tensorflow_version'] = tf.__version__
+
+    graph_path, metadata_path = frozen_graph_paths(model_path)
+    with open(graph_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(metadata_path, 'w', encoding='utf8') as f:
+        json.dump(metadata, f, indent=2)
+    return graph_path
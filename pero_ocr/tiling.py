@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+
+from pero_ocr import parallel
+from pero_ocr.canvas_pool import CanvasPool, fill_canvas
+
+
+def tile_starts(size, tile_size, overlap):
+    """Start offsets of overlapping tiles covering a dimension of given size.
+    The last tile is aligned with the end, so it may overlap its neighbour more.
+    Overlap is limited to half of the tile, so that tiles advance by at least half of their size.
+    """
+    if size <= tile_size:
+        return [0]
+    step = max(1, tile_size - min(overlap, tile_size // 2))
+    return list(range(0, size - tile_size, step)) + [size - tile_size]
+
+
+def blend_weights(length, overlap, first, last):
+    """1-D blending weights of a tile, linear ramps over the overlaps with neighbouring tiles.
+    :param first: the tile is at the start of the dimension (no ramp at its start)
+    :param last: the tile is at the end of the dimension (no ramp at its end)
+    """
+    weights = np.ones(length, dtype=np.float32)
+    overlap = min(overlap, length // 2)
+    if overlap > 0:
+        ramp = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+        if not first:
+            weights[:overlap] = ramp
+        if not last:
+            weights[-overlap:] = ramp[::-1]
+    return weights
+
+
+def infer_tiled(img, infer, tile_size, overlap=64, pad=0, align=64, scale=1.0, canvas_pool=None, tile_cost=0.05):
+    """Run a fully convolutional network on overlapping tiles of an image and blend the outputs.
+    Only a single tile is held in the network input at a time per thread, tiles run in threads of the shared executor.
+    :param img: input image array (H x W x C), already resized for the network
+    :param infer: function mapping float32 batch (1 x h x w x C) to output maps (1 x h x w x K)
+    :param tile_size: size of output tiles in pixels
+    :param overlap: overlap of neighbouring tiles in pixels, outputs are linearly blended over it
+    :param pad: context added around each tile, zeros outside of the image
+    :param align: network input size has to be multiple of this
+    :param scale: multiplier of image values when copied to the network input
+    :param canvas_pool: CanvasPool of float32 network inputs
+    :param tile_cost: estimated inference time of a single tile (seconds)
+    :return: blended output maps (H x W x K) as float32
+    """
+    if canvas_pool is None:
+        canvas_pool = CanvasPool()
+    height, width = img.shape[:2]
+    y_starts = tile_starts(height, tile_size, overlap)
+    x_starts = tile_starts(width, tile_size, overlap)
+    tile_height = min(tile_size, height)
+    tile_width = min(tile_size, width)
+    canvas_height = int(np.ceil((tile_height + 2 * pad) / align) * align)
+    canvas_width = int(np.ceil((tile_width + 2 * pad) / align) * align)
+
+    y_weights = [blend_weights(tile_height, overlap, y == y_starts[0], y == y_starts[-1]) for y in y_starts]
+    x_weights = [blend_weights(tile_width, overlap, x == x_starts[0], x == x_starts[-1]) for x in x_starts]
+
+    output = {}
+    weight_sum = np.zeros((height, width, 1), dtype=np.float32)
+    lock = threading.Lock()
+
+    def process_tile(tile):
+        (y, y_weight), (x, x_weight) = tile
+        in_y1, in_y2 = max(0, y - pad), min(height, y + tile_height + pad)
+        in_x1, in_x2 = max(0, x - pad), min(width, x + tile_width + pad)
+        with canvas_pool.canvas((1, canvas_height, canvas_width, img.shape[2])) as canvas:
+            fill_canvas(canvas[0], img[in_y1:in_y2, in_x1:in_x2], offset=(in_y1 - (y - pad), in_x1 - (x - pad)), scale=scale)
+            tile_out = infer(canvas)[0, pad:pad + tile_height, pad:pad + tile_width]
+            weights = np.outer(y_weight, x_weight)[:, :, np.newaxis]
+            with lock:
+                if 'maps' not in output:
+                    output['maps'] = np.zeros((height, width, tile_out.shape[2]), dtype=np.float32)
+                output['maps'][y:y + tile_height, x:x + tile_width] += tile_out * weights
+                weight_sum[y:y + tile_height, x:x + tile_width] += weights
+
+    tiles = [(y_tile, x_tile) for y_tile in zip(y_starts, y_weights) for x_tile in zip(x_starts, x_weights)]
+    parallel.get_executor().map(process_tile, tiles, cost=tile_cost, releases_gil=True)
+
+    return output['maps'] / weight_sum
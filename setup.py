@@ -11,7 +11,7 @@ def get_long_desc():
 setup(
     name='pero-ocr',
     version='0.2',
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     packages=[
         'pero_ocr',
         'pero_ocr/decoding',
@@ -31,7 +31,7 @@ setup(
         'scikit-learn',
         'scikit-image',
         'tensorflow-gpu==1.14',
-        'shapely',
+        'shapely>=2.0',
         'pyamg',
     ],
     classifiers=[
@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+
+from pero_ocr.canvas_pool import CanvasPool, fill_canvas
+
+
+class TestFillCanvas(unittest.TestCase):
+    def test_image_is_scaled_and_rest_zeroed(self):
+        canvas = np.full((8, 10, 3), 7, dtype=np.float32)
+        img = np.random.randint(0, 256, size=(4, 5, 3)).astype(np.uint8)
+        fill_canvas(canvas, img, offset=(2, 3), scale=1/256.)
+
+        expected = np.zeros((8, 10, 3), dtype=np.float32)
+        expected[2:6, 3:8] = img / 256.
+        self.assertTrue(np.array_equal(canvas, expected))
+
+    def test_image_filling_canvas(self):
+        canvas = np.empty((4, 5, 1), dtype=np.float32)
+        fill_canvas(canvas, np.ones((4, 5, 1), dtype=np.uint8))
+        self.assertTrue(np.all(canvas == 1))
+
+
+class TestCanvasPool(unittest.TestCase):
+    def test_released_canvas_is_reused(self):
+        pool = CanvasPool()
+        with pool.canvas((1, 64, 64, 3)) as canvas:
+            self.assertEqual(canvas.dtype, np.float32)
+        with pool.canvas((1, 64, 64, 3)) as reused:
+            self.assertIs(reused, canvas)
+            with pool.canvas((1, 64, 64, 3)) as other:
+                self.assertIsNot(other, canvas)
+
+    def test_pool_size_is_limited(self):
+        pool = CanvasPool(max_canvases=2)
+        canvases = [pool.acquire((i + 1, 4)) for i in range(3)]
+        for canvas in canvases:
+            pool.release(canvas)
+        self.assertEqual([c.shape for c in pool.free_canvases], [(2, 4), (3, 4)])
@@ -0,0 +1,96 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from pero_ocr.document_ocr.crop_engine import EngineLineCropper, remap_roi
+
+
+def reference_reverse_line_mapping(forward_mapping, sample_positions, sampled_values):
+    backward_mapping = np.zeros_like(sample_positions)
+    forward_position = 0
+    for i in range(sample_positions.shape[0]):
+        while forward_mapping[forward_position] > sample_positions[i]:
+            forward_position += 1
+        d = forward_mapping[forward_position] - forward_mapping[forward_position-1]
+        da = (sample_positions[i] - forward_mapping[forward_position-1]) / d
+        backward_mapping[i] = (1 - da) * sampled_values[forward_position - 1] + da * sampled_values[forward_position]
+    return backward_mapping
+
+
+def reference_reverse_xy_mapping(forward_mapping, shape):
+    y_mapping = np.clip(cv2.resize(forward_mapping[:, :, 1], (0, 0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR), 0, shape[0]-1)
+    y_mapping = np.round(y_mapping).astype(int)
+    x_mapping = np.clip(cv2.resize(forward_mapping[:, :, 0], (0, 0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR), 0, shape[1]-1)
+    x_mapping = np.round(x_mapping).astype(int)
+    ystart, ystop = np.amin(y_mapping), np.amax(y_mapping) + 1
+    xstart, xstop = np.amin(x_mapping), np.amax(x_mapping) + 1
+
+    y_map = np.tile(np.arange(0, forward_mapping.shape[0]), (forward_mapping.shape[1], 1)).T.astype(np.float32)
+    y_map = cv2.resize(y_map, (0, 0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR)
+    x_map = np.tile(np.arange(0, forward_mapping.shape[1]), (forward_mapping.shape[0], 1)).astype(np.float32)
+    x_map = cv2.resize(x_map, (0, 0), fx=4, fy=4, interpolation=cv2.INTER_LINEAR)
+
+    reverse_mapping = np.ones((ystop-ystart, xstop-xstart, 2), dtype=np.float32) * -1
+    for sx, sy, dx, dy in zip(x_map.flatten(), y_map.flatten(), x_mapping.flatten(), y_mapping.flatten()):
+        reverse_mapping[dy-ystart, dx-xstart, 0] = sx
+        reverse_mapping[dy-ystart, dx-xstart, 1] = sy
+    return reverse_mapping, (ystart, xstart)
+
+
+class TestLineCropping(unittest.TestCase):
+    def setUp(self):
+        self.cropper = EngineLineCropper(line_height=32, poly=2)
+        self.img = np.random.default_rng(0).integers(0, 255, size=(300, 400, 3), dtype=np.uint8)
+        self.baselines = [
+            np.array([[10, 100], [200, 110], [380, 105]]),
+            np.array([[-20, 5], [200, 2], [450, 10]]),  # partially outside of the image
+            np.array([[350, 290], [420, 295]])
+        ]
+        self.heights = [(20, 10), (12, 6), (16, 8)]
+
+    def test_reverse_line_mapping(self):
+        forward_mapping = np.concatenate([[0], np.cumsum(np.linspace(0.5, 1.5, 50))])
+        sample_positions = np.linspace(0, forward_mapping[-1], 37)
+        sampled_values = np.arange(51.0) + 10
+        np.testing.assert_allclose(
+            self.cropper.reverse_line_mapping(forward_mapping, sample_positions, sampled_values),
+            reference_reverse_line_mapping(forward_mapping, sample_positions, sampled_values))
+
+    def test_roi_remap_matches_full_image_remap(self):
+        for baseline, heights in zip(self.baselines, self.heights):
+            coords = self.cropper.get_crop_inputs(baseline, heights, 32)
+            full = cv2.remap(self.img, coords[:, :, 0], coords[:, :, 1],
+                             interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+            np.testing.assert_array_equal(remap_roi(self.img, coords), full)
+
+    def test_roi_outside_of_image(self):
+        coords = np.full((4, 5, 2), -10, dtype=np.float32)
+        crop = remap_roi(self.img, coords)
+        self.assertEqual(crop.shape, (4, 5, 3))
+        self.assertFalse(crop.any())
+
+    def test_crop_lines_matches_crop(self):
+        crops = self.cropper.crop_lines(self.img, self.baselines, self.heights)
+        for crop, baseline, heights in zip(crops, self.baselines, self.heights):
+            np.testing.assert_array_equal(crop, self.cropper.crop(self.img, baseline, heights))
+
+    def test_failed_line_is_none(self):
+        crops = self.cropper.crop_lines(self.img, [np.array([[5, 5], [5, 50]])], [(5, 5)])
+        self.assertEqual(crops, [None])
+
+    def test_reverse_xy_mapping(self):
+        for baseline, heights in zip(self.baselines, self.heights):
+            coords = self.cropper.get_crop_inputs(baseline, heights, 32)
+            mapping, offset = self.cropper.reverse_xy_mapping(coords, self.img.shape)
+            reference_mapping, reference_offset = reference_reverse_xy_mapping(coords, self.img.shape)
+            self.assertEqual(offset, reference_offset)
+            np.testing.assert_array_equal(mapping, reference_mapping)
+
+    def test_blend_in_unchanged_crop(self):
+        crop, mapping, offset = self.cropper.crop(self.img, self.baselines[0], self.heights[0], return_mapping=True)
+        blended = self.cropper.blend_in(self.img.copy(), crop, mapping, offset)
+        difference = np.abs(blended.astype(int) - self.img)
+        # resampling there and back blurs the line a bit, pixels outside of it are untouched
+        self.assertLess(difference.mean(), 10)
+        self.assertFalse(difference[:offset[0]].any())
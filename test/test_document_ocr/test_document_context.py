@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from pero_ocr.document_ocr.document_context import DocumentContext
+
+
+class DocumentContextTests(unittest.TestCase):
+    def setUp(self):
+        self.context = DocumentContext(tolerance=0.2)
+        self.context.begin_page((1000, 800))
+        self.context.update_scale(40.0, downsample=3)
+        self.context.update_rotation(1.5)
+        self.context.update_regions([np.array([[0, 0], [400, 0], [400, 1000], [0, 1000]])])
+
+    def test_priors_kept_for_similar_page(self):
+        self.context.begin_page((1050, 790))
+        self.assertEqual(self.context.text_height, 40.0)
+        self.assertEqual(self.context.downsample, 3)
+        self.assertEqual(self.context.rotation, 1.5)
+        self.assertEqual(self.context.page_count, 2)
+
+    def test_page_size_change_invalidates(self):
+        self.context.begin_page((2000, 1600))
+        self.assertIsNone(self.context.text_height)
+        self.assertIsNone(self.context.downsample)
+        self.assertIsNone(self.context.rotation)
+        self.assertIsNone(self.context.region_templates)
+        self.assertEqual(self.context.page_count, 1)
+
+    def test_text_height_deviation_replaces_scale(self):
+        self.context.update_scale(42.0)
+        self.assertIsNotNone(self.context.region_templates)
+        self.context.update_scale(80.0, downsample=6)
+        self.assertEqual(self.context.text_height, 80.0)
+        self.assertEqual(self.context.downsample, 6)
+        self.assertIsNone(self.context.region_templates)
+
+    def test_unknown_text_height_is_ignored(self):
+        self.context.update_scale(np.nan)
+        self.assertEqual(self.context.text_height, 40.0)
+
+    def test_region_templates_scale_with_page(self):
+        templates = self.context.get_region_templates((2000, 1600))
+        self.assertTrue(np.allclose(templates[0], [[0, 0], [800, 0], [800, 2000], [0, 2000]]))
+
+    def test_low_region_coverage_drops_templates(self):
+        self.context.check_region_coverage(0.9)
+        self.assertIsNotNone(self.context.region_templates)
+        self.context.check_region_coverage(0.7)
+        self.assertIsNone(self.context.region_templates)
+
+    def test_rotation_kept_within_tolerance(self):
+        self.context.update_rotation(2.0)
+        self.assertEqual(self.context.rotation, 1.5)
+        self.context.update_rotation(3.0)
+        self.assertEqual(self.context.rotation, 3.0)
+
+    def test_document_id_changes_on_invalidation(self):
+        document_id = self.context.document_id
+        self.context.begin_page((1050, 790))
+        self.assertEqual(self.context.document_id, document_id)
+        self.context.begin_page((2000, 1600))
+        self.assertNotEqual(self.context.document_id, document_id)
+        self.assertNotEqual(DocumentContext().document_id, self.context.document_id)
@@ -1,9 +1,12 @@
+import os
+import tempfile
 from unittest import TestCase
 
+import cv2
 import numpy as np
 from scipy import sparse
 
-from pero_ocr.document_ocr.layout import TextLine
+from pero_ocr.document_ocr.layout import PageLayout, RegionLayout, TextLine
 from pero_ocr.ocr_engine.softmax import softmax
 
 
@@ -24,3 +27,122 @@ class TextLineTests(TestCase):
             [0.1, 0.1, -50.0],
         ])
         self.assertTrue(np.array_equal(reconstructed, expected))
+
+
+PAGE_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15">
+  <Page imageFilename="page" imageWidth="300" imageHeight="200">
+    <TextRegion id="r1">
+      <Coords points="0,0 300,0 300,200 0,200"/>
+      <TextEquiv><Unicode>Příliš žluťoučký kůň</Unicode></TextEquiv>
+      <TextLine id="r1-l1" custom="heights_v2:[12.0,4.0]">
+        <Coords points="10,18 250,18 250,34 10,34"/>
+        <Baseline points="10,30 130,31 250,30"/>
+        <TextEquiv><Unicode>Příliš žluťoučký kůň</Unicode></TextEquiv>
+      </TextLine>
+      <TextLine id="r1-l2">
+        <Coords points="10,50 250,50 250,70 10,70"/>
+        <TextEquiv><Unicode></Unicode></TextEquiv>
+      </TextLine>
+    </TextRegion>
+    <TextRegion id="r2">
+      <Coords points="0,100 10,100 10,110"/>
+    </TextRegion>
+  </Page>
+</PcGts>
+'''
+
+
+class PageLayoutBinaryTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.tmp_dir.name, 'page.plb')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def reload(self, page_layout, mmap=True):
+        page_layout.to_binary(self.file_name)
+        reloaded = PageLayout()
+        reloaded.from_binary(self.file_name, mmap=mmap)
+        return reloaded
+
+    def test_pagexml_round_trip(self):
+        page_layout = PageLayout()
+        page_layout.from_pagexml_string(PAGE_XML.encode('utf-8'))
+
+        for mmap in [True, False]:
+            reloaded = self.reload(page_layout, mmap=mmap)
+            self.assertEqual(reloaded.to_pagexml_string(), page_layout.to_pagexml_string())
+
+    def test_preserves_missing_attributes(self):
+        page_layout = PageLayout(id='page', page_size=(20, 30))
+        region = RegionLayout('r1', np.asarray([[0.5, 0.5], [29.5, 0.5], [29.5, 19.5]]))
+        region.lines.append(TextLine(id='r1-l1', baseline=np.asarray([[1.25, 10.0], [20.75, 11.5]]), heights=[5.5, 2.0]))
+        region.lines.append(TextLine())
+        page_layout.regions.append(region)
+
+        reloaded = self.reload(page_layout)
+        self.assertEqual(reloaded.id, 'page')
+        self.assertEqual(reloaded.page_size, (20, 30))
+        self.assertIsNone(reloaded.regions[0].transcription)
+        np.testing.assert_array_equal(reloaded.regions[0].polygon, region.polygon)
+
+        line, empty_line = reloaded.regions[0].lines
+        self.assertEqual(line.id, 'r1-l1')
+        np.testing.assert_array_equal(line.baseline, region.lines[0].baseline)
+        self.assertEqual(line.heights, [5.5, 2.0])
+        self.assertIsNone(line.polygon)
+        self.assertIsNone(line.transcription)
+        for attribute in ['id', 'baseline', 'polygon', 'heights', 'transcription']:
+            self.assertIsNone(getattr(empty_line, attribute))
+
+    def test_memory_mapped_lines_are_copy_on_write(self):
+        page_layout = PageLayout()
+        page_layout.from_pagexml_string(PAGE_XML.encode('utf-8'))
+        reloaded = self.reload(page_layout)
+
+        reloaded.regions[0].lines[0].baseline[:, 1] += 1
+        fresh = PageLayout()
+        fresh.from_binary(self.file_name)
+        np.testing.assert_array_equal(fresh.regions[0].lines[0].baseline, page_layout.regions[0].lines[0].baseline)
+
+
+class PageGeometryTests(TestCase):
+    def setUp(self):
+        self.page_layout = PageLayout(id='page', page_size=(100, 100))
+        region = RegionLayout('r1', np.asarray([[0, 0], [100, 0], [100, 100], [0, 100]]))
+        region.lines.append(TextLine(id='r1-l1', baseline=np.asarray([[10, 20], [50, 22]]),
+                                     polygon=np.asarray([[10, 10], [50, 12], [50, 25], [10, 23]]), heights=[10, 3]))
+        region.lines.append(TextLine(id='r1-l2'))
+        region.lines.append(TextLine(id='r1-l3', baseline=np.asarray([[5, 60], [30, 60], [90, 61]]), heights=[8, 2]))
+        self.page_layout.regions.append(region)
+
+    def test_lines_become_views(self):
+        geometry = self.page_layout.pack_geometry()
+        lines = list(self.page_layout.lines_iterator())
+
+        self.assertTrue(np.shares_memory(lines[0].baseline, geometry.baselines))
+        self.assertTrue(np.shares_memory(lines[2].heights, geometry.heights))
+        self.assertIsNone(lines[1].baseline)
+        self.assertIsNone(lines[2].polygon)
+        np.testing.assert_array_equal(geometry.baseline_lines, [0, 0, 2, 2, 2])
+
+        lines[2].baseline[:, 1] += 1
+        np.testing.assert_array_equal(geometry.baselines[2:, 1], [61, 61, 62])
+
+    def test_bounding_boxes(self):
+        geometry = self.page_layout.pack_geometry()
+        boxes = geometry.bounding_boxes(use_polygons=False)
+        np.testing.assert_array_equal(boxes[0], [10, 20, 50, 22])
+        self.assertTrue(np.all(np.isnan(boxes[1])))
+        np.testing.assert_array_equal(boxes[2], [5, 60, 90, 61])
+        np.testing.assert_array_equal(geometry.bounding_boxes()[0], [10, 10, 50, 25])
+
+    def test_rotate_matches_per_line_rotation(self):
+        baseline = self.page_layout.regions[0].lines[2].baseline.astype(np.float64)
+        M = cv2.getRotationMatrix2D((50, 50), 10, 1)
+        expected = cv2.transform(baseline[np.newaxis], M)[0]
+
+        self.page_layout.pack_geometry().rotate(10, (50, 50))
+        np.testing.assert_allclose(self.page_layout.regions[0].lines[2].baseline, expected)
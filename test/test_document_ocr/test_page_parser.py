@@ -0,0 +1,245 @@
+import configparser
+import math
+import unittest
+
+import numpy as np
+
+from pero_ocr import parallel
+from pero_ocr.document_ocr.document_context import DocumentContext
+from pero_ocr.document_ocr.layout import PageLayout, RegionLayout, TextLine
+from pero_ocr.document_ocr.page_parser import LineRefiner, PageParser, RegionTemplateParser, TextlineExtractorCNN, \
+    region_coverage
+import pero_ocr.line_engine.line_postprocessing as linepp
+
+
+def parser_config(**page_parser):
+    config = configparser.ConfigParser()
+    config['PAGE_PARSER'] = {
+        'RUN_LAYOUT_PARSER': 'no',
+        'RUN_LINE_PARSER': 'no',
+        'RUN_LINE_CROPPER': 'no',
+        'RUN_OCR': 'no',
+        'RUN_DECODER': 'no',
+    }
+    config['PAGE_PARSER'].update(page_parser)
+    return config
+
+
+class TestPageParserExecutor(unittest.TestCase):
+    def setUp(self):
+        self.thread_budget = parallel.get_thread_budget()
+        self.executor = parallel._executor
+
+    def tearDown(self):
+        parallel.set_thread_budget(self.thread_budget)
+        if parallel._executor is not self.executor:
+            parallel._executor.shutdown()
+        parallel._executor = self.executor
+
+    def test_second_parser_keeps_executor(self):
+        PageParser(parser_config(MAX_WORKERS='3'))
+        executor = parallel.get_executor()
+        executor.map(abs, range(-10, 0), cost=1.0, releases_gil=True)
+        thread_pool = executor._thread_pool
+
+        PageParser(parser_config())
+        PageParser(parser_config(MAX_WORKERS='3'))
+        self.assertIs(parallel.get_executor(), executor)
+        self.assertIs(executor._thread_pool, thread_pool)
+        self.assertEqual(executor.map(abs, range(-10, 0), cost=1.0, releases_gil=True), list(range(10, 0, -1)))
+
+    def test_explicit_size_replaces_executor(self):
+        PageParser(parser_config(MAX_WORKERS='3'))
+        PageParser(parser_config(MAX_WORKERS='2'))
+        self.assertEqual(parallel.get_executor().max_workers, 2)
+
+
+class PageRecorder(object):
+    """Stand-in page decoder, records pages it got."""
+    def __init__(self):
+        self.pages = []
+
+    def process_page(self, page_layout, document_context=None):
+        self.pages.append(page_layout.id)
+        return page_layout
+
+
+class TestPageParserWithoutImage(unittest.TestCase):
+    def setUp(self):
+        self.parser = PageParser(parser_config())
+        self.parser.run_decoder = True
+        self.parser.decoder = PageRecorder()
+
+    def test_decoding_without_image(self):
+        context = DocumentContext()
+        page_layout = self.parser.process_page(None, PageLayout(id='page', page_size=(1000, 800)), context)
+        self.assertEqual(page_layout.id, 'page')
+        self.assertEqual(self.parser.decoder.pages, ['page'])
+        self.assertEqual(context.page_size, (1000, 800))
+        self.assertEqual(context.page_count, 1)
+
+    def test_unknown_page_size_is_skipped(self):
+        context = DocumentContext()
+        self.parser.process_page(None, PageLayout(id='page'), context)
+        self.assertEqual(self.parser.decoder.pages, ['page'])
+        self.assertIsNone(context.page_size)
+
+
+class RegionRecorder(object):
+    """Stand-in layout parser, records pages it got and returns a single region."""
+    def __init__(self):
+        self.pages = []
+
+    def process_page(self, img, page_layout, document_context=None):
+        self.pages.append(page_layout.id)
+        page_layout.regions = [RegionLayout('r000', np.array([[100, 50], [700, 50], [700, 900], [100, 900]]))]
+        return page_layout
+
+
+class TestRegionTemplateParser(unittest.TestCase):
+    def setUp(self):
+        self.region_parser = RegionRecorder()
+        self.parser = RegionTemplateParser(self.region_parser)
+        self.context = DocumentContext()
+
+    def process_page(self, page_id, page_size):
+        self.context.begin_page(page_size)
+        return self.parser.process_page(None, PageLayout(id=page_id, page_size=page_size), self.context)
+
+    def test_later_pages_reuse_regions(self):
+        self.process_page('p1', (1000, 800))
+        page_layout = self.process_page('p2', (1100, 800))
+        self.assertEqual(self.region_parser.pages, ['p1'])
+        self.assertEqual(len(page_layout.regions), 1)
+        np.testing.assert_allclose(page_layout.regions[0].polygon, [[100, 55], [700, 55], [700, 990], [100, 990]])
+
+    def test_dropped_templates_run_region_parser(self):
+        self.process_page('p1', (1000, 800))
+        self.context.check_region_coverage(0.5)
+        self.process_page('p2', (1000, 800))
+        self.process_page('p3', (2000, 1600))
+        self.assertEqual(self.region_parser.pages, ['p1', 'p2', 'p3'])
+
+    def test_independent_pages(self):
+        self.parser.process_page(None, PageLayout(id='p1', page_size=(1000, 800)))
+        self.parser.process_page(None, PageLayout(id='p2', page_size=(1000, 800)))
+        self.assertEqual(self.region_parser.pages, ['p1', 'p2'])
+
+
+def tilted_baseline(x, y, length, rotation):
+    return np.array([[x, y], [x + length, y + length * math.tan(math.radians(rotation))]])
+
+
+class StandInLineEngine(object):
+    """Stand-in CNN line detector returning the lines set for the page."""
+    downsample = 4
+
+    def __init__(self):
+        self.baselines = []
+
+    def detect_lines(self, img, downsample=None, return_downsample=False):
+        heights = [[20, 10] for _ in self.baselines]
+        textlines = [linepp.baseline_to_textline(baseline, height) for baseline, height in zip(self.baselines, heights)]
+        return self.baselines, heights, textlines, downsample or self.downsample
+
+
+class TestTextlineExtractorDocumentContext(unittest.TestCase):
+    def setUp(self):
+        self.extractor = TextlineExtractorCNN.__new__(TextlineExtractorCNN)
+        self.extractor.merge_lines = False
+        self.extractor.stretch_lines = 0
+        self.extractor.resample_lines = False
+        self.extractor.order_lines = 'vertical'
+        self.extractor.heights_from_regions = False
+        self.extractor.line_engine = StandInLineEngine()
+        self.rotation_priors = []
+        postprocess_region_lines = self.extractor.postprocess_region_lines
+        self.extractor.postprocess_region_lines = lambda region, rotation_prior=None: \
+            self.rotation_priors.append(rotation_prior) or postprocess_region_lines(region, rotation_prior)
+        self.context = DocumentContext(rotation_tolerance=1.0)
+
+    def process_page(self, rotation, regions=((0, 0, 1000, 1000),)):
+        self.extractor.line_engine.baselines = [tilted_baseline(100, y, 600, rotation) for y in range(100, 900, 50)]
+        page_layout = PageLayout(id='page', page_size=(1000, 1000))
+        page_layout.regions = [RegionLayout('r{:03d}'.format(i), np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]))
+                               for i, (x1, y1, x2, y2) in enumerate(regions)]
+        self.context.begin_page((1000, 1000))
+        self.rotation_priors = []
+        return self.extractor.process_page(np.zeros((1000, 1000, 3), dtype=np.uint8), page_layout, self.context)
+
+    def test_rotation_of_previous_pages_is_used_within_tolerance(self):
+        self.process_page(0.5)
+        self.assertAlmostEqual(self.rotation_priors[0], 0.5)
+        self.process_page(1.2)
+        self.assertAlmostEqual(self.rotation_priors[0], 0.5)
+        self.assertAlmostEqual(self.context.rotation, 0.5)
+
+    def test_deviating_page_uses_own_rotation(self):
+        self.process_page(0.5)
+        self.process_page(4.0)
+        self.assertAlmostEqual(self.rotation_priors[0], 4.0)
+        self.assertAlmostEqual(self.context.rotation, 4.0)
+
+    def test_lines_outside_of_templates_drop_them(self):
+        self.context.begin_page((1000, 1000))
+        self.context.update_regions([np.array([[0, 0], [1000, 0], [1000, 1000], [0, 1000]])])
+        self.process_page(0.0)
+        self.assertIsNotNone(self.context.region_templates)
+        self.process_page(0.0, regions=[(0, 0, 1000, 300)])
+        self.assertIsNone(self.context.region_templates)
+
+
+class TestRegionCoverage(unittest.TestCase):
+    def test_fraction_of_points_inside(self):
+        regions = [RegionLayout('r1', np.array([[0, 0], [100, 0], [100, 100], [0, 100]])),
+                   RegionLayout('r2', np.array([[200, 0], [300, 0], [300, 100], [200, 100]]))]
+        baselines = [np.array([[10, 50], [90, 50]]), np.array([[150, 50], [250, 50]])]
+        self.assertAlmostEqual(region_coverage(baselines, regions), 0.75)
+        self.assertEqual(region_coverage(baselines, []), 0.0)
+
+
+class StandInRefinerEngine(object):
+    """Stand-in CNN line detector of the line refiner, records downsample factors of inference."""
+    def __init__(self):
+        self.downsamples = []
+
+    def infer_maps(self, img, downsample):
+        self.downsamples.append(downsample)
+        return None, None
+
+
+class TestLineRefinerDocumentContext(unittest.TestCase):
+    def setUp(self):
+        self.refiner = LineRefiner.__new__(LineRefiner)
+        self.refiner.downsample = 4
+        self.refiner.adjust_baselines = False
+        self.refiner.adjust_heights = False
+        self.refiner.line_engine = StandInRefinerEngine()
+
+    def process_page(self, document_context=None):
+        page_layout = PageLayout(id='page', page_size=(1000, 1000))
+        region = RegionLayout('r1', np.array([[0, 0], [1000, 0], [1000, 1000], [0, 1000]]))
+        region.lines = [TextLine(id='r1-l001', baseline=np.array([[100, 200], [800, 200]]), heights=[70, 30])]
+        page_layout.regions = [region]
+        return self.refiner.process_page(np.zeros((1000, 1000, 3), dtype=np.uint8), page_layout, document_context)
+
+    def test_downsample_from_text_height(self):
+        self.process_page()
+        self.assertEqual(self.refiner.line_engine.downsamples, [8])
+
+    def test_downsample_of_previous_pages(self):
+        context = DocumentContext()
+        context.begin_page((1000, 1000))
+        context.update_scale(95.0, downsample=6)
+        self.process_page(context)
+        self.assertEqual(self.refiner.line_engine.downsamples, [6])
+        self.assertEqual(context.downsample, 6)
+        self.assertEqual(context.text_height, 100.0)
+
+    def test_deviating_text_height_ignores_downsample(self):
+        context = DocumentContext()
+        context.begin_page((1000, 1000))
+        context.update_scale(40.0, downsample=3)
+        self.process_page(context)
+        self.assertEqual(self.refiner.line_engine.downsamples, [8])
+        self.assertEqual(context.downsample, 8)
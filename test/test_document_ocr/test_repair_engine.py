@@ -0,0 +1,83 @@
+import types
+import unittest
+
+import numpy as np
+
+from pero_ocr.document_ocr.repair_engine import EngineRepairCNN
+
+
+class StandInSession(object):
+    """Session of a repair network which returns its content input and records the fed batches."""
+    def __init__(self, batch_size=None, height=8, max_width=20):
+        shape = types.SimpleNamespace(ndims=4, as_list=lambda: [batch_size, height, max_width, 3])
+        self.graph = types.SimpleNamespace(get_tensor_by_name=lambda name: types.SimpleNamespace(shape=shape))
+        self.feeds = []
+
+    def run(self, output, feed_dict):
+        self.feeds.append(feed_dict)
+        return feed_dict['inference_content:0']
+
+
+class TestRepairBatching(unittest.TestCase):
+    def setUp(self):
+        self.engine = EngineRepairCNN.__new__(EngineRepairCNN)
+        self.engine.from_char = ['á']
+        self.engine.to_char = ['a']
+        self.engine.max_labels = 6
+        self.engine.height = 8
+        self.engine.max_width = 20
+        self.engine.repair_model = 'repair'
+        self.engine.sessions = {}
+
+        rng = np.random.default_rng(0)
+        self.lines = [rng.integers(0, 256, size=(8, width, 3)).astype(np.uint8) for width in [5, 20, 12, 25, 1]]
+        self.transcriptions = ['ab', 'ábcdefgh', '', 'x', 'yz']
+
+    def expected_outputs(self):
+        return [(255 * np.clip(self.engine.clip_or_pad_image(line) / 255., 0, 1)).astype(np.uint8) for line in self.lines]
+
+    def assert_outputs(self, outputs):
+        self.assertEqual(len(outputs), len(self.lines))
+        for output, expected in zip(outputs, self.expected_outputs()):
+            self.assertEqual(output.dtype, np.uint8)
+            np.testing.assert_array_equal(output, expected)
+
+    def test_variable_batch_size(self):
+        session = StandInSession()
+        outputs = self.engine.run_batched(session, self.lines, self.transcriptions, batch_size=2)
+        self.assertEqual([feed['inference_content:0'].shape[0] for feed in session.feeds], [2, 2, 1])
+        self.assert_outputs(outputs)
+
+    def test_fixed_batch_size_pads_last_batch(self):
+        session = StandInSession(batch_size=4)
+        outputs = self.engine.run_batched(session, self.lines, self.transcriptions, batch_size=2)
+        self.assertEqual([feed['inference_content:0'].shape[0] for feed in session.feeds], [4, 4])
+        last_feed = session.feeds[-1]
+        self.assertFalse(last_feed['inference_content:0'][1:].any())
+        self.assertFalse(last_feed['inference_transcriptions:0'][1:].any())
+        self.assert_outputs(outputs)
+
+    def test_label_and_width_padding(self):
+        session = StandInSession()
+        self.engine.run_batched(session, self.lines, self.transcriptions)
+        feed = session.feeds[0]
+        np.testing.assert_array_equal(feed['inference_transcriptions:0'], [
+            [ord('a'), ord('b'), 0, 0, 0, 0],
+            [ord(c) for c in 'abcdef'],
+            [0] * 6,
+            [ord('x'), 0, 0, 0, 0, 0],
+            [ord('y'), ord('z'), 0, 0, 0, 0]])
+        self.assertEqual(feed['inference_transcriptions:0'].dtype, np.int32)
+
+        images = feed['inference_content:0']
+        self.assertEqual(images.shape, (5, 8, 20, 3))
+        np.testing.assert_allclose(images[0, :, :5], self.lines[0] / 255.)
+        self.assertFalse(images[0, :, 5:].any())
+        np.testing.assert_allclose(images[3], self.lines[3][:, :20] / 255.)
+        np.testing.assert_array_equal(feed['inference_style:0'], images)
+
+    def test_single_line_matches_batch(self):
+        self.engine.sessions['repair'] = StandInSession()
+        line = self.engine.repair_line(self.lines[0], self.transcriptions[0])
+        np.testing.assert_array_equal(line, self.engine.repair_lines(self.lines[:1], self.transcriptions[:1])[0])
+        np.testing.assert_array_equal(line, self.expected_outputs()[0])
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['tensorflow', 'torch', 'sklearn', 'pyamg', 'skimage', 'numba', 'matplotlib', 'hdbscan']
+# seconds, can be raised on slow machines
+IMPORT_BUDGET = float(os.environ.get('PERO_IMPORT_BUDGET', 3.0))
+
+
+def measure_import(module):
+    """Import module in a fresh interpreter.
+    :return: import time in seconds and names of all loaded modules
+    """
+    code = ('import json, sys, time\n'
+            't = time.perf_counter()\n'
+            f'import {module}\n'
+            'print(json.dumps({"time": time.perf_counter() - t, "modules": sorted(sys.modules)}))\n')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_ROOT, os.environ.get('PYTHONPATH', '')]))
+    result = subprocess.run([sys.executable, '-c', code], env=env, cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    measurement = json.loads(result.stdout.decode().strip().splitlines()[-1])
+    return measurement['time'], set(measurement['modules'])
+
+
+def loaded_heavy_modules(modules):
+    return sorted(name for name in HEAVY_MODULES if name in modules)
+
+
+class TestImportTime(unittest.TestCase):
+    def test_page_parser_defers_engines(self):
+        import_time, modules = measure_import('pero_ocr.document_ocr.page_parser')
+        self.assertEqual(loaded_heavy_modules(modules), [])
+        self.assertLess(import_time, IMPORT_BUDGET)
+
+    def test_layout_defers_engines(self):
+        import_time, modules = measure_import('pero_ocr.document_ocr.layout')
+        self.assertEqual(loaded_heavy_modules(modules), [])
+        self.assertLess(import_time, IMPORT_BUDGET)
+
+    def test_line_postprocessing_defers_engines(self):
+        _, modules = measure_import('pero_ocr.line_engine.line_postprocessing')
+        self.assertEqual(loaded_heavy_modules(modules), [])
@@ -0,0 +1,261 @@
+import threading
+import unittest
+
+import cv2
+import numpy as np
+import shapely
+from scipy import ndimage
+from scipy import signal
+from scipy.ndimage import binary_erosion
+from skimage.draw import polygon2mask
+
+from pero_ocr import parallel
+from pero_ocr.line_engine import line_postprocessing as pp
+from pero_ocr.line_engine.baseline_engine import EngineLineDetectorCNN, EngineLineDetectorSimple, first_uncovered_row, \
+    region_mask
+
+
+def text_page():
+    img = np.full((400, 300, 3), 255, dtype=np.uint8)
+    rng = np.random.default_rng(0)
+    for y in range(40, 360, 40):
+        for x in range(20, 280, 12):
+            height = rng.integers(12, 20)
+            img[y - height:y, x:x + 8] = 0
+    return img
+
+
+def random_text_page(rng):
+    img = np.full((rng.integers(300, 500), rng.integers(200, 400), 3), 255, dtype=np.uint8)
+    line_period = rng.integers(18, 50)
+    for y in range(rng.integers(20, 40), img.shape[0] - 10, line_period):
+        x = rng.integers(0, 20)
+        while x < img.shape[1]:
+            width = rng.integers(3, 12)
+            height = rng.integers(5, line_period)
+            descent = rng.integers(0, 6) if rng.random() < 0.2 else 0
+            img[max(0, y - height):y + descent, x:x + width] = rng.integers(0, 100)
+            x += width + rng.integers(1, 10)
+    noise = rng.random(img.shape[:2]) < 0.01
+    img[noise] = 0
+    return img
+
+
+def random_region(rng, img):
+    y1 = rng.integers(-20, img.shape[0] - 40)
+    x1 = rng.integers(-20, img.shape[1] - 40)
+    y2 = rng.integers(y1 + 20, img.shape[0] + 20)
+    x2 = rng.integers(x1 + 20, img.shape[1] + 20)
+    # corners of the bounding box moved outwards keep the region a valid polygon
+    shift = rng.integers(0, 16, size=(4, 2)) * np.array([[-1, -1], [-1, 1], [1, 1], [1, -1]])
+    corners = np.array([[y1, x1], [y1, x2], [y2, x2], [y2, x1]]) + shift
+    return np.clip(corners, 0, None)
+
+
+def row_search_detect_lines(engine, img, region):
+    """Previous implementation of EngineLineDetectorSimple.detect_lines with the mask of the whole page and
+    the search for line extents by intersecting every third row with the matching objects. The region is
+    rasterized by region_mask as in the current implementation.
+    """
+    baselines_list = []
+    heights_list = []
+
+    y1 = np.amin(region[:, 0].astype(np.int32))
+    y2 = np.amax(region[:, 0].astype(np.int32))
+    x1 = np.amin(region[:, 1].astype(np.int32))
+    x2 = np.amax(region[:, 1].astype(np.int32))
+
+    if y2 == y1 or x1 == x2:
+        return [], [], []
+
+    column_width = x2 - x1
+    column_height = y2 - y1
+
+    img_mask = region_mask(region, (0, 0), (y2 + 1, x2 + 1)).astype(bool)
+    img_mask = img_mask[y1:y2, x1:x2][:img.shape[0] - y1, :img.shape[1] - x1]
+    img_mask = binary_erosion(img_mask, structure=np.ones((1, 2 * engine.ignored_border_pixels + 1)))
+
+    img_crop = img[y1:y2, x1:x2, :]
+    img_crop = img_crop.mean(axis=2).astype(np.uint8)
+    img_crop = cv2.adaptiveThreshold(img_crop, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                     engine.block_size, engine.adaptive_threshold) == 0
+    img_crop = img_crop * img_mask
+
+    img_crop_labeled, num_features = ndimage.label(img_crop)
+    proj = np.sum(img_crop, axis=1)
+    corr = np.correlate(proj, proj, mode='full')[proj.shape[0]:]
+    corr_peaks = signal.find_peaks(corr, prominence=0, distance=1)[0]
+    line_period = float(corr_peaks[0]) if len(corr_peaks) > 0 else 1
+    target_signal = - np.diff(proj)
+    target_signal[target_signal < 0] = 0
+
+    baseline_coords = signal.find_peaks(target_signal, distance=int(round(0.85*line_period)))[0]
+    region = shapely.geometry.polygon.Polygon(region)
+    used_inds = []
+
+    for baseline_coord in baseline_coords[::-1]:
+        valid_baseline = True
+        matching_objects = np.unique(img_crop_labeled[baseline_coord-10, :])[1:]
+        if len(matching_objects) > 0:
+            for ind in matching_objects:
+                if ind in used_inds:
+                    valid_baseline = False
+                used_inds.append(ind)
+
+            for yb1 in range(baseline_coord, 0, -3):
+                if not np.any(np.intersect1d(matching_objects, img_crop_labeled[yb1, :])):
+                    break
+
+            for yb2 in range(baseline_coord, column_height, 3):
+                if not np.any(np.intersect1d(matching_objects, img_crop_labeled[yb2, :])):
+                    break
+
+            xb1, xb2 = 0, column_width
+
+            if yb2 - yb1 < engine.minimum_length:
+                valid_baseline = False
+
+            line = shapely.geometry.LineString([[y1+baseline_coord, x1+xb1-20], [y1+baseline_coord, x1+xb2+20]])
+            intersection = region.intersection(line)
+            if not intersection.is_empty and valid_baseline:
+                baselines_list.append(np.flip(np.round(np.asarray(list(intersection.coords[:]))).astype(np.int16), axis=1))
+                heights_list.append([baseline_coord-yb1, yb2-baseline_coord])
+
+    textlines_list = [pp.baseline_to_textline(baseline, heights) for baseline, heights in zip(baselines_list, heights_list)]
+
+    return baselines_list, heights_list, textlines_list
+
+
+class TestFirstUncoveredRow(unittest.TestCase):
+    def test_first_uncovered(self):
+        covered_rows = np.array([False, True, True, True, False, True, False])
+        self.assertEqual(first_uncovered_row(covered_rows, np.arange(6, 0, -1)), 6)
+        self.assertEqual(first_uncovered_row(covered_rows, np.arange(5, 0, -1)), 4)
+        self.assertEqual(first_uncovered_row(covered_rows, np.arange(2, 7, 2)), 4)
+
+    def test_all_covered_returns_last_row(self):
+        covered_rows = np.ones(10, dtype=bool)
+        self.assertEqual(first_uncovered_row(covered_rows, np.arange(8, 0, -3)), 2)
+
+
+class TestRegionMask(unittest.TestCase):
+    def test_differs_from_pixel_centers_only_at_outline(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            angles = np.sort(rng.random(rng.integers(3, 8))) * 2 * np.pi
+            radii = rng.random(len(angles)) * 60
+            region = np.stack([70 + radii * np.sin(angles), 90 + radii * np.cos(angles)], axis=1)
+            mask = region_mask(region, (0, 0), (140, 180))
+            differences = np.argwhere(mask.astype(bool) != polygon2mask((140, 180), region))
+            if len(differences) > 0:
+                distances = shapely.distance(shapely.points(differences), shapely.LinearRing(region))
+                self.assertLessEqual(distances.max(), 1.5)
+
+    def test_origin_and_clipping(self):
+        region = np.array([[10, 20], [10, 60], [50, 60], [50, 20]])
+        mask = region_mask(region, (30, 10), (10, 100))
+        self.assertEqual(mask.shape, (10, 100))
+        np.testing.assert_array_equal(np.flatnonzero(mask.any(axis=0)), np.arange(10, 51))
+        self.assertTrue(mask[:, 10:51].all())
+
+
+class TestLineDetectorSimple(unittest.TestCase):
+    def setUp(self):
+        self.engine = EngineLineDetectorSimple(block_size=21)
+        self.img = text_page()
+        self.regions = [
+            np.array([[10, 5], [10, 295], [390, 295], [390, 5]]),
+            np.array([[30, 10], [30, 150], [200, 150], [200, 10]]),
+            np.array([[300, 100], [300, 320], [450, 320], [450, 100]]),  # partially outside of the image
+        ]
+
+    def test_detects_text_lines(self):
+        baselines, heights, textlines = self.engine.detect_lines(self.img, self.regions[0])
+        self.assertEqual(len(baselines), 8)
+        self.assertEqual(len(textlines), 8)
+        for baseline, (height_up, height_down) in zip(baselines, heights):
+            self.assertTrue(np.all(baseline[:, 0] >= 5) and np.all(baseline[:, 0] <= 295))
+            self.assertGreater(height_up, 0)
+            self.assertGreaterEqual(height_down, 0)
+
+    def assert_lines_equal(self, lines, reference_lines):
+        baselines, heights, textlines = lines
+        reference_baselines, reference_heights, reference_textlines = reference_lines
+        self.assertEqual(heights, reference_heights)
+        self.assertEqual(len(baselines), len(reference_baselines))
+        for baseline, reference_baseline in zip(baselines, reference_baselines):
+            np.testing.assert_array_equal(baseline, reference_baseline)
+        for textline, reference_textline in zip(textlines, reference_textlines):
+            np.testing.assert_array_equal(textline, reference_textline)
+
+    def test_regions_match_row_search(self):
+        region_lines = self.engine.detect_lines_in_regions(self.img, self.regions)
+        self.assertEqual(len(region_lines), len(self.regions))
+        for region, lines in zip(self.regions, region_lines):
+            self.assert_lines_equal(lines, row_search_detect_lines(self.engine, self.img, region))
+
+    def test_threads_match_serial_detection(self):
+        executor = parallel._executor
+        parallel._executor = parallel.SharedExecutor(max_workers=3)
+        self.addCleanup(setattr, parallel, '_executor', executor)
+        self.addCleanup(parallel._executor.shutdown)
+
+        threads = set()
+        detect_lines = self.engine.detect_lines
+
+        def recording_detect_lines(img, region):
+            threads.add(threading.current_thread())
+            return detect_lines(img, region)
+
+        self.engine.detect_lines = recording_detect_lines
+        region_lines = self.engine.detect_lines_in_regions(self.img, self.regions)
+        self.assertNotIn(threading.current_thread(), threads)
+        for region, lines in zip(self.regions, region_lines):
+            self.assert_lines_equal(lines, detect_lines(self.img, region))
+
+    def test_random_pages_match_row_search(self):
+        rng = np.random.default_rng(1)
+        for page in range(10):
+            img = random_text_page(rng)
+            engine = EngineLineDetectorSimple(block_size=int(rng.choice([11, 21, 31])),
+                                              ignored_border_pixels=int(rng.integers(0, 12)))
+            for region in [random_region(rng, img) for _ in range(4)]:
+                with self.subTest(page=page, region=region.tolist()):
+                    self.assert_lines_equal(engine.detect_lines(img, region),
+                                            row_search_detect_lines(engine, img, region))
+
+    def test_empty_region(self):
+        self.assertEqual(self.engine.detect_lines(self.img, np.array([[10, 10], [10, 10], [10, 10]])), ([], [], []))
+
+
+class TestLineDetectorCNNDownsample(unittest.TestCase):
+    def setUp(self):
+        # engine without a model, single scale detection returns lines of a fixed text height in input pixels
+        self.engine = EngineLineDetectorCNN.__new__(EngineLineDetectorCNN)
+        self.engine.downsample = 4
+        self.estimations = []
+        self.detections = []
+        self.engine.estimate_downsample = lambda img: self.estimations.append(img.shape) or 4
+        self.engine.detect_lines_single_scale = self.detect_lines_single_scale
+        self.img = np.zeros((800, 600, 3), dtype=np.uint8)
+
+    def detect_lines_single_scale(self, img, downsample):
+        self.detections.append(downsample)
+        return [np.array([[10, 100], [500, 100]])], [[30, 10]], [np.zeros((4, 2))]
+
+    def test_pages_are_estimated_independently(self):
+        self.engine.detect_lines(self.img)
+        self.engine.detect_lines(self.img)
+        self.assertEqual(len(self.estimations), 2)
+        self.assertEqual(self.detections, [4, 4])
+
+    def test_known_downsample_skips_estimation(self):
+        baselines, heights, textlines, downsample = self.engine.detect_lines(self.img, 3, return_downsample=True)
+        self.assertEqual(self.estimations, [])
+        self.assertEqual(self.detections, [3])
+        self.assertEqual(downsample, 3)
+
+    def test_out_of_range_height_returns_corrected_downsample(self):
+        *_, downsample = self.engine.detect_lines(self.img, 1, return_downsample=True)
+        self.assertEqual(self.detections, [1, downsample])
+        self.assertEqual(downsample, 3)
@@ -0,0 +1,177 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from pero_ocr.line_engine import line_postprocessing as linepp
+
+
+def square(x, y, size):
+    return np.array([[x, y], [x + size, y], [x + size, y + size], [x, y + size]], dtype=np.float64)
+
+
+def line(x, y, length, height=10):
+    baseline = np.array([[x, y], [x + length / 2, y], [x + length, y]], dtype=np.float64)
+    textline = np.concatenate([baseline - [0, height], (baseline + [0, height / 4])[::-1]])
+    return baseline, textline
+
+
+class TestOptimalDownsample(unittest.TestCase):
+    def test_height_in_range_keeps_downsample(self):
+        self.assertEqual(linepp.optimal_downsample(40, 4), 4)
+        self.assertEqual(linepp.optimal_downsample(72, 4), 4)
+
+    def test_small_text_decreases_downsample(self):
+        self.assertEqual(linepp.optimal_downsample(20, 4), 2)
+        self.assertEqual(linepp.optimal_downsample(3, 4), 1)
+
+    def test_large_text_increases_downsample(self):
+        self.assertEqual(linepp.optimal_downsample(120, 4), 10)
+
+    def test_unknown_height_keeps_downsample(self):
+        self.assertEqual(linepp.optimal_downsample(np.nan, 3), 3)
+
+
+class TestMaskTextlinesByRegions(unittest.TestCase):
+    def test_matches_pairwise_masking(self):
+        rng = np.random.default_rng(0)
+        lines = [line(*rng.uniform(0, 1000, size=2), rng.uniform(10, 300)) for _ in range(200)]
+        baselines = [baseline for baseline, _ in lines]
+        textlines = [textline for _, textline in lines]
+        regions = [square(*rng.uniform(0, 1000, size=2), 250) for _ in range(10)]
+
+        masked = linepp.mask_textlines_by_regions(baselines, textlines, regions)
+
+        self.assertEqual(len(masked), len(regions))
+        for region, region_lines in zip(regions, masked):
+            expected = []
+            for line_num, (baseline, textline) in enumerate(lines):
+                baseline_is, textline_is = linepp.mask_textline_by_region(baseline, textline, region)
+                if baseline_is is not None:
+                    expected.append((line_num, baseline_is, textline_is))
+
+            self.assertEqual([l[0] for l in region_lines], [l[0] for l in expected])
+            for (_, baseline, textline), (_, expected_baseline, expected_textline) in zip(region_lines, expected):
+                self.assertTrue(np.allclose(baseline, expected_baseline))
+                self.assertTrue(np.allclose(np.sort(textline[:-1], axis=0), np.sort(expected_textline[:-1], axis=0)))
+
+    def test_covered_line_is_kept(self):
+        baseline, textline = line(10, 50, 100)
+        masked = linepp.mask_textlines_by_regions([baseline], [textline], [square(0, 0, 200)])
+        self.assertEqual(len(masked[0]), 1)
+        self.assertTrue(np.allclose(masked[0][0][1], baseline))
+
+    def test_line_is_clipped_by_region(self):
+        baseline, textline = line(150, 50, 100)
+        masked = linepp.mask_textlines_by_regions([baseline], [textline], [square(0, 0, 200)])
+        self.assertEqual(masked[0][0][1][:, 0].max(), 200)
+
+    def test_empty_inputs(self):
+        self.assertEqual(linepp.mask_textlines_by_regions([], [], [square(0, 0, 10)]), [[]])
+        self.assertEqual(linepp.mask_textlines_by_regions([line(0, 0, 10)[0]], [line(0, 0, 10)[1]], []), [])
+
+
+class TestPixelGroups(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.labels_img = rng.integers(0, 6, size=(40, 50))
+        self.values = rng.uniform(size=(40, 50))
+
+    def test_groups_match_labels(self):
+        rows, cols, offsets = linepp.label_pixel_groups(self.labels_img)
+        for label in range(1, 6):
+            group_rows = rows[offsets[label - 1]:offsets[label]]
+            group_cols = cols[offsets[label - 1]:offsets[label]]
+            expected_rows, expected_cols = np.nonzero(self.labels_img == label)
+            self.assertTrue(np.array_equal(group_rows, expected_rows))
+            self.assertTrue(np.array_equal(group_cols, expected_cols))
+
+    def test_group_percentile(self):
+        rows, cols, offsets = linepp.label_pixel_groups(self.labels_img)
+        percentiles = linepp.group_percentile(self.values[rows, cols], offsets, 70)
+        for label in range(1, 6):
+            self.assertAlmostEqual(percentiles[label - 1], np.percentile(self.values[self.labels_img == label], 70))
+
+    def test_group_baseline_points(self):
+        labels_img = np.zeros((10, 60), dtype=np.int32)
+        labels_img[5, 2:50] = 1
+        labels_img[4, 10:20] = 1
+        labels_img[2, 55:58] = 2
+        rows, cols, offsets = linepp.label_pixel_groups(labels_img)
+        points = linepp.group_baseline_points(rows, cols, offsets)
+
+        expected_columns = np.linspace(0, 47, 4).astype(np.int32) + 2
+        expected_rows = np.where((expected_columns >= 10) & (expected_columns < 20), 4, 5)
+        self.assertTrue(np.array_equal(points[0], np.stack([expected_columns, expected_rows], axis=1)))
+        self.assertTrue(np.array_equal(points[1], [[55, 2], [57, 2]]))
+        self.assertEqual(linepp.group_baseline_points(*linepp.label_pixel_groups(np.zeros((3, 3), dtype=np.int32))), [])
+
+
+class TestMergeLines(unittest.TestCase):
+    def test_overlapping_intervals(self):
+        rng = np.random.default_rng(0)
+        lower = rng.integers(0, 100, 50).astype(np.float64)
+        upper = lower + rng.integers(0, 15, 50)
+        first, second = linepp.overlapping_intervals(lower, upper)
+        pairs = {tuple(sorted(pair)) for pair in zip(first.tolist(), second.tolist())}
+        self.assertEqual(len(pairs), len(first))
+        expected_pairs = {(i, j) for i in range(50) for j in range(i + 1, 50)
+                          if min(upper[i], upper[j]) - max(lower[i], lower[j]) > 0}
+        self.assertEqual(pairs, expected_pairs)
+
+    def test_fragments_on_row_are_merged(self):
+        baselines = [line(0, 50, 40)[0], line(200, 100, 40)[0], line(60, 51, 40)[0], line(120, 50, 40)[0]]
+        heights = [[10, 4], [10, 4], [12, 3], [10, 4]]
+        merged_baselines, merged_heights = linepp.merge_lines(baselines, heights)
+
+        self.assertEqual(len(merged_baselines), 2)
+        np.testing.assert_allclose(merged_baselines[0], baselines[1], atol=1e-6)
+        self.assertEqual(merged_heights[0], [10, 4])
+        self.assertEqual(merged_baselines[1].shape, (9, 2))
+        self.assertTrue(np.all(np.diff(merged_baselines[1][:, 0]) >= 0))
+        self.assertEqual(merged_heights[1], [12, 4])
+
+    def test_contained_fragment_is_not_merged(self):
+        baselines = [line(0, 50, 300)[0], line(100, 50, 40)[0]]
+        merged_baselines, merged_heights = linepp.merge_lines(baselines, [[10, 4], [10, 4]])
+        self.assertEqual(len(merged_baselines), 2)
+        self.assertEqual(merged_heights, [[10, 4], [10, 4]])
+
+    def test_empty_input(self):
+        self.assertEqual(linepp.merge_lines([], []), ([], []))
+
+
+class TestBatchedGeometry(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.baselines = []
+        for length in [2, 3, 7, 20]:
+            xs = np.sort(rng.uniform(0, 2000, length))
+            self.baselines.append(np.stack([xs, 500 + 0.05 * xs + rng.normal(0, 2, length)], axis=1))
+        self.baselines.append(np.array([[100.0, 40.0], [100.0, 42.0], [100.0, 44.0]]))
+        self.heights = [[10, 4], [12.5, 3], [8, 2], [20, 6], [5, 5]]
+
+    def test_rotate_lines_matches_rotate_coords(self):
+        for baselines in [self.baselines, [np.round(baseline).astype(np.int16) for baseline in self.baselines]]:
+            for line, reference in zip(linepp.rotate_lines(baselines, 3.5, (0, 0)),
+                                       [linepp.rotate_coords(baseline, 3.5, (0, 0)) for baseline in baselines]):
+                self.assertEqual(line.dtype, reference.dtype)
+                self.assertTrue(np.array_equal(line, reference))
+        self.assertEqual(linepp.rotate_lines([], 3.5, (0, 0)), [])
+
+    def test_baselines_to_textlines(self):
+        textlines = linepp.baselines_to_textlines(self.baselines, self.heights)
+        self.assertEqual(len(textlines), len(self.baselines))
+        for textline, baseline, heights in zip(textlines, self.baselines, self.heights):
+            self.assertTrue(np.array_equal(textline, linepp.baseline_to_textline(baseline, heights)))
+
+    def test_resample_baselines_matches_polyfit(self):
+        resampled = linepp.resample_baselines(self.baselines, num_points=15)
+        for baseline, points in zip(self.baselines, resampled):
+            xs = np.linspace(np.amin(baseline[:, 0]), np.amax(baseline[:, 0]), 15)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                ys = np.poly1d(np.polyfit(baseline[:, 0], baseline[:, 1], 2))(xs)
+            np.testing.assert_allclose(points[:, 0], xs)
+            np.testing.assert_allclose(points[:, 1], ys, atol=1e-6)
+        self.assertEqual(linepp.resample_baselines([]), [])
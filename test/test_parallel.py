@@ -0,0 +1,94 @@
+import os
+import unittest
+
+import cv2
+
+from pero_ocr import parallel
+from pero_ocr.parallel import SharedExecutor, split_cores
+
+
+class TestModeSelection(unittest.TestCase):
+    def setUp(self):
+        self.executor = SharedExecutor(max_workers=4, serial_threshold=0.01, process_overhead=0.001)
+
+    def test_small_work_is_serial(self):
+        self.assertEqual(self.executor.choose_mode(3, cost=0.001, releases_gil=True), 'serial')
+
+    def test_single_item_is_serial(self):
+        self.assertEqual(self.executor.choose_mode(1, cost=10.0), 'serial')
+
+    def test_single_worker_is_serial(self):
+        executor = SharedExecutor(max_workers=1)
+        self.assertEqual(executor.choose_mode(100, cost=1.0, releases_gil=True), 'serial')
+
+    def test_gil_releasing_work_uses_threads(self):
+        self.assertEqual(self.executor.choose_mode(10, cost=0.01, releases_gil=True), 'thread')
+
+    def test_expensive_work_uses_processes(self):
+        self.assertEqual(self.executor.choose_mode(10, cost=0.01, transfer_cost=0.001), 'process')
+
+    def test_transfer_dominated_work_is_serial(self):
+        self.assertEqual(self.executor.choose_mode(10, cost=0.01, transfer_cost=0.02), 'serial')
+
+
+class TestMap(unittest.TestCase):
+    def setUp(self):
+        self.executor = SharedExecutor(max_workers=2, serial_threshold=0.0)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_pools_are_created_lazily(self):
+        self.executor.map(abs, [-1, -2], cost=0.0)
+        self.assertIsNone(self.executor._thread_pool)
+        self.assertIsNone(self.executor._process_pool)
+
+    def test_threads_keep_order(self):
+        self.assertEqual(self.executor.map(abs, range(-10, 0), cost=1.0, releases_gil=True), list(range(10, 0, -1)))
+        self.assertIsNotNone(self.executor._thread_pool)
+
+    def test_processes_keep_order(self):
+        self.assertEqual(self.executor.map(abs, range(-10, 0), cost=1.0), list(range(10, 0, -1)))
+        self.assertIsNotNone(self.executor._process_pool)
+
+    def test_nested_map_runs_serially(self):
+        def nested(item):
+            return self.executor.choose_mode(10, cost=1.0, releases_gil=True)
+
+        self.assertEqual(self.executor.map(nested, range(4), cost=1.0, releases_gil=True), ['serial'] * 4)
+
+
+class TestSplitCores(unittest.TestCase):
+    def test_cores_are_split_evenly(self):
+        self.assertEqual(split_cores(4, cores=16), [4, 4, 4, 4])
+
+    def test_remainder_goes_to_first_workers(self):
+        self.assertEqual(split_cores(3, cores=8), [3, 3, 2])
+
+    def test_each_worker_gets_a_thread(self):
+        self.assertEqual(split_cores(4, cores=2), [1, 1, 1, 1])
+
+
+class TestThreadBudget(unittest.TestCase):
+    def setUp(self):
+        self.environment = {variable: os.environ.get(variable) for variable in parallel.THREAD_ENVIRONMENT_VARIABLES}
+        self.cv2_threads = cv2.getNumThreads()
+
+    def tearDown(self):
+        parallel.set_thread_budget(None)
+        cv2.setNumThreads(self.cv2_threads)
+        for variable, value in self.environment.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+    def test_budget_is_applied(self):
+        parallel.set_thread_budget(2)
+        self.assertEqual(parallel.get_thread_budget(), 2)
+        self.assertEqual(cv2.getNumThreads(), 2)
+        self.assertEqual(os.environ['OMP_NUM_THREADS'], '2')
+
+    def test_no_budget_keeps_defaults(self):
+        parallel.set_thread_budget(None)
+        self.assertEqual(cv2.getNumThreads(), self.cv2_threads)
@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+from scipy import ndimage
+
+from pero_ocr.region_engine.region_engine import open_labels
+
+
+def reference_open_labels(labels, size):
+    labels_post = np.zeros((labels.shape[0], labels.shape[1], np.amax(labels)+1))
+    for i in range(1, np.amax(labels)+1):
+        labels_post[:, :, i] = labels == i
+    labels_post = ndimage.binary_erosion(labels_post, structure=np.ones((size, size, 1)))
+    labels_post = ndimage.binary_dilation(labels_post, structure=np.ones((size, size, 1)))
+    return np.argmax(labels_post, axis=2)
+
+
+class TestOpenLabels(unittest.TestCase):
+    def test_matches_dense_opening(self):
+        rng = np.random.default_rng(0)
+        labels = np.zeros((60, 50), dtype=np.int64)
+        for value in range(1, 30):
+            y, x = rng.integers(0, 55), rng.integers(0, 45)
+            height, width = rng.integers(2, 20, size=2)
+            labels[y:y + height, x:x + width] = value
+        labels[labels == 7] = 0  # unused label
+
+        for size in [3, 4, 5]:
+            np.testing.assert_array_equal(open_labels(labels, size), reference_open_labels(labels, size))
+
+    def test_small_labels_are_removed(self):
+        labels = np.zeros((20, 20), dtype=np.int64)
+        labels[2:4, 2:4] = 1
+        labels[8:18, 5:15] = 2
+        opened = open_labels(labels, 5)
+        self.assertFalse((opened == 1).any())
+        self.assertTrue((opened[8:18, 5:15] == 2).all())
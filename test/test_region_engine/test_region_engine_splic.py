@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+import shapely.geometry
+
+from pero_ocr.region_engine.region_engine_splic import EngineRegionSPLIC
+
+
+def reference_filter_polygons(polygon_coords_list, threshold=0.9):
+    polygons_list = [shapely.geometry.Polygon(coords) for coords in polygon_coords_list]
+    num_polys = len(polygons_list)
+    intersections = np.zeros((num_polys, num_polys))
+    for i in range(num_polys):
+        for j in range(num_polys):
+            if i != j:
+                if polygons_list[i].intersects(polygons_list[j]):
+                    intersections[i, j] = polygons_list[i].intersection(polygons_list[j]).area / polygons_list[i].area
+    scores = np.amax(intersections, axis=1)
+    return [polygon_coords_list[i] for i in np.where(scores < threshold)[0]]
+
+
+def box(x, y, width, height):
+    return list(shapely.geometry.box(x, y, x + width, y + height).exterior.coords)
+
+
+class TestFilterPolygons(unittest.TestCase):
+    def setUp(self):
+        # filter_polygons does not use the model, so no session is loaded
+        self.engine = EngineRegionSPLIC.__new__(EngineRegionSPLIC)
+
+    def test_contained_polygon_is_removed(self):
+        outer = box(0, 0, 100, 100)
+        inner = box(10, 10, 20, 20)
+        aside = box(200, 0, 50, 50)
+        self.assertEqual(self.engine.filter_polygons([outer, inner, aside]), [outer, aside])
+
+    def test_matches_pairwise_filtering(self):
+        rng = np.random.default_rng(0)
+        polygons = [box(*(rng.random(2) * 500), *(rng.random(2) * 100 + 5)) for _ in range(60)]
+        self.assertEqual(self.engine.filter_polygons(polygons), reference_filter_polygons(polygons))
+
+    def test_no_polygons(self):
+        self.assertEqual(self.engine.filter_polygons([]), [])
+
+    def test_zero_area_polygons_are_removed(self):
+        outer = box(0, 0, 100, 100)
+        isolated = [(300, 300), (400, 300), (350, 300)]
+        touching = [(10, 10), (50, 50), (30, 30)]
+        self.assertEqual(self.engine.filter_polygons([outer, isolated, touching]), [outer])
@@ -0,0 +1,37 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from pero_ocr.region_engine.simple_threshold_region_engine import SimpleThresholdRegion
+
+
+class TestSplitComponents(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        mask = np.zeros((300, 250), dtype=np.uint8)
+        for _ in range(300):
+            center = (int(rng.integers(-5, 250)), int(rng.integers(-5, 300)))
+            axes = (int(rng.integers(1, 6)), int(rng.integers(1, 4)))
+            cv2.ellipse(mask, center, axes, float(rng.integers(0, 180)), 0, 360, 1, -1)
+        _, self.labels, self.stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    def test_contours_match_whole_image(self):
+        components = SimpleThresholdRegion._split_components(self.labels, self.stats)
+        self.assertEqual(len(components), self.stats.shape[0] - 1)
+        for value, (component, offset) in enumerate(components, start=1):
+            contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+            reference, _ = cv2.findContours((self.labels == value).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                            cv2.CHAIN_APPROX_SIMPLE)
+            self.assertEqual(len(contours), len(reference))
+            np.testing.assert_array_equal(contours[0], reference[0])
+
+    def test_small_components_are_skipped(self):
+        components = SimpleThresholdRegion._split_components(self.labels, self.stats, min_point_per_component=20)
+        self.assertEqual(len(components), np.count_nonzero(self.stats[1:, cv2.CC_STAT_AREA] >= 20))
+        for component, _ in components:
+            self.assertGreaterEqual(np.count_nonzero(component), 20)
+
+    def test_crops_are_small(self):
+        for component, _ in SimpleThresholdRegion._split_components(self.labels, self.stats):
+            self.assertLess(component.size, self.labels.size // 10)
@@ -0,0 +1,110 @@
+import unittest
+
+import cv2
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import laplacian as csgraph_laplacian
+
+from pero_ocr.document_ocr.document_context import DocumentContext
+from pero_ocr.region_engine import spectral_clustering as sc
+
+
+def two_columns(height=40, width=30):
+    edge_img = np.zeros((height, width), dtype=np.float64)
+    for y in range(4, height - 4, 4):
+        cv2.line(edge_img, (2, y), (12, y), 1, 1)
+        cv2.line(edge_img, (17, y), (27, y), 1, 1)
+    edge_img[:, 14:16] = 1
+    return edge_img
+
+
+class TestImgToGraph(unittest.TestCase):
+    def test_matches_generic_graph(self):
+        rng = np.random.default_rng(0)
+        for shape in [(1, 1), (1, 5), (5, 1), (7, 9)]:
+            for dtype in [np.float64, np.float32]:
+                img = (rng.random(shape) * (rng.random(shape) > 0.5)).astype(dtype)
+                graph = sc.img_to_graph_2d(img)
+                reference = sc.to_graph(shape[0], shape[1], 1, img=img, return_as=sparse.csr_matrix)
+                self.assertEqual(graph.dtype, dtype)
+                self.assertEqual(graph.nnz, reference.nnz)
+                np.testing.assert_array_equal(graph.toarray(), reference.toarray())
+
+    def test_img_to_graph_uses_2d_builder(self):
+        img = two_columns()
+        graph = sc.img_to_graph(img)
+        self.assertTrue(sparse.isspmatrix_coo(graph))
+        np.testing.assert_array_equal(graph.toarray(), sc.img_to_graph_2d(img).toarray())
+
+    def test_template_is_shared(self):
+        self.assertIs(sc.grid_graph_template(6, 4), sc.grid_graph_template(6, 4))
+        graph = sc.img_to_graph_2d(np.zeros((6, 4)))
+        graph.indices[0] = 1
+        self.assertEqual(sc.grid_graph_template(6, 4)[1][0], 0)
+
+
+class TestSpectralEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.edge_img = two_columns()
+        self.adjacency = sc.img_to_graph(self.edge_img)
+
+    def test_embedding_matches_dense_solution(self):
+        edge_img = self.edge_img[:12, :10]
+        adjacency = sc.img_to_graph(edge_img)
+        embedding = sc.SpectralEmbeddingCache().embed(adjacency, edge_img.shape, n_components=2)
+
+        laplacian, dd = csgraph_laplacian(adjacency.toarray(), normed=True, return_diag=True)
+        _, eigenvectors = np.linalg.eigh(laplacian)
+        fiedler = eigenvectors[:, 1] / dd
+        correlation = np.corrcoef(embedding[:, 0], fiedler)[0, 1]
+        self.assertGreater(abs(correlation), 0.999)
+
+    def test_warm_start_from_same_graph(self):
+        cache = sc.SpectralEmbeddingCache()
+        cold = cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        cold_iterations = cache.stats['iterations']
+        self.assertFalse(cache.stats['warm_start'])
+
+        warm = cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        self.assertTrue(cache.stats['warm_start'])
+        self.assertLessEqual(cache.stats['iterations'], cold_iterations)
+        np.testing.assert_allclose(np.abs(warm[:, 0]), np.abs(cold[:, 0]), atol=1e-3 * np.abs(cold[:, 0]).max())
+
+    def test_initial_vectors_are_resized(self):
+        cache = sc.SpectralEmbeddingCache()
+        cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        self.assertEqual(cache.initial_vectors((50, 20)).shape, (1000, 6))
+
+    def test_component_count_change_starts_cold(self):
+        cache = sc.SpectralEmbeddingCache()
+        cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        embedding = cache.embed(self.adjacency, self.edge_img.shape, n_components=6)
+        self.assertFalse(cache.stats['warm_start'])
+        self.assertEqual(embedding.shape, (self.edge_img.size, 6))
+
+    def test_pages_of_document_keep_cache(self):
+        context = DocumentContext()
+        cache = sc.SpectralEmbeddingCache()
+        for page_size in [(1000, 800), (1000, 800)]:
+            context.begin_page(page_size)
+            cache.begin_page(context.document_id)
+            cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        self.assertTrue(cache.stats['warm_start'])
+
+    def test_new_document_and_independent_pages_start_cold(self):
+        context = DocumentContext()
+        context.begin_page((1000, 800))
+        cache = sc.SpectralEmbeddingCache()
+        cache.begin_page(context.document_id)
+        cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+
+        # page of a different size invalidates the context
+        context.begin_page((2000, 1600))
+        cache.begin_page(context.document_id)
+        self.assertIsNone(cache.initial_vectors(self.edge_img.shape))
+
+        cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        cache.begin_page(None)
+        self.assertIsNone(cache.initial_vectors(self.edge_img.shape))
+        cache.embed(self.adjacency, self.edge_img.shape, n_components=4)
+        self.assertFalse(cache.stats['warm_start'])
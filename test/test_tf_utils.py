@@ -0,0 +1,352 @@
+import contextlib
+import importlib
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import tensorflow
+    TENSORFLOW_1 = tensorflow.__version__.startswith('1.')
+except ImportError:
+    TENSORFLOW_1 = False
+
+
+class FakeTensor(object):
+    def __init__(self, name, dtype, shape):
+        self.name = name
+        self.dtype = types.SimpleNamespace(name=dtype)
+        self.shape = types.SimpleNamespace(ndims=None if shape is None else len(shape), as_list=lambda: list(shape))
+
+
+class FakeGraphDef(object):
+    def __init__(self, tensors=()):
+        self.tensors = list(tensors)
+
+    def SerializeToString(self):
+        return json.dumps(self.tensors).encode('utf8')
+
+    def ParseFromString(self, data):
+        self.tensors = json.loads(data.decode('utf8'))
+
+
+def fake_tensorflow():
+    """Minimal stand-in for the parts of the TensorFlow 1 API used by tf_utils. Graphs are lists of tensors,
+    sessions record their configuration, freezing records its arguments.
+    """
+    tf = types.ModuleType('tensorflow')
+    tf.__version__ = 'fake'
+    tf.calls = []
+    default_graphs = []
+
+    class Graph(object):
+        def __init__(self):
+            self.tensors = {}
+
+        def add_tensor(self, name, dtype, shape):
+            self.tensors[name] = FakeTensor(name, dtype, shape)
+
+        @contextlib.contextmanager
+        def as_default(self):
+            default_graphs.append(self)
+            try:
+                yield self
+            finally:
+                default_graphs.pop()
+
+        def get_tensor_by_name(self, name):
+            return self.tensors[name]
+
+        def as_graph_def(self):
+            return FakeGraphDef([[t.name, t.dtype.name, t.shape.as_list() if t.shape.ndims is not None else None]
+                                 for t in self.tensors.values()])
+
+    class Session(object):
+        def __init__(self, graph=None, config=None):
+            self.graph = graph
+            self.config = config
+
+    class Saver(object):
+        def restore(self, session, path):
+            tf.calls.append(('restore', path))
+
+    def import_meta_graph(path):
+        tf.calls.append(('import_meta_graph', path))
+        return Saver()
+
+    def import_graph_def(graph_def, name=''):
+        for tensor_name, dtype, shape in graph_def.tensors:
+            default_graphs[-1].add_tensor(tensor_name, dtype, shape)
+
+    def convert_variables_to_constants(session, graph_def, output_nodes):
+        tf.calls.append(('convert_variables_to_constants', output_nodes))
+        return graph_def
+
+    def remove_training_nodes(graph_def, protected_nodes=None):
+        tf.calls.append(('remove_training_nodes', protected_nodes))
+        return graph_def
+
+    class SparseTensor(object):
+        def __init__(self, indices, values, dense_shape):
+            self.indices, self.values, self.dense_shape = indices, values, dense_shape
+            self.graph = default_graphs[-1] if default_graphs else None
+
+    def ConfigProto(device_count=None):
+        return types.SimpleNamespace(device_count=device_count, gpu_options=types.SimpleNamespace(allow_growth=False),
+                                     intra_op_parallelism_threads=None, inter_op_parallelism_threads=None)
+
+    tf.Graph = Graph
+    tf.GraphDef = FakeGraphDef
+    tf.Session = Session
+    tf.SparseTensor = SparseTensor
+    tf.ConfigProto = ConfigProto
+    tf.import_graph_def = import_graph_def
+    tf.train = types.SimpleNamespace(import_meta_graph=import_meta_graph)
+    tf.graph_util = types.SimpleNamespace(convert_variables_to_constants=convert_variables_to_constants,
+                                          remove_training_nodes=remove_training_nodes)
+    return tf
+
+
+class TfUtilsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tf = fake_tensorflow()
+        modules = mock.patch.dict(sys.modules, {'tensorflow': self.tf})
+        modules.start()
+        self.addCleanup(modules.stop)
+        self.tf_utils = self.import_module('pero_ocr.tf_utils')
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_path = os.path.join(directory.name, 'model')
+
+    def import_module(self, name):
+        """Import module with the fake TensorFlow, it is removed from sys.modules again when the patch stops
+        and from attributes of its package by a cleanup.
+        """
+        package_name, _, module_name = name.rpartition('.')
+        package = importlib.import_module(package_name)
+        self.addCleanup(self.restore_package_attribute, package, module_name, package.__dict__.get(module_name))
+        sys.modules.pop(name, None)
+        return importlib.import_module(name)
+
+    @staticmethod
+    def restore_package_attribute(package, name, module):
+        if module is None:
+            package.__dict__.pop(name, None)
+        else:
+            setattr(package, name, module)
+
+    def touch(self, path, mtime):
+        with open(path, 'w'):
+            pass
+        os.utime(path, (mtime, mtime))
+
+    def model_graph(self):
+        graph = self.tf.Graph()
+        graph.add_tensor('input:0', 'float32', [None, 40, None, 3])
+        graph.add_tensor('seq_len:0', 'int32', None)
+        graph.add_tensor('probs:0', 'float32', [None, None, 10])
+        return self.tf.Session(graph=graph)
+
+
+class TestFrozenGraphPaths(TfUtilsTestCase):
+    def test_paths_next_to_checkpoint(self):
+        graph_path, metadata_path = self.tf_utils.frozen_graph_paths(self.model_path)
+        self.assertEqual(graph_path, self.model_path + '.frozen.pb')
+        self.assertEqual(metadata_path, self.model_path + '.frozen.json')
+
+    def test_missing_graph(self):
+        self.touch(self.model_path + '.index', 100)
+        self.assertFalse(self.tf_utils.has_frozen_graph(self.model_path))
+
+    def test_missing_metadata(self):
+        self.touch(self.model_path + '.frozen.pb', 200)
+        self.assertFalse(self.tf_utils.has_frozen_graph(self.model_path))
+
+    def test_graph_newer_than_checkpoint(self):
+        self.touch(self.model_path + '.index', 100)
+        self.touch(self.model_path + '.meta', 100)
+        self.touch(self.model_path + '.frozen.pb', 200)
+        self.touch(self.model_path + '.frozen.json', 50)
+        self.assertTrue(self.tf_utils.has_frozen_graph(self.model_path))
+
+    def test_checkpoint_newer_than_graph(self):
+        self.touch(self.model_path + '.index', 100)
+        self.touch(self.model_path + '.meta', 300)
+        self.touch(self.model_path + '.frozen.pb', 200)
+        self.touch(self.model_path + '.frozen.json', 200)
+        self.assertFalse(self.tf_utils.has_frozen_graph(self.model_path))
+
+    def test_graph_without_checkpoint(self):
+        self.touch(self.model_path + '.frozen.pb', 200)
+        self.touch(self.model_path + '.frozen.json', 200)
+        self.assertTrue(self.tf_utils.has_frozen_graph(self.model_path))
+
+
+class TestFrozenGraphExport(TfUtilsTestCase):
+    def test_metadata_round_trip(self):
+        graph_path = self.tf_utils.export_frozen_graph(
+            self.model_graph(), self.model_path, ['input:0', 'seq_len:0'], ['probs:0'], metadata={'net_subsampling': 4})
+        self.assertEqual(graph_path, self.model_path + '.frozen.pb')
+        self.assertIn(('convert_variables_to_constants', ['probs']), self.tf.calls)
+        self.assertIn(('remove_training_nodes', ['input', 'seq_len', 'probs']), self.tf.calls)
+
+        session, metadata = self.tf_utils.load_frozen_graph(self.model_path, use_cpu=True)
+        self.assertEqual(metadata['inputs'], {
+            'input:0': {'dtype': 'float32', 'shape': [None, 40, None, 3]},
+            'seq_len:0': {'dtype': 'int32', 'shape': None}})
+        self.assertEqual(metadata['outputs'], ['probs:0'])
+        self.assertEqual(metadata['net_subsampling'], 4)
+        self.assertEqual(metadata['tensorflow_version'], 'fake')
+        self.assertEqual(session.graph.get_tensor_by_name('probs:0').shape.as_list(), [None, None, 10])
+        self.assertEqual(session.config.device_count, {'GPU': 0})
+
+    def test_load_model_prefers_fresh_frozen_graph(self):
+        self.touch(self.model_path + '.index', 100)
+        self.touch(self.model_path + '.meta', 100)
+        session, metadata = self.tf_utils.load_model(self.model_path)
+        self.assertIsNone(metadata)
+        self.assertEqual(self.tf.calls, [('import_meta_graph', self.model_path + '.meta'),
+                                         ('restore', self.model_path)])
+
+        self.tf_utils.export_frozen_graph(self.model_graph(), self.model_path, ['input:0'], ['probs:0'])
+        del self.tf.calls[:]
+        session, metadata = self.tf_utils.load_model(self.model_path)
+        self.assertEqual(metadata['outputs'], ['probs:0'])
+        self.assertEqual(self.tf.calls, [])
+
+
+class TestSessionConfig(TfUtilsTestCase):
+    def test_explicit_threads(self):
+        config = self.tf_utils.session_config(use_cpu=True, intra_op_threads=3, inter_op_threads=2)
+        self.assertEqual(config.intra_op_parallelism_threads, 3)
+        self.assertEqual(config.inter_op_parallelism_threads, 2)
+
+    def test_limited_intra_threads_run_ops_sequentially(self):
+        config = self.tf_utils.session_config(intra_op_threads=4)
+        self.assertEqual(config.inter_op_parallelism_threads, 1)
+        self.assertTrue(config.gpu_options.allow_growth)
+
+
+class TestLineOCRFrozenGraph(TfUtilsTestCase):
+    def setUp(self):
+        super(TestLineOCRFrozenGraph, self).setUp()
+        self.import_module('pero_ocr.ocr_engine.CTC_nets')
+        self.line_ocr_engine = self.import_module('pero_ocr.ocr_engine.line_ocr_engine')
+
+    def engine(self):
+        engine = self.line_ocr_engine.EngineLineOCR.__new__(self.line_ocr_engine.EngineLineOCR)
+        engine.checkpoint = self.model_path
+        engine.net_name = 'net'
+        engine.intra_op_threads = None
+        engine.inter_op_threads = None
+        return engine
+
+    def test_export_and_load(self):
+        graph = self.tf.Graph()
+        for name, dtype, shape in [('input:0', 'uint8', [8, 40, None, 3]), ('seq_len:0', 'int32', [8]),
+                                   ('logits:0', 'float32', [8, None, 10]), ('decoded:0', 'int64', [None, 2]),
+                                   ('decoded:1', 'int64', [None]), ('decoded:2', 'int64', [2])]:
+            graph.add_tensor(name, dtype, shape)
+        engine = self.engine()
+        engine.session = self.tf.Session(graph=graph)
+        engine.input_data = graph.get_tensor_by_name('input:0')
+        engine.in_seq_len = graph.get_tensor_by_name('seq_len:0')
+        engine.out_logits = graph.get_tensor_by_name('logits:0')
+        engine.out_decoded = [self.tf.SparseTensor(*[graph.get_tensor_by_name(f'decoded:{i}') for i in range(3)])]
+        engine.net_subsampling = 4.0
+        engine.export_frozen_graph()
+
+        loaded = self.engine()
+        loaded.load_frozen_graph(use_cpu=True)
+        self.assertEqual(loaded.net_subsampling, 4.0)
+        self.assertEqual(loaded.input_data.name, 'input:0')
+        self.assertEqual(loaded.in_seq_len.name, 'seq_len:0')
+        self.assertEqual(loaded.out_logits.name, 'logits:0')
+        decoded = loaded.out_decoded[0]
+        self.assertEqual([decoded.indices.name, decoded.values.name, decoded.dense_shape.name],
+                         ['decoded:0', 'decoded:1', 'decoded:2'])
+        # the sparse tensor is rebuilt in the graph of the session
+        self.assertIs(decoded.graph, loaded.session.graph)
+        self.assertIsNone(loaded.saver)
+
+
+@unittest.skipUnless(TENSORFLOW_1, 'TensorFlow 1.x is not installed')
+class TestTensorFlowRoundTrip(unittest.TestCase):
+    """Export and load of real checkpoints, outputs of frozen graphs have to match the checkpoint sessions."""
+    def setUp(self):
+        import tensorflow as tf
+        from pero_ocr import tf_utils
+        self.tf = tf
+        self.tf_utils = tf_utils
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.model_path = os.path.join(directory.name, 'model')
+        self.rng = np.random.default_rng(0)
+
+    def save_checkpoint(self, build):
+        tf = self.tf
+        with tf.Graph().as_default():
+            tf.set_random_seed(0)
+            build()
+            saver = tf.train.Saver()
+            with tf.Session() as session:
+                session.run(tf.global_variables_initializer())
+                saver.save(session, self.model_path)
+
+    def test_load_model_round_trip(self):
+        tf = self.tf
+
+        def build():
+            data = tf.placeholder(tf.float32, [None, 5], name='input')
+            weights = tf.Variable(self.rng.normal(size=(5, 3)).astype(np.float32))
+            bias = tf.Variable(self.rng.normal(size=3).astype(np.float32))
+            tf.nn.softmax(tf.matmul(data, weights) + bias, name='probs')
+
+        self.save_checkpoint(build)
+        data = self.rng.normal(size=(7, 5)).astype(np.float32)
+
+        session, metadata = self.tf_utils.load_model(self.model_path, use_cpu=True)
+        self.assertIsNone(metadata)
+        expected = session.run('probs:0', feed_dict={'input:0': data})
+
+        self.tf_utils.export_frozen_graph(session, self.model_path, ['input:0'], ['probs:0'], metadata={'version': 1})
+        self.assertTrue(self.tf_utils.has_frozen_graph(self.model_path))
+        frozen_session, metadata = self.tf_utils.load_model(self.model_path, use_cpu=True)
+        self.assertEqual(metadata['version'], 1)
+        self.assertEqual(metadata['inputs'], {'input:0': {'dtype': 'float32', 'shape': [None, 5]}})
+        self.assertFalse(frozen_session.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES))
+        np.testing.assert_allclose(frozen_session.run('probs:0', feed_dict={'input:0': data}), expected, rtol=1e-6)
+
+    def test_line_ocr_round_trip(self):
+        from pero_ocr.ocr_engine.CTC_nets import build_eval_net, line_nets
+        from pero_ocr.ocr_engine.line_ocr_engine import EngineLineOCR
+
+        characters = ' abcdefgh'
+        net_name = 'NET_SIMPLE_BC_2_BLC_1_BFC_6'
+        self.save_checkpoint(lambda: build_eval_net([8, 40, None, 3], len(characters), line_nets[net_name]))
+        json_def = os.path.join(self.directory, 'ocr_engine.json')
+        with open(json_def, 'w', encoding='utf8') as f:
+            json.dump({'line_px_height': 40, 'line_vertical_scale': 1, 'checkpoint': 'model',
+                       'characters': list(characters), 'net_name': net_name}, f)
+        lines = [self.rng.integers(0, 256, size=(40, width, 3)).astype(np.uint8) for width in [50, 130, 90]]
+
+        engine = EngineLineOCR(json_def, gpu_id=None)
+        self.assertIsNotNone(engine.saver)
+        transcriptions, logits = engine.process_lines(lines)
+        engine.export_frozen_graph()
+
+        frozen_engine = EngineLineOCR(json_def, gpu_id=None)
+        self.assertIsNone(frozen_engine.saver)
+        self.assertEqual(frozen_engine.net_subsampling, engine.net_subsampling)
+        frozen_transcriptions, frozen_logits = frozen_engine.process_lines(lines)
+        self.assertEqual(frozen_transcriptions, transcriptions)
+        self.assertTrue(any(transcriptions))
+        for line_logits, frozen_line_logits in zip(logits, frozen_logits):
+            np.testing.assert_allclose(frozen_line_logits.toarray(), line_logits.toarray(), rtol=1e-4, atol=1e-4)
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy as np
+
+from pero_ocr.tiling import tile_starts, blend_weights, infer_tiled
+
+
+def mean_filter(batch):
+    # translation equivariant network with 2 px receptive field radius
+    padded = np.pad(batch, [(0, 0), (2, 2), (2, 2), (0, 0)], 'edge')
+    out = np.zeros_like(batch)
+    for dy in range(5):
+        for dx in range(5):
+            out += padded[:, dy:dy + batch.shape[1], dx:dx + batch.shape[2]]
+    return out / 25
+
+
+class TestTiles(unittest.TestCase):
+    def test_tiles_cover_dimension(self):
+        for size in [1, 63, 64, 65, 200, 1000]:
+            starts = tile_starts(size, 64, 16)
+            covered = np.zeros(size, dtype=bool)
+            for start in starts:
+                covered[start:start + 64] = True
+            self.assertTrue(covered.all())
+            self.assertEqual(starts[-1], max(0, size - 64))
+
+    def test_overlap_limited_to_half_of_tile(self):
+        self.assertEqual(tile_starts(200, 64, 64), list(range(0, 136, 32)) + [136])
+        self.assertEqual(tile_starts(200, 64, 100), tile_starts(200, 64, 32))
+
+    def test_blend_weights(self):
+        weights = blend_weights(10, 3, first=True, last=False)
+        self.assertTrue(np.all(weights[:7] == 1))
+        self.assertTrue(np.all(np.diff(weights[-4:]) < 0))
+        self.assertTrue(np.all(blend_weights(10, 3, first=True, last=True) == 1))
+
+
+class TestInferTiled(unittest.TestCase):
+    def test_identity_network(self):
+        img = np.random.uniform(0, 255, size=(300, 200, 3)).astype(np.float32)
+        out = infer_tiled(img, lambda batch: batch, tile_size=64, overlap=16, pad=8)
+        self.assertEqual(out.shape, img.shape)
+        self.assertTrue(np.allclose(out, img, atol=1e-3))
+
+    def test_context_matches_whole_image(self):
+        img = np.random.uniform(0, 1, size=(150, 170, 2)).astype(np.float32)
+        whole = mean_filter(img[np.newaxis])[0]
+        out = infer_tiled(img, mean_filter, tile_size=64, overlap=16, pad=8)
+        # tiles see zero context outside of the image instead of edge replication, compare the interior
+        self.assertTrue(np.allclose(out[2:-2, 2:-2], whole[2:-2, 2:-2], atol=1e-5))
+
+    def test_overlap_larger_than_tile(self):
+        calls = []
+
+        def network(batch):
+            calls.append(batch.shape)
+            return mean_filter(batch)
+
+        img = np.random.uniform(0, 1, size=(150, 170, 2)).astype(np.float32)
+        whole = mean_filter(img[np.newaxis])[0]
+        out = infer_tiled(img, network, tile_size=64, overlap=100, pad=8)
+        # overlap of 32 px, 4 x 5 tiles
+        self.assertEqual(len(calls), 20)
+        self.assertTrue(np.allclose(out[2:-2, 2:-2], whole[2:-2, 2:-2], atol=1e-5))
+
+    def test_small_image_is_single_tile(self):
+        calls = []
+
+        def network(batch):
+            calls.append(batch.shape)
+            return batch[..., :1]
+
+        img = np.ones((20, 30, 3), dtype=np.float32)
+        out = infer_tiled(img, network, tile_size=64, overlap=16, pad=4)
+        self.assertEqual(calls, [(1, 64, 64, 3)])
+        self.assertEqual(out.shape, (20, 30, 1))
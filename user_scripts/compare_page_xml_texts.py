@@ -10,15 +10,19 @@ from pero_ocr.document_ocr.layout import PageLayout
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--path1', help='First path with page xml files.', required=True)
-    parser.add_argument('--path2', help='Second path with page xml files.', required=True)
+    parser.add_argument('--path1', help='First path with page xml (or binary layout) files.', required=True)
+    parser.add_argument('--path2', help='Second path with page xml (or binary layout) files.', required=True)
     args = parser.parse_args()
     return args
 
 
 def read_page_xml(path):
     try:
-        page_layout = PageLayout(file=path)
+        if os.path.splitext(path)[1] == '.plb':
+            page_layout = PageLayout()
+            page_layout.from_binary(path)
+        else:
+            page_layout = PageLayout(file=path)
     except:
         print(f'Warning: unable to load page xml "{path}"')
         return None
@@ -53,8 +57,8 @@ def main():
     # initialize some parameters
     args = parse_arguments()
 
-    xml_to_process = set([f for f in os.listdir(args.path1) if os.path.splitext(f)[1] == '.xml'])
-    xml_to_process |= set([f for f in os.listdir(args.path2) if os.path.splitext(f)[1] == '.xml'])
+    xml_to_process = set([f for f in os.listdir(args.path1) if os.path.splitext(f)[1] in ['.xml', '.plb']])
+    xml_to_process |= set([f for f in os.listdir(args.path2) if os.path.splitext(f)[1] in ['.xml', '.plb']])
 
     total_char_sum = 0
     total_char_dist = 0
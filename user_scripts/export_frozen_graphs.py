@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+import configparser
+
+from pero_ocr.document_ocr.page_parser import PageParser
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Export frozen inference graphs of all TensorFlow models used by a page parser config. '
+                    'The graphs are stored next to the model checkpoints and loaded instead of them afterwards.')
+    parser.add_argument('-c', '--config', help='Path to page parser config file', required=True)
+    parser.add_argument('--repair-json', help='JSON definition of repair engine models to export as well.')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_arguments()
+    config_path = args.config
+
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # suppress tensorflow warnings on loading models
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    page_parser = PageParser(config, config_path=os.path.dirname(config_path))
+
+    engines = []
+    if page_parser.layout_parser is not None:
+        engines.append(getattr(page_parser.layout_parser, 'region_engine', None))
+    if page_parser.line_parser is not None:
+        engines.append(getattr(page_parser.line_parser, 'line_engine', None))
+    if page_parser.ocr is not None:
+        engines.append(page_parser.ocr.ocr_engine)
+    if args.repair_json:
+        from pero_ocr.document_ocr.repair_engine import EngineRepairCNN
+        engines.append(EngineRepairCNN(args.repair_json))
+
+    for engine in engines:
+        if engine is None or not hasattr(engine, 'export_frozen_graph'):
+            continue
+        paths = engine.export_frozen_graph()
+        for path in paths if isinstance(paths, list) else [paths]:
+            print(f'Exported {type(engine).__name__} to {path}')
+
+
+if __name__ == "__main__":
+    main()
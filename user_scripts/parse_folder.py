@@ -11,9 +11,15 @@ from typing import Set, List, Optional
 import traceback
 import sys
 import time
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from pero_ocr.document_ocr.layout import PageLayout
 from pero_ocr.document_ocr.page_parser import PageParser
+from pero_ocr.document_ocr.document_context import DocumentContext
+from pero_ocr import parallel
 
 
 
@@ -22,6 +28,16 @@ def parse_arguments():
     parser.add_argument('-c', '--config', help='Path to input config file', required=True)
     parser.add_argument('-s', '--skip-processed', help='If set, already processed files are skipped.', required=False,
                         action='store_true')
+    parser.add_argument('--workers', help='Number of worker processes, each with its own page parser.',
+                        type=int, default=1)
+    parser.add_argument('--threads-per-worker', help='Number of compute threads of each worker process '
+                        '(default: CPU count divided by the number of workers).', type=int)
+    parser.add_argument('--prefetch', help='Number of input pages read ahead by background threads '
+                        '(0 reads synchronously).', type=int, default=2)
+    parser.add_argument('--writer-threads', help='Number of background threads writing outputs '
+                        '(0 writes synchronously).', type=int, default=2)
+    parser.add_argument('--independent-pages', help='Do not share scale and layout priors between consecutive pages '
+                        '(use when the folder mixes unrelated documents).', action='store_true')
     args = parser.parse_args()
     return args
 
@@ -43,7 +59,7 @@ def load_already_processed_files_in_directory(directory: Optional[str]) -> Set[s
     already_processed = set()
 
     if directory is not None:
-        file_pattern = r"(.+?)(\.logits|\.xml|\.jpg)"
+        file_pattern = r"(.+?)(\.logits|\.xml|\.plb|\.jpg)"
         regex = re.compile(file_pattern)
 
         for file in os.listdir(directory):
@@ -78,9 +94,10 @@ class LMDB_writer(object):
         self.env_out = lmdb.open(path, map_size=gb100)
         self.data_size = 0
         self.file = open('dataset.ann', 'w')
+        self.lock = threading.Lock()
 
     def __call__(self, page_layout: PageLayout, file_id):
-        with self.env_out.begin(write=True) as txn_out:
+        with self.lock, self.env_out.begin(write=True) as txn_out:
             c_out = txn_out.cursor()
             all_lines = list(page_layout.lines_iterator())
             all_lines = sorted(all_lines, key=lambda x: x.id)
@@ -93,6 +110,194 @@ class LMDB_writer(object):
                     c_out.put(key.encode(), img)
 
 
+PATH_OPTIONS = ['INPUT_IMAGE_PATH', 'INPUT_XML_PATH', 'INPUT_BINARY_PATH', 'INPUT_LOGIT_PATH',
+                'OUTPUT_RENDER_PATH', 'OUTPUT_LINE_PATH', 'OUTPUT_XML_PATH', 'OUTPUT_BINARY_PATH', 'OUTPUT_LOGIT_PATH']
+
+
+def get_paths(config):
+    return dict((option.lower(), get_value_or_none(config, 'PARSE_FOLDER', option)) for option in PATH_OPTIONS)
+
+
+def read_inputs(file_id, image_file_name, paths):
+    if paths['input_image_path'] is not None:
+        image = cv2.imread(os.path.join(paths['input_image_path'], image_file_name), 1)
+        if image is None:
+            raise Exception(f'Unable to read image "{os.path.join(paths["input_image_path"], image_file_name)}"')
+    else:
+        image = None
+
+    if paths['input_xml_path']:
+        page_layout = PageLayout(file=os.path.join(paths['input_xml_path'], file_id + '.xml'))
+    elif paths['input_binary_path']:
+        page_layout = PageLayout()
+        page_layout.from_binary(os.path.join(paths['input_binary_path'], file_id + '.plb'))
+    else:
+        page_layout = PageLayout(id=file_id, page_size=(image.shape[0], image.shape[1]))
+
+    if paths['input_logit_path'] is not None:
+        page_layout.load_logits(os.path.join(paths['input_logit_path'], file_id + '.logits'))
+
+    return image, page_layout
+
+
+def write_outputs(file_id, image, page_layout, paths, lmdb_writer=None):
+    if paths['output_xml_path'] is not None:
+        page_layout.to_pagexml(os.path.join(paths['output_xml_path'], file_id + '.xml'))
+
+    if paths['output_binary_path'] is not None:
+        page_layout.to_binary(os.path.join(paths['output_binary_path'], file_id + '.plb'))
+
+    if paths['output_render_path'] is not None:
+        page_layout.render_to_image(image)
+        cv2.imwrite(os.path.join(paths['output_render_path'], file_id + '.jpg'), image, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
+
+    if paths['output_logit_path'] is not None:
+        page_layout.save_logits(os.path.join(paths['output_logit_path'], file_id + '.logits'))
+
+    if paths['output_line_path'] is not None:
+        if lmdb_writer:
+            lmdb_writer(page_layout, file_id)
+        else:
+            for region in page_layout.regions:
+                for line in region.lines:
+                    cv2.imwrite(
+                        os.path.join(paths['output_line_path'], f'{file_id}-{line.id}.jpg'),
+                        line.crop.astype(np.uint8),
+                        [int(cv2.IMWRITE_JPEG_QUALITY), 98])
+
+
+def process_file(page_parser, file_id, image_file_name, paths, lmdb_writer=None, document_context=None):
+    image, page_layout = read_inputs(file_id, image_file_name, paths)
+    page_layout = page_parser.process_page(image, page_layout, document_context=document_context)
+    write_outputs(file_id, image, page_layout, paths, lmdb_writer)
+
+
+def report_done(index, total, file_id, processing_time):
+    print("DONE {current}/{total} ({percentage:.2f} %) [id: {file_id}] Time:{time:.2f}".format(
+        current=index+1, total=total, percentage=(index+1)/total * 100,
+        file_id=file_id, time=processing_time))
+
+
+def report_error(file_id, error):
+    print(f'ERROR: Failed to process file {file_id}.')
+    print(error)
+
+
+def wait_for_write(file_id, write):
+    try:
+        write.result()
+    except Exception as e:
+        report_error(file_id, e)
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+
+def process_files(page_parser, paths, ids_to_process, images_to_process, lmdb_writer=None, prefetch=0, writer_threads=0,
+                  document_context=None):
+    """Process files in the current process. Input pages are read ahead by a pool of prefetch threads
+    and outputs are written by writer threads, so that image decoding and encoding overlap with parsing.
+    """
+    tasks = list(zip(ids_to_process, images_to_process))
+    reader = ThreadPoolExecutor(prefetch) if prefetch > 0 else None
+    writer = ThreadPoolExecutor(writer_threads) if writer_threads > 0 else None
+    reads = deque()
+    writes = deque()
+    next_read = 0
+
+    try:
+        for index, (file_id, image_file_name) in enumerate(tasks):
+            if reader is not None:
+                while next_read < len(tasks) and len(reads) <= prefetch:
+                    reads.append(reader.submit(read_inputs, *tasks[next_read], paths))
+                    next_read += 1
+
+            print("Processing {file_id}".format(file_id=file_id))
+            t1 = time.time()
+            try:
+                if reader is not None:
+                    image, page_layout = reads.popleft().result()
+                else:
+                    image, page_layout = read_inputs(file_id, image_file_name, paths)
+
+                page_layout = page_parser.process_page(image, page_layout, document_context=document_context)
+
+                if writer is not None:
+                    writes.append((file_id, writer.submit(write_outputs, file_id, image, page_layout, paths, lmdb_writer)))
+                    # limit the number of finished pages held in memory
+                    while len(writes) > 2 * writer_threads:
+                        wait_for_write(*writes.popleft())
+                else:
+                    write_outputs(file_id, image, page_layout, paths, lmdb_writer)
+            except KeyboardInterrupt:
+                traceback.print_exc()
+                print('Terminated by user.')
+                sys.exit()
+            except Exception as e:
+                report_error(file_id, e)
+                traceback.print_exc()
+            report_done(index, len(tasks), file_id, time.time() - t1)
+
+        while writes:
+            wait_for_write(*writes.popleft())
+    finally:
+        if reader is not None:
+            reader.shutdown(wait=False)
+        if writer is not None:
+            writer.shutdown()
+
+
+# page parser, paths and document context of a worker process, created by init_worker
+worker_state = None
+
+
+def init_worker(config_path, paths, threads, independent_pages=False):
+    global worker_state
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    # thread budget of the worker overrides the one of the config, which is meant for a single process
+    config['PAGE_PARSER']['NUM_THREADS'] = str(threads)
+    config['PAGE_PARSER']['MAX_WORKERS'] = str(threads)
+    page_parser = PageParser(config, config_path=os.path.dirname(config_path))
+    document_context = None if independent_pages else DocumentContext()
+    worker_state = (page_parser, paths, document_context)
+
+
+def run_worker(task):
+    """Process a single file in a worker process. Errors are returned instead of raised,
+    so that a failing file does not stop the other workers.
+    """
+    file_id, image_file_name = task
+    page_parser, paths, document_context = worker_state
+    t1 = time.time()
+    try:
+        process_file(page_parser, file_id, image_file_name, paths, document_context=document_context)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return error, time.time() - t1
+
+
+def process_files_in_workers(config_path, paths, ids_to_process, images_to_process, workers, threads,
+                             independent_pages=False):
+    # must be set before worker processes import numerical libraries
+    parallel.set_thread_environment(threads)
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(workers, initializer=init_worker, initargs=(config_path, paths, threads, independent_pages))
+    try:
+        # imap yields results in submission order while workers take tasks from a shared queue
+        results = pool.imap(run_worker, zip(ids_to_process, images_to_process), chunksize=1)
+        for index, (file_id, (error, processing_time)) in enumerate(zip(ids_to_process, results)):
+            if error is not None:
+                report_error(file_id, error)
+            report_done(index, len(ids_to_process), file_id, processing_time)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print('Terminated by user.')
+        sys.exit()
+    finally:
+        pool.join()
+
+
 def main():
     # initialize some parameters
     args = parse_arguments()
@@ -104,114 +309,73 @@ def main():
     config = configparser.ConfigParser()
     config.read(config_path)
 
-    page_parser = PageParser(config, config_path=os.path.dirname(config_path))
-
-    input_image_path = get_value_or_none(config, 'PARSE_FOLDER', 'INPUT_IMAGE_PATH')
-    input_xml_path = get_value_or_none(config, 'PARSE_FOLDER', 'INPUT_XML_PATH')
-    input_logit_path = get_value_or_none(config, 'PARSE_FOLDER', 'INPUT_LOGIT_PATH')
-
-    output_render_path = get_value_or_none(config, 'PARSE_FOLDER', 'OUTPUT_RENDER_PATH')
-    output_line_path = get_value_or_none(config, 'PARSE_FOLDER', 'OUTPUT_LINE_PATH')
-    output_xml_path = get_value_or_none(config, 'PARSE_FOLDER', 'OUTPUT_XML_PATH')
-    output_logit_path = get_value_or_none(config, 'PARSE_FOLDER', 'OUTPUT_LOGIT_PATH')
+    paths = get_paths(config)
 
-    if output_line_path is not None and 'lmdb' in output_line_path:
-        lmdb_writer = LMDB_writer(output_line_path)
+    if paths['output_line_path'] is not None and 'lmdb' in paths['output_line_path']:
+        if args.workers > 1:
+            raise Exception('LMDB line output is not supported with multiple workers.')
+        lmdb_writer = LMDB_writer(paths['output_line_path'])
     else:
         lmdb_writer = None
 
-    if output_render_path is not None:
-        create_dir_if_not_exists(output_render_path)
-    if output_line_path is not None:
-        create_dir_if_not_exists(output_line_path)
-    if output_xml_path is not None:
-        create_dir_if_not_exists(output_xml_path)
-    if output_logit_path is not None:
-        create_dir_if_not_exists(output_logit_path)
-
-    if input_logit_path is not None and input_xml_path is None:
-        input_logit_path = None
-        print('Warning: Logit path specified and Page XML path not specified. Logits will be ignored.')
-
-    if input_image_path is not None:
-        print(f'Reading images from {input_image_path}.')
-        images_to_process = [f for f in os.listdir(input_image_path) if
+    for option in ['output_render_path', 'output_line_path', 'output_xml_path', 'output_binary_path', 'output_logit_path']:
+        if paths[option] is not None:
+            create_dir_if_not_exists(paths[option])
+
+    if paths['input_xml_path'] is not None and paths['input_binary_path'] is not None:
+        paths['input_binary_path'] = None
+        print('Warning: Both Page XML path and binary layout path specified. Binary layouts will be ignored.')
+
+    if paths['input_logit_path'] is not None and paths['input_xml_path'] is None and paths['input_binary_path'] is None:
+        paths['input_logit_path'] = None
+        print('Warning: Logit path specified and neither Page XML nor binary layout path specified. Logits will be ignored.')
+
+    if paths['input_image_path'] is not None:
+        print(f'Reading images from {paths["input_image_path"]}.')
+        images_to_process = [f for f in sorted(os.listdir(paths['input_image_path'])) if
                              os.path.splitext(f)[1].lower() in ['.jpg', '.jpeg', '.png', '.tif']]
         ids_to_process = [os.path.splitext(os.path.basename(file))[0] for file in images_to_process]
-    elif input_xml_path is not None:
-        print(f'Reading page xml from {input_xml_path}')
-        xml_to_process = [f for f in os.listdir(input_xml_path) if
+    elif paths['input_xml_path'] is not None:
+        print(f'Reading page xml from {paths["input_xml_path"]}')
+        xml_to_process = [f for f in sorted(os.listdir(paths['input_xml_path'])) if
                           os.path.splitext(f)[1] == '.xml']
         images_to_process = [None] * len(xml_to_process)
         ids_to_process = [os.path.splitext(os.path.basename(file))[0] for file in xml_to_process]
+    elif paths['input_binary_path'] is not None:
+        print(f'Reading binary layouts from {paths["input_binary_path"]}')
+        binary_to_process = [f for f in sorted(os.listdir(paths['input_binary_path'])) if
+                             os.path.splitext(f)[1] == '.plb']
+        images_to_process = [None] * len(binary_to_process)
+        ids_to_process = [os.path.splitext(os.path.basename(file))[0] for file in binary_to_process]
     else:
         raise Exception(
-            f'Either INPUT_IMAGE_PATH or INPUT_XML_PATH has to be specified. Both are missing in {config_path}.')
+            f'One of INPUT_IMAGE_PATH, INPUT_XML_PATH or INPUT_BINARY_PATH has to be specified. All are missing in {config_path}.')
 
     if skip_already_processed_files:
         # Files already processed are skipped. File is considered as already processed when file with appropriate
         # extension is found in all required output directories. If any of the output paths is set to 'None'
         # (i.e. the output is not required) than this directory is omitted.
-        already_processed_files = load_already_processed_files([output_xml_path, output_logit_path, output_render_path])
+        already_processed_files = load_already_processed_files([
+            paths['output_xml_path'], paths['output_binary_path'], paths['output_logit_path'], paths['output_render_path']])
         if len(already_processed_files) > 0:
             print(f"Already processed {len(already_processed_files)} file(s).")
 
             images_to_process = [image for id, image in zip(ids_to_process, images_to_process) if id not in already_processed_files]
             ids_to_process = [id for id in ids_to_process if id not in already_processed_files]
 
-    for index, (file_id, image_file_name) in enumerate(zip(ids_to_process, images_to_process)):
-        print("Processing {file_id}".format(file_id=file_id))
-        t1 = time.time()
-        try:
-            if input_image_path is not None:
-                image = cv2.imread(os.path.join(input_image_path, image_file_name), 1)
-                if image is None:
-                    raise Exception(f'Unable to read image "{os.path.join(input_image_path, image_file_name)}"')
-            else:
-                image = None
-
-            if input_xml_path:
-                page_layout = PageLayout(file=os.path.join(input_xml_path, file_id + '.xml'))
-            else:
-                page_layout = PageLayout(id=file_id, page_size=(image.shape[0], image.shape[1]))
-
-            if input_logit_path is not None:
-                page_layout.load_logits(os.path.join(input_logit_path, file_id + '.logits'))
+    if args.workers > 1:
+        threads = args.threads_per_worker
+        if threads is None:
+            # all workers share the initializer arguments, so the smallest share is used
+            threads = min(parallel.split_cores(args.workers))
+        process_files_in_workers(config_path, paths, ids_to_process, images_to_process, args.workers, threads,
+                                 independent_pages=args.independent_pages)
+        return
 
-            page_layout = page_parser.process_page(image, page_layout)
-
-            if output_xml_path is not None:
-                page_layout.to_pagexml(os.path.join(output_xml_path, file_id + '.xml'))
-
-            if output_render_path is not None:
-                page_layout.render_to_image(image)
-                cv2.imwrite(os.path.join(output_render_path, file_id + '.jpg'), image, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-
-            if output_logit_path is not None:
-                page_layout.save_logits(os.path.join(output_logit_path, file_id + '.logits'))
-
-            if output_line_path is not None:
-                if lmdb_writer:
-                    lmdb_writer(page_layout, file_id)
-                else:
-                    for region in page_layout.regions:
-                        for line in region.lines:
-                            cv2.imwrite(
-                                os.path.join(output_line_path, f'{file_id}-{line.id}.jpg'),
-                                line.crop.astype(np.uint8),
-                                [int(cv2.IMWRITE_JPEG_QUALITY), 98])
-
-        except KeyboardInterrupt:
-            traceback.print_exc()
-            print('Terminated by user.')
-            sys.exit()
-        except Exception as e:
-            print(f'ERROR: Failed to process file {file_id}.')
-            print(e)
-            traceback.print_exc()
-        print("DONE {current}/{total} ({percentage:.2f} %) [id: {file_id}] Time:{time:.2f}".format(
-            current=index+1, total=len(ids_to_process), percentage=(index+1)/len(ids_to_process) * 100,
-            file_id=file_id, time=time.time() - t1))
+    page_parser = PageParser(config, config_path=os.path.dirname(config_path))
+    document_context = None if args.independent_pages else DocumentContext()
+    process_files(page_parser, paths, ids_to_process, images_to_process, lmdb_writer,
+                  prefetch=args.prefetch, writer_threads=args.writer_threads, document_context=document_context)
 
 
 if __name__ == "__main__":
@@ -157,9 +157,12 @@ def main():
     cv2.resizeWindow('Page Editor', 1024, 1024)
     layout_clicker = LayoutClicker(page_layout)
     cv2.setMouseCallback("Page Editor", layout_clicker.callback)
+    flagged_lines = [] # lines repaired together by 'a', (un)flagged by 'f'
 
     while True:
         page_img_rendered = page_img.copy()
+        if flagged_lines:
+            page_img_rendered = layout.draw_lines(page_img_rendered, [line.polygon for line in flagged_lines], color=(0,165,255), close=True)
         if layout_clicker.chosen_line:
             page_img_rendered = layout.draw_lines(page_img_rendered, [layout_clicker.chosen_line.polygon], color=(0,255,0), close=True)
         if layout_clicker.points:
@@ -195,6 +198,21 @@ def main():
                 page_img = crop_engine.blend_in(page_img, line_crop, line_mapping, offset)
                 page_img_rendered = page_img.copy()
 
+        elif key == ord('f') and layout_clicker.chosen_line:
+            if layout_clicker.chosen_line in flagged_lines:
+                flagged_lines.remove(layout_clicker.chosen_line)
+            else:
+                flagged_lines.append(layout_clicker.chosen_line)
+
+        elif key == ord('a') and flagged_lines:
+            crops = [crop_engine.crop(page_img, line.baseline, line.heights, return_mapping=True) for line in flagged_lines]
+            repaired_crops = repair_engine.repair_lines([line_crop for line_crop, _, _ in crops],
+                                                        [line.transcription for line in flagged_lines])
+            for line_crop, (_, line_mapping, offset) in zip(repaired_crops, crops):
+                page_img = crop_engine.blend_in(page_img, line_crop, line_mapping, offset)
+            print('Repaired {} flagged lines.'.format(len(flagged_lines)))
+            flagged_lines = []
+
         elif key == ord('e') and len(layout_clicker.points)==2:
             line_crop, line_mapping, offset = crop_engine.crop(
                         page_img,